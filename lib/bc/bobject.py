@@ -11,72 +11,166 @@
 
 __version__ = '1.0'
 
+import operator
+import itertools
+
+_setattr = object.__setattr__
+
+
+def _type_error(name, typ, value):
+	return TypeError("Type of {0} is {1}, not {2}".format(name, typ, type(value)))
+
+
+def _to_long(name, value):
+	if not isinstance(value, (int, long)):
+		raise _type_error(name, long, value)
+	return long(value)
+
+
+def _to_unicode(name, value):
+	if not isinstance(value, basestring):
+		raise _type_error(name, unicode, value)
+	return unicode(value)
+
+
+def _to_type(typ):
+	def convert(name, value):
+		if not isinstance(value, typ):
+			raise _type_error(name, typ, value)
+		return value
+	return convert
+
+
+def converter(default):
+	"""Returns converter of the field values by the type of default value"""
+
+	if isinstance(default, (int, long)):
+		return _to_long
+	if isinstance(default, basestring):
+		return _to_unicode
+	return _to_type(type(default))
+
+
+def _getter(names):
+	get = operator.attrgetter(*names)
+
+	# attrgetter of one name returns the value itself.
+	if len(names) == 1:
+		return lambda o: (get(o),)
+	return get
+
+
+class metaClass(type):
+	"""Generates model class from the list of fields
+
+	The class declares '__fields__' as a list of (name, default) pairs.
+	The default is a value or a callable which returns a value. The type
+	of default value defines the type of the field.
+
+	Fields are stored in slots. The converters of the fields and the
+	function which fills defaults are made once for the class.
+	"""
+
+	def __new__(cls, cname, bases, cdict):
+		fields = cdict.get('__fields__')
+
+		if not fields:
+			cdict.setdefault('__slots__', ())
+			return type.__new__(cls, cname, bases, cdict)
+
+		names = [ n for n, d in fields ]
+
+		cdict['__slots__']      = tuple(names)
+		cdict['__columns__']    = sorted(names)
+		cdict['__getvalues__']  = staticmethod(_getter(names))
+		cdict['__converters__'] = {}
+
+		ns = { '_setattr': _setattr }
+		code = [ "def __initvalues__(self):" ]
+
+		for i, (n, d) in enumerate(fields):
+			if callable(d):
+				conv = converter(d())
+				code.append("\t_setattr(self, {0!r}, _d{1}())".format(n, i))
+			else:
+				conv = converter(d)
+				d = conv(n, d)
+				code.append("\t_setattr(self, {0!r}, _d{1})".format(n, i))
+
+			cdict['__converters__'][n] = conv
+			ns['_d' + str(i)] = d
+
+		exec "\n".join(code) in ns
+		cdict['__initvalues__'] = ns['__initvalues__']
+
+		return type.__new__(cls, cname, bases, cdict)
+
+
 class BaseObject(object):
-	__values__ = {}
-	__getter__ = {}
-	__setter__ = {}
+	__metaclass__  = metaClass
+	__fields__     = []
+	__converters__ = {}
 
-	def set(self, o):
-		h = self.__setter__
+	def __init__(self, data = None):
+		self.__initvalues__()
+		if data:
+			self.set(data)
 
-		for n in self.__values__.keys():
-			if n not in o:
-				continue
 
-			if h and n in h:
-				h[n](n, o[n])
-				continue
+	@classmethod
+	def columns(cls):
+		"""Returns sorted list of the object fields"""
 
-			if o[n] == None:
-				continue
+		return cls.__columns__
 
-			self.__assign(n, o[n])
 
-		return self
+	@classmethod
+	def from_row(cls, row):
+		"""Creates object from the database row
 
+		The row is a tuple of values in the order of columns(). Values are
+		converted as set() does but without checks.
+		"""
+		o = cls()
 
-	def __getattr__(self, name):
-		if name == 'values':
-			return self.__values__
+		for n, x in itertools.izip(cls.__columns__, row):
+			if x == None:
+				continue
+			if isinstance(x, str):
+				x = unicode(x)
+			elif isinstance(x, int):
+				x = long(x)
+			_setattr(o, n, x)
 
-		o = self.__values__
-		h = self.__getter__
+		return o
 
-		if name not in o:
-			raise KeyError
 
-		if h and name in h:
-			return h[name](name)
+	@property
+	def values(self):
+		return dict(itertools.izip(self.__slots__, self.__getvalues__(self)))
 
-		return o[name]
 
+	def set(self, o):
+		conv = self.__converters__
 
-	def __setattr__(self, name, value):
-		if name == '__values__':
-			if '__values__' not in self.__dict__:
-				self.__dict__['__values__'] = {}
-			for k,v in value.iteritems():
-				if isinstance(v, int):
-					self.__dict__['__values__'][k] = long(v)
-				else:
-					self.__dict__['__values__'][k] = v
-			return
+		for n, v in o.iteritems():
+			if v == None or n not in conv:
+				continue
+			_setattr(self, n, conv[n](n, v))
 
-		if name in ['__getter__', '__setter__']:
-			self.__dict__[name] = value
-			return
+		return self
 
-		o = self.__values__
-		h = self.__setter__
 
-		if name not in o:
-			raise KeyError
+	def __getattr__(self, name):
+		# Called only for unknown attributes.
+		raise KeyError(name)
 
-		if h and name in h:
-			h[name](name, value)
-			return
 
-		self.__assign(name, value)
+	def __setattr__(self, name, value):
+		conv = self.__converters__.get(name)
+		if not conv:
+			raise KeyError(name)
+		_setattr(self, name, conv(name, value))
 
 
 	def __delattr__(self, name):
@@ -88,32 +182,16 @@ class BaseObject(object):
 
 
 	def __eq__(self, over):
+		if not isinstance(over, BaseObject):
+			return NotImplemented
 		return self.values == over.values
 
 
 	def __ne__(self, over):
+		if not isinstance(over, BaseObject):
+			return NotImplemented
 		return self.values != over.values
 
 
 	def __hash__(self):
-		return hash((self.values[key] for key in sorted(self.values.iterkeys())))
-
-
-	def __assign(self, name, value, check=True):
-		o = self.__values__
-
-		if check:
-			t = typ = type(o[name])
-
-			if typ in [ int, long ]: t = (int,long)
-			elif typ == unicode:     t = (basestring,unicode)
-
-			if not isinstance(value, t):
-				raise TypeError("Type of {0} is {1}, not {2}".format(name, typ, type(value)))
-
-		if isinstance(value, int):
-			o[name] = long(value)
-		elif isinstance(value, str):
-			o[name] = unicode(value)
-		else:
-			o[name] = value
+		return hash(self.__getvalues__(self))
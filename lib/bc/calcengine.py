@@ -0,0 +1,368 @@
+#
+# calcengine.py
+#
+# Copyright (c) 2012-2013 by Alexey Gladkov
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+import time
+import logging
+import itertools
+
+from bc import config
+from bc import database
+from bc import polinomial
+
+from bc import bills
+from bc import rates
+from bc import tasks
+from bc import metrics
+from bc import calculate_bulk
+from bc import customers
+
+LOG = logging.getLogger("calcengine")
+
+MODE_CLIENT   = 'client'
+MODE_DATABASE = 'database'
+
+# Columns of the tasks used by the calculation.
+TASK_FIELDS = [
+	'task_id', 'base_id', 'queue_id', 'customer', 'metric_id',
+	'rate_id', 'rate', 'value', 'state', 'time_destroy',
+]
+
+# Per-customer sums of the group are computed by the server. Queue items are
+# locked and advanced and deleted tasks are marked in the same statement.
+# Items locked by someone else are skipped until the next pass, they are
+# counted by 'selected' (one row with NULL customer if none is locked).
+SQL_GROUP_SUMMARY = """
+WITH selected AS (
+	SELECT COUNT(*) AS selected
+	FROM tasks t
+	JOIN queue q ON q.id = t.queue_id
+	JOIN (VALUES {metrics}) AS m(id, formula) ON m.id = t.metric_id
+	WHERE t.group_id = %(group_id)s AND t.state = %(state)s AND t.rate_id != ''
+),
+items AS (
+	SELECT t.task_id, t.customer, t.state, t.rate, t.value, t.time_destroy,
+	       q.id AS queue_id, q.time_check, m.formula
+	FROM tasks t
+	JOIN queue q ON q.id = t.queue_id
+	JOIN (VALUES {metrics}) AS m(id, formula) ON m.id = t.metric_id
+	WHERE t.group_id = %(group_id)s AND t.state = %(state)s AND t.rate_id != ''
+	FOR UPDATE OF q SKIP LOCKED
+),
+advance AS (
+	UPDATE queue SET time_check = %(now)s
+	FROM items WHERE queue.id = items.queue_id
+),
+processed AS (
+	UPDATE tasks SET state = %(processed)s
+	FROM items WHERE tasks.task_id = items.task_id AND items.state = %(deleted)s
+),
+costs AS (
+	SELECT customer,
+	       CASE
+	         WHEN rate = 0              THEN 0
+	         WHEN formula = %(speed)s   THEN rate::numeric * delta * value
+	         WHEN formula = %(time)s    THEN rate::numeric * delta
+	         WHEN formula = %(unit)s    THEN rate::numeric * value
+	       END AS cost
+	FROM (
+		SELECT *,
+		       CASE WHEN time_destroy > 0
+		            THEN time_destroy - time_check
+		            ELSE %(now)s - time_check
+		       END AS delta
+		FROM items
+	) AS i
+)
+SELECT g.*, s.selected
+FROM selected s
+LEFT JOIN (
+	SELECT customer, SUM(cost) AS cost, BOOL_OR(cost != 0) AS payable, COUNT(*) AS tasks
+	FROM costs
+	GROUP BY customer
+) AS g ON TRUE
+"""
+
+# Rates of the unrated tasks are set by one statement.
+SQL_RESOLVE_RATES = """
+UPDATE tasks AS t SET rate_id = v.rate_id, rate = v.rate
+FROM (VALUES {values}) AS v(task_id, rate_id, rate)
+WHERE t.task_id = v.task_id
+"""
+
+
+class CalcEngine(object):
+	"""Billing cycle for the task groups
+
+	All time_check advances of a group are applied by one UPDATE statement
+	and all bills of the group are written by one multi-row INSERT, so the
+	number of round-trips per group does not depend on the number of tasks.
+
+	In the 'database' mode the costs are computed by the server and only
+	per-customer sums are transferred.
+	"""
+
+	def __init__(self, mode=None):
+		if mode == None:
+			mode = config.read()['calc-server'].get('calculate', MODE_CLIENT)
+
+		if mode not in [ MODE_CLIENT, MODE_DATABASE ]:
+			raise ValueError("Unknown calculate mode: " + str(mode))
+
+		self.mode = mode
+		self.metrics = metrics.REGISTRY
+		self.bills_groupid = iter(polinomial.permutation())
+
+
+	def resolve_rates(self, db, unrated):
+		"""Fills rates of the tasks which were created without them
+
+		Customers and rates are read by one query each (if they are not
+		cached) and all tasks are updated by one statement.
+		"""
+
+		if not unrated:
+			return
+
+		custs = customers.get_many([ t.customer for t in unrated ])
+
+		found = []
+		for t in unrated:
+			c = custs.get(t.customer)
+			if not c:
+				LOG.error("task(%s): Unknown customer (%s)",
+					t.base_id, t.customer)
+				continue
+			found.append((t, (t.metric_id, c.tariff_id)))
+
+		resolved = rates.resolve_many([ key for t, key in found ])
+
+		values = []
+		for t, key in found:
+			rid, rate = resolved[key]
+			if not rid:
+				LOG.error("task(%s): Unable to find rate for metric",
+					t.base_id)
+				continue
+			values.append((t.task_id, rid, rate))
+
+		if not values:
+			return
+
+		db.execute(SQL_RESOLVE_RATES.format(values = ','.join([ '%s' ] * len(values))), values)
+
+
+	def summarize_client(self, db, group_id, now):
+		"""Calculates payment of the group on the client side
+
+		Returns (sums by customer, processed tasks, skipped tasks).
+		"""
+
+		tasks_dict = {}
+		unrated = []
+
+		# Get tasks
+		for t in db.find_all('tasks',
+			{
+				'state':    { '$eq': tasks.constants.STATE_ENABLED },
+				'group_id': { '$eq': group_id },
+			},
+			fields=TASK_FIELDS,
+			rows=database.ROWS_RECORD
+		):
+			if t.rate_id == '':
+				unrated.append(t)
+				continue
+
+			# Tasks with unknown metrics wait for the metric.
+			if self.metrics.code(t.metric_id) == None:
+				continue
+
+			tasks_dict[t.queue_id] = t
+
+		self.resolve_rates(db, unrated)
+
+		if not tasks_dict:
+			return ({}, 0, 0)
+
+		# Lock all selected items. Items locked by someone else are
+		# skipped until the next pass.
+		cur = db.find('queue',
+			{ 'id': tasks_dict.keys() },
+			fields=[ 'id', 'time_check' ],
+			lock='update', skip_locked=True,
+			rows=database.ROWS_TUPLE
+		)
+
+		# Join results: tasks = tasks + queue
+		joined = []
+		checks = []
+		for queue_id, time_check in cur:
+			joined.append(tasks_dict[queue_id])
+			checks.append(time_check)
+
+		skipped = len(tasks_dict) - len(joined)
+
+		if not joined:
+			return ({}, 0, skipped)
+
+		# Calculate payment.
+		costs = calculate_bulk.calculate(
+			rate         = [ t.rate for t in joined ],
+			value        = [ t.value for t in joined ],
+			time_check   = checks,
+			time_now     = now,
+			time_destroy = [ t.time_destroy for t in joined ],
+			formula      = [ self.metrics.code(t.metric_id) for t in joined ]
+		)
+
+		summ = {
+			# "customer": "payment for group", ...
+		}
+		processed = []
+
+		for t, cost in itertools.izip(joined, costs):
+			if t.state == tasks.constants.STATE_DELETED:
+				# Deleted tasks must be processed only once.
+				processed.append(t.task_id)
+
+			if cost == 0:
+				continue
+
+			summ[t.customer] = summ.get(t.customer, 0) + long(cost)
+
+		# Update last check of all items at once.
+		db.update('queue',
+			{ 'id':         map(lambda x: x.queue_id, joined) },
+			{ 'time_check': now }
+		)
+
+		if processed:
+			db.update('tasks',
+				{ 'task_id': processed },
+				{ 'state':   tasks.constants.STATE_PROCESSED }
+			)
+
+		return (summ, len(joined), skipped)
+
+
+	def summarize_database(self, db, group_id, now):
+		"""Calculates payment of the group on the server side
+
+		Returns the same as summarize_client().
+		"""
+
+		# Unrated tasks are billed from the next pass as in the client
+		# mode, so their rates are resolved after the summary.
+		unrated = db.find_all('tasks',
+			{
+				'state':    { '$eq': tasks.constants.STATE_ENABLED },
+				'group_id': { '$eq': group_id },
+				'rate_id':  '',
+			},
+			fields=TASK_FIELDS,
+			rows=database.ROWS_RECORD
+		)
+
+		# Metrics with unknown formulas are not joined, their tasks
+		# wait for the metric as in the client mode.
+		mlist = [ m for m in self.metrics.all() if self.metrics.code(m.id) != None ]
+		if not mlist:
+			self.resolve_rates(db, unrated)
+			return ({}, 0, 0)
+
+		params = {
+			'group_id':  group_id,
+			'now':       now,
+			'state':     tasks.constants.STATE_ENABLED,
+			'deleted':   tasks.constants.STATE_DELETED,
+			'processed': tasks.constants.STATE_PROCESSED,
+			'speed':     metrics.constants.FORMULA_SPEED,
+			'time':      metrics.constants.FORMULA_TIME,
+			'unit':      metrics.constants.FORMULA_UNIT,
+		}
+
+		# Tasks with unknown metrics are not joined and wait for
+		# the next refresh of the metric list.
+		values = []
+		for i, m in enumerate(mlist):
+			params['metric' + str(i)]  = m.id
+			params['formula' + str(i)] = m.formula
+			values.append('(%(metric{0})s,%(formula{0})s)'.format(i))
+
+		qs = SQL_GROUP_SUMMARY.format(metrics = ','.join(values))
+
+		summ = {}
+		count = 0
+		selected = 0
+
+		for r in db.query(qs, params):
+			selected = r['selected']
+			if r['customer'] == None:
+				continue
+			count += r['tasks']
+			if r['payable']:
+				summ[r['customer']] = long(r['cost'])
+
+		self.resolve_rates(db, unrated)
+
+		return (summ, count, selected - count)
+
+
+	def process(self, group_id, now=None):
+		"""Calculates payment for all tasks of the group
+
+		Tasks locked by someone else are skipped and counted by
+		'skipped'. Returns dictionary with group statistics.
+		"""
+
+		summarize = {
+			MODE_CLIENT:   self.summarize_client,
+			MODE_DATABASE: self.summarize_database,
+		}
+
+		stat = {
+			'group_id':   group_id,
+			'tasks':      0,
+			'skipped':    0,
+			'bills':      0,
+			'roundtrips': 0,
+		}
+
+		with database.DBConnect(dbtype='local', autocommit=False) as db:
+			summ, count, skipped = summarize[self.mode](db, group_id, now or int(time.time()))
+
+			# Withdraw payment from the customers.
+			if summ:
+				values = [
+					bills.Bill({
+						'target':   customer,
+						'value':    cost,
+						'group_id': self.bills_groupid.next()
+					}).values
+					for customer, cost in summ.iteritems()
+				]
+
+				if len(values) >= database.COPY_THRESHOLD:
+					db.copy_in('bills', values, sorted(values[0].keys()))
+				else:
+					db.insert('bills', values)
+
+			# Commit all changes at once.
+			db.commit()
+
+			stat['tasks'] = count
+			stat['skipped'] = skipped
+			stat['bills'] = len(summ)
+			stat['roundtrips'] = db.roundtrips
+
+		if stat['tasks'] > 0:
+			LOG.debug("group(%s): tasks=%d skipped=%d bills=%d roundtrips=%d",
+				group_id, stat['tasks'], stat['skipped'], stat['bills'], stat['roundtrips'])
+
+		return stat
@@ -9,7 +9,20 @@
 #
 from bc import metrics
 
+_CODES = metrics.FORMULA_CODES
+
+_FORMULAS = {
+	_CODES[metrics.constants.FORMULA_SPEED]: lambda task, delta_ts: task['rate'] * delta_ts * task['value'],
+	_CODES[metrics.constants.FORMULA_TIME]:  lambda task, delta_ts: task['rate'] * delta_ts,
+	_CODES[metrics.constants.FORMULA_UNIT]:  lambda task, delta_ts: task['rate'] * task['value'],
+}
+
 def calculate(task, metric):
+	"""Calculates cost of the task interval
+
+	The 'metric' is a Metric object or a formula code
+	from metrics.FORMULA_CODES.
+	"""
 
 	if task['rate'] == 0:
 		return 0
@@ -19,11 +32,7 @@ def calculate(task, metric):
 	else:
 		delta_ts = int(task['time_now']) - int(task['time_check'])
 
-	switch = {
-		metrics.constants.FORMULA_SPEED: lambda: task['rate'] * delta_ts * task['value'],
-		metrics.constants.FORMULA_TIME:  lambda: task['rate'] * delta_ts,
-		metrics.constants.FORMULA_UNIT:  lambda: task['rate'] * task['value'],
-	}
-
-	return switch[metric.formula]()
+	if not isinstance(metric, (int, long)):
+		metric = _CODES[metric.formula]
 
+	return _FORMULAS[metric](task, delta_ts)
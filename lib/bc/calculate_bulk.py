@@ -0,0 +1,145 @@
+#
+# calculate_bulk.py
+#
+# Copyright (c) 2012-2013 by Alexey Gladkov
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+import array
+
+from bc import metrics
+
+try:
+	import numpy
+	_HAVE_NUMPY = True
+except ImportError:
+	_HAVE_NUMPY = False
+
+CODE_SPEED = metrics.FORMULA_CODES[metrics.constants.FORMULA_SPEED]
+CODE_TIME  = metrics.FORMULA_CODES[metrics.constants.FORMULA_TIME]
+CODE_UNIT  = metrics.FORMULA_CODES[metrics.constants.FORMULA_UNIT]
+
+# Costs above this bound may not fit into int64. The bound is checked
+# in floating point, so there is a reserve for rounding errors.
+_INT64_BOUND = 2.0 ** 62
+
+
+def formula_codes(formulas):
+	"""Converts list of formula names to the list of formula codes"""
+
+	return [ metrics.FORMULA_CODES[f] for f in formulas ]
+
+
+def _column(arg, size):
+	if isinstance(arg, (int, long)):
+		return [ arg ] * size
+	if len(arg) != size:
+		raise ValueError("Columns have different length")
+	return arg
+
+
+def _numpy_column(arg, size, dtype=None):
+	# Same as _column(), scalars are broadcast.
+	if isinstance(arg, (int, long)):
+		return numpy.full(size, arg, dtype=dtype)
+	res = numpy.asarray(arg, dtype=dtype)
+	if res.shape != (size,):
+		raise ValueError("Columns have different length")
+	return res
+
+
+def _calculate_python(rate, value, time_check, time_now, time_destroy, formula):
+	size = len(rate)
+
+	value, time_check, time_now, time_destroy, formula = map(
+		lambda x: _column(x, size),
+		[ value, time_check, time_now, time_destroy, formula ])
+
+	res = [ 0 ] * size
+
+	for i in xrange(size):
+		r = int(rate[i])
+		if r == 0:
+			continue
+
+		if int(time_destroy[i]) > 0:
+			delta_ts = int(time_destroy[i]) - int(time_check[i])
+		else:
+			delta_ts = int(time_now[i]) - int(time_check[i])
+
+		f = formula[i]
+
+		if f == CODE_SPEED:
+			res[i] = r * delta_ts * int(value[i])
+		elif f == CODE_TIME:
+			res[i] = r * delta_ts
+		elif f == CODE_UNIT:
+			res[i] = r * int(value[i])
+		else:
+			raise ValueError("Unknown formula code: " + str(f))
+
+	return res
+
+
+def _calculate_array(rate, value, time_check, time_now, time_destroy, formula):
+	res = _calculate_python(rate, value, time_check, time_now, time_destroy, formula)
+	try:
+		return array.array('l', res)
+	except OverflowError:
+		return res
+
+
+def _calculate_numpy(rate, value, time_check, time_now, time_destroy, formula):
+	size = len(rate)
+
+	try:
+		r, v, tc, tn, td = map(
+			lambda x: _numpy_column(x, size, numpy.int64),
+			[ rate, value, time_check, time_now, time_destroy ])
+	except OverflowError:
+		return numpy.array(_calculate_python(rate, value, time_check,
+			time_now, time_destroy, formula), dtype=object)
+
+	f = _numpy_column(formula, size)
+
+	is_speed = (f == CODE_SPEED)
+	is_time  = is_speed | (f == CODE_TIME)
+	is_unit  = is_speed | (f == CODE_UNIT)
+
+	# The scalar function returns zero for zero rate before
+	# looking at the formula.
+	if numpy.any(~(is_time | is_unit) & (r != 0)):
+		raise ValueError("Unknown formula code")
+
+	delta = numpy.where(td > 0, td - tc, tn - tc)
+
+	a = numpy.where(is_time, delta, 1)
+	b = numpy.where(is_unit, v, 1)
+
+	bound = numpy.abs(r.astype(numpy.float64)) * numpy.abs(a) * numpy.abs(b)
+
+	if numpy.any(bound >= _INT64_BOUND):
+		return numpy.array(_calculate_python(rate, value, time_check,
+			time_now, time_destroy, formula), dtype=object)
+
+	return r * a * b
+
+
+def calculate(rate, value, time_check, time_now, time_destroy, formula):
+	"""Calculates costs of many task intervals at once
+
+	All arguments are columns of the same length, any of them except
+	'rate' may be a single number. The 'formula' column contains codes from
+	metrics.FORMULA_CODES. The result is the same as calculate.calculate()
+	called for each row.
+
+	Returns numpy.ndarray if NumPy is available or array.array otherwise.
+	If some cost does not fit into 64 bits, the result contains python
+	integers (object array or list).
+	"""
+
+	if _HAVE_NUMPY:
+		return _calculate_numpy(rate, value, time_check, time_now, time_destroy, formula)
+	return _calculate_array(rate, value, time_check, time_now, time_destroy, formula)
@@ -31,7 +31,9 @@ _TEMPLATE_CONFIG = {
 
 	"calc-server": {
 		"pidfile": "/tmp/bc-calc.pid",
-		"workers": 3
+		"workers": 3,
+		"calculate": "client",
+		"period": 5
 	},
 
 	"data-server": {
@@ -43,10 +45,32 @@ _TEMPLATE_CONFIG = {
 			#"tables": [ "customers", "metrics", "rates", "tariffs" ],
 
 			# Polling period
-			#"period": 15
+			#"period": 15,
+
+			# Records per request and requests queued per zone
+			#"batch": 500,
+			#"depth": 4,
+
+			# Seconds to wait for the full queue of a zone
+			#"timeout": 60
+		},
+		"routine": {
+			# Maximum number of records moved at once
+			#"batch": 50,
+
+			# Bounds of the idle delay (seconds)
+			#"idle-min": 1,
+			#"idle-max": 15
 		},
 	},
 
+	# In-process caches
+	"cache": {
+		# Customers looked up by the task handlers and the calculator.
+		# Entries live 'ttl' seconds at most.
+		"customers": { "size": 10000, "ttl": 60 },
+	},
+
 	"zones": {
 		#"local-DC": { "server": "localhost", "weight": 3, "local": True,
 		#              "auth": { "role": "admin", "secret": "qwerty" } }
@@ -63,6 +87,9 @@ _TEMPLATE_CONFIG = {
 		# Database searver for global collections
 		"server": "127.0.0.1",
 
+		# Number of rows fetched at once by the streaming queries
+		"itersize": 2000,
+
 		# Database servers for sharding
 		"shards": {
 			#"shard0": { "server": "127.0.0.10", "weight": 3, "local": true  },
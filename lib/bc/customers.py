@@ -15,6 +15,7 @@ import uuid
 import bobject
 import readonly
 
+from bc import config
 from bc import database
 
 class CustomerConstants(object):
@@ -50,62 +51,126 @@ class CustomerConstants(object):
 constants = CustomerConstants()
 
 class Customer(bobject.BaseObject):
-	def __init__(self, data = None):
+	__fields__ = [
+		('id',               lambda: unicode(uuid.uuid4())),
 
-		c = CustomerConstants()
+		('login',            u''),
 
-		self.__values__ = {
-			'id': unicode(uuid.uuid4()),
+		('name_short',       u''),
+		('name_full',        u''),
 
-			'login':            u'',
+		('comment',          u''),
 
-			'name_short':       u'',
-			'name_full':        u'',
+		('contract_client',  u''),
+		('contract_service', u''),
 
-			'comment':          u'',
+		('tariff_id',        u''),
 
-			'contract_client':  u'',
-			'contract_service': u'',
+		('contact_person',   u''),
+		('contact_email',    u''),
+		('contact_phone',    u''),
 
-			'tariff_id':        u'',
+		('state',            constants.STATE_ENABLED),
 
-			'contact_person':   u'',
-			'contact_email':    u'',
-			'contact_phone':    u'',
+		('time_create',      lambda: long(time.time())),
+		('time_destroy',     0L),
 
-			'state':            c.STATE_ENABLED,
+		('wallet',           0L),
+		('wallet_mode',      constants.WALLET_MODE_LIMITED),
+	]
 
-			'time_create':      int(time.time()),
-			'time_destroy':     0,
 
-			'wallet':           0L,
-			'wallet_mode':      c.WALLET_MODE_LIMITED
-		}
+_CACHE = None
+
+def cache():
+	"""Returns cache of the customers by ID"""
+
+	global _CACHE
+
+	if _CACHE == None:
+		conf = config.read()['cache']['customers']
+		_CACHE = database.TTLCache(conf['size'], conf['ttl'])
+
+	return _CACHE
+
 
-		if data:
-			if 'sync' in data:
-				del data['sync']
-			self.set(data)
+def invalidate(typ='id', val=None):
+	"""Drops cached customer. Without value drops all of them."""
+
+	if typ == 'id' and val != None:
+		cache().remove(val)
+	else:
+		cache().clear()
 
 
-def get(val, typ='id'):
-	"""Finds customer by ID or Login"""
+def get(val, typ='id', cached=False):
+	"""Finds customer by ID or Login
+
+	If 'cached' is set the customer is looked up by ID in the cache first.
+	The cached object is shared and must not be modified.
+	"""
 
 	c = CustomerConstants()
 
 	if typ not in [ 'id', 'login' ]:
 		raise ValueError("Unknown type: " + str(typ))
 
+	cached = cached and typ == 'id'
+
+	if cached:
+		o = cache().get(val)
+		if o != None:
+			return o
+		generation = cache().generation
+
 	query = {
 		'login': { 'login': val, 'state': c.STATE_ENABLED },
 		'id': { 'id': val }
 	}
 
 	with database.DBConnect() as db:
-		r = db.find_one('customers', query[typ])
-		if r:
-			return Customer(r)
-		return None
+		r = db.find_one('customers', query[typ],
+			fields=Customer.columns(), rows=database.ROWS_TUPLE)
+		if not r:
+			return None
+
+	o = Customer.from_row(r)
+	if cached:
+		cache().add(o.id, o, generation)
+	return o
+
+
+def get_many(ids):
+	"""Finds customers by list of IDs
+
+	Returns dictionary of the found customers by ID. Customers missing
+	in the cache are fetched by one query. The cached objects are shared
+	and must not be modified.
+	"""
+
+	res = {}
+	misses = []
+
+	for i in set(ids):
+		o = cache().get(i)
+		if o != None:
+			res[i] = o
+		else:
+			misses.append(i)
+
+	if not misses:
+		return res
+
+	generation = cache().generation
+
+	with database.DBConnect() as db:
+		for r in db.find('customers', { 'id': misses },
+				fields=Customer.columns(), rows=database.ROWS_TUPLE):
+			o = Customer.from_row(r)
+			cache().add(o.id, o, generation)
+			res[o.id] = o
+
+	return res
 
 
 def get_all():
@@ -113,8 +178,9 @@ def get_all():
 
 	with database.DBConnect() as db:
 		c = CustomerConstants()
-		for i in db.find('customers', { 'state': c.STATE_ENABLED }):
-			yield Customer(i)
+		for i in db.find('customers', { 'state': c.STATE_ENABLED },
+				fields=Customer.columns(), rows=database.ROWS_TUPLE, stream=True):
+			yield Customer.from_row(i)
 
 
 def add(obj):
@@ -171,6 +237,8 @@ def modify(typ, val, params):
 	with database.DBConnect() as db:
 		db.update("customers", query[typ], params)
 
+	invalidate(typ, val)
+
 
 def remove(typ, value):
 	"""Disables customer"""
@@ -192,6 +260,8 @@ def remove(typ, value):
 			}
 		)
 
+	invalidate(typ, value)
+
 
 def deposit(cid, ammount):
 	""" Make deposit to customer """
@@ -201,3 +271,5 @@ def deposit(cid, ammount):
 			{ 'id': cid },
 			{ '$inc': { 'wallet': ammount } }
 		)
+
+	invalidate('id', cid)
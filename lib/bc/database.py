@@ -11,8 +11,13 @@ import os
 import re
 import time
 import uuid
+import select
 import inspect
 import logging
+import tempfile
+import itertools
+import threading
+import collections
 
 from bc import config
 from bc import hashing
@@ -26,6 +31,24 @@ from psycopg2 import pool
 MIN_OPEN_CONNECTIONS = 1
 MAX_OPEN_CONNECTIONS = 20
 
+# Maximum number of prepared statements per connection.
+MAX_PREPARED_STATEMENTS = 64
+
+# How many times a query shape is executed before it will be prepared.
+PREPARE_THRESHOLD = 2
+
+# Maximum number of compiled WHERE and SET templates.
+MAX_QUERY_SHAPES = 1024
+
+# Number of rows fetched at once by a streaming query.
+STREAM_ITERSIZE = 2000
+
+# Batches of this size and larger are loaded by COPY instead of INSERT.
+COPY_THRESHOLD = 100
+
+# COPY data above this size is spooled to a temporary file.
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
 # Backend exceptions:
 OperationalError = psycopg2.OperationalError
 DatabaseError    = psycopg2.DatabaseError
@@ -33,8 +56,14 @@ DatabaseError    = psycopg2.DatabaseError
 # Backend methods
 DBCursor  = extras.RealDictCursor
 
+# Formats of the result rows
+ROWS_DICT   = 'dict'
+ROWS_TUPLE  = 'tuple'
+ROWS_RECORD = 'record'
+
 # Backend status
 TRANSACTION_STATUS_IDLE       = extensions.TRANSACTION_STATUS_IDLE
+TRANSACTION_STATUS_INTRANS    = extensions.TRANSACTION_STATUS_INTRANS
 TRANSACTION_STATUS_INERROR    = extensions.TRANSACTION_STATUS_INERROR
 
 LOG = logging.getLogger("database")
@@ -74,6 +103,20 @@ def get_host(dbtype, key=None):
 		return conf['database']['server']
 
 
+def get_hosts(keys):
+	"""Returns database servers of the keys as { server: [ keys ] }"""
+
+	conf = config.read()
+	data = config.subdict(conf['database']['shards'], field='weight')
+	ring = hashing.HashRing(data.keys(), data)
+
+	res = {}
+	for key in keys:
+		server = conf['database']['shards'][ring.get_node(key)]['server']
+		res.setdefault(server, []).append(key)
+	return res
+
+
 def sqldbg(qs):
 	if os.environ.get('BILLING_SQL_DESCRIBE', False):
 		LOG.debug("SQL: " + qs)
@@ -104,6 +147,373 @@ def sqlcmd(a, delim=' '):
 	return delim.join(runover(a))
 
 
+def _sqlarray(values):
+	res = []
+	for v in values:
+		if v == None:
+			res.append('NULL')
+			continue
+		if not isinstance(v, basestring):
+			v = str(v)
+		res.append('"' + v.replace('\\', '\\\\').replace('"', '\\"') + '"')
+	return '{' + ','.join(res) + '}'
+
+
+def _sqlvalue(value):
+	"""Converts value for binding
+
+	Values are passed as strings (arrays as array literals), so the server
+	casts them to the type of the column just like quoted literals.
+	"""
+	if value == None or isinstance(value, basestring):
+		return value
+	if isinstance(value, (list, tuple)):
+		return _sqlarray(value)
+	return str(value)
+
+
+def _copyvalue(value):
+	if value == None:
+		return '\\N'
+	if isinstance(value, unicode):
+		value = value.encode('utf-8')
+	elif not isinstance(value, str):
+		value = str(value)
+	return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _sqlparams(qs):
+	"""Replaces psycopg2 placeholders by the server ones ($1, $2, ...)"""
+	num = [ 0 ]
+	def repl(m):
+		if m.group(1) == '%':
+			return '%'
+		num[0] += 1
+		return '$' + str(num[0])
+	return re.sub(r'%([%s])', repl, qs)
+
+
+_RECORD_TYPES = {}
+
+def record_type(columns):
+	"""Returns record class (slotted named tuple) for the list of columns"""
+
+	key = tuple(columns)
+	rt = _RECORD_TYPES.get(key)
+	if rt == None:
+		rt = _RECORD_TYPES[key] = collections.namedtuple('Record', key, rename=True)
+	return rt
+
+
+class RecordCursor(extensions.cursor):
+	"""Cursor which returns rows as records
+
+	The record class is generated once for each set of columns.
+	"""
+
+	def _record(self):
+		return record_type([ d[0] for d in self.description ])
+
+	def fetchone(self):
+		r = extensions.cursor.fetchone(self)
+		if r == None:
+			return None
+		return self._record()._make(r)
+
+	def fetchmany(self, size=None):
+		rows = extensions.cursor.fetchmany(self, size or self.arraysize)
+		return map(self._record()._make, rows)
+
+	def fetchall(self):
+		rows = extensions.cursor.fetchall(self)
+		return map(self._record()._make, rows)
+
+	def __iter__(self):
+		rt = None
+		for r in extensions.cursor.__iter__(self):
+			if rt == None:
+				rt = self._record()
+			yield rt._make(r)
+
+
+ROW_CURSORS = {
+	ROWS_DICT:   DBCursor,
+	ROWS_TUPLE:  extensions.cursor,
+	ROWS_RECORD: RecordCursor,
+}
+
+
+class LRUCache(object):
+	"""Bounded mapping which evicts least recently used entries"""
+
+	def __init__(self, size):
+		self.size      = size
+
+		self.hits      = 0
+		self.misses    = 0
+		self.evictions = 0
+
+		self._items = collections.OrderedDict()
+		self._lock  = threading.Lock()
+
+
+	def __len__(self):
+		return len(self._items)
+
+
+	def get(self, key):
+		"""Returns cached value or None"""
+
+		with self._lock:
+			value = self._items.pop(key, None)
+			if value == None:
+				self.misses += 1
+				return None
+
+			self._items[key] = value
+			self.hits += 1
+			return value
+
+
+	def add(self, key, value):
+		"""Adds the value and returns the evicted one"""
+
+		evicted = None
+		with self._lock:
+			if key not in self._items and len(self._items) >= self.size:
+				evicted = self._items.popitem(last=False)[1]
+				self.evictions += 1
+
+			self._items[key] = value
+		return evicted
+
+
+	def remove(self, key):
+		"""Drops the value and returns it"""
+
+		with self._lock:
+			return self._items.pop(key, None)
+
+
+	def clear(self):
+		with self._lock:
+			self._items.clear()
+
+
+	def stats(self):
+		return {
+			'size':      len(self._items),
+			'hits':      self.hits,
+			'misses':    self.misses,
+			'evictions': self.evictions,
+		}
+
+
+class TTLCache(LRUCache):
+	"""LRU cache whose entries expire after 'ttl' seconds
+
+	The 'generation' is incremented by remove() and clear(). A value read
+	from the database before the invalidation is not added if add() gets
+	the generation seen before the read.
+	"""
+
+	def __init__(self, size, ttl):
+		LRUCache.__init__(self, size)
+		self.ttl        = ttl
+		self.expired    = 0
+		self.generation = 0
+
+
+	def get(self, key):
+		item = LRUCache.get(self, key)
+		if item == None:
+			return None
+
+		if item[0] > time.time():
+			return item[1]
+
+		# Expired entry is counted as a miss.
+		with self._lock:
+			if self._items.get(key) is item:
+				del self._items[key]
+			self.hits    -= 1
+			self.misses  += 1
+			self.expired += 1
+		return None
+
+
+	def add(self, key, value, generation=None):
+		if generation != None and generation != self.generation:
+			return None
+
+		evicted = LRUCache.add(self, key, (time.time() + self.ttl, value))
+		if evicted:
+			return evicted[1]
+		return None
+
+
+	def remove(self, key):
+		self.generation += 1
+		item = LRUCache.remove(self, key)
+		if item:
+			return item[1]
+		return None
+
+
+	def clear(self):
+		self.generation += 1
+		LRUCache.clear(self)
+
+
+	def stats(self):
+		res = LRUCache.stats(self)
+		res['expired'] = self.expired
+		return res
+
+
+class StatementCache(LRUCache):
+	"""LRU cache of the prepared statements of the connection"""
+
+	def __init__(self, size=MAX_PREPARED_STATEMENTS, threshold=PREPARE_THRESHOLD):
+		LRUCache.__init__(self, size)
+		self.threshold = threshold
+
+		self._seen  = collections.OrderedDict()
+		self._num   = 0
+
+
+	def want(self, qs):
+		"""Counts the query shape and returns True if it should be prepared"""
+
+		n = self._seen.pop(qs, 0) + 1
+		if n >= self.threshold:
+			return True
+
+		self._seen[qs] = n
+		while len(self._seen) > self.size:
+			self._seen.popitem(last=False)
+		return False
+
+
+	def genname(self):
+		self._num += 1
+		return "bc_stmt_{0}".format(self._num)
+
+
+	def stats(self):
+		res = LRUCache.stats(self)
+		res['statements'] = res.pop('size')
+		return res
+
+
+# Compiled WHERE and SET templates shared by all connections.
+SHAPES = LRUCache(MAX_QUERY_SHAPES)
+
+
+def _sqloperation(op, value):
+	if op == '$eq':
+		if isinstance(value, bool) or value == None:
+			return '$is'
+		if isinstance(value, list):
+			return '$in'
+	if op == '$ne':
+		if isinstance(value, bool) or value == None:
+			return '$notis'
+		if isinstance(value, list):
+			return '$nin'
+	return op
+
+
+def _freeze(x):
+	if isinstance(x, dict):
+		return ('d',) + tuple((k, _freeze(x[k])) for k in sorted(x.keys()))
+	if isinstance(x, (list, tuple)):
+		return ('t',) + tuple(map(_freeze, x))
+	return x
+
+
+def _where_leaf(op, value, values):
+	op = _sqloperation(op, value)
+	if op in [ '$is', '$notis' ]:
+		return (op, value if value is None else bool(value))
+	if isinstance(value, dict):
+		return (op, _freeze(value))
+	values.append(_sqlvalue(value))
+	return op
+
+
+def _where_shape(query, values):
+	"""Returns hashable shape of the WHERE spec and collects its values
+
+	The values are collected in the order of placeholders produced
+	by DBConnect.sql_where() in the parameterized mode.
+	"""
+	res = []
+	for name in sorted(query.keys()):
+		cond = query[name]
+		if name == '$not':
+			res.append((name, _where_shape(cond, values)))
+		elif name in [ '$and', '$or' ]:
+			res.append((name, tuple(_where_shape(x, values) for x in cond)))
+		elif isinstance(cond, dict):
+			res.append((name, tuple(_where_leaf(o, cond[o], values) for o in sorted(cond.keys()))))
+		else:
+			res.append((name, _where_leaf('$eq', cond, values), None))
+	return tuple(res)
+
+
+def _func_shape(x, values):
+	# Strings are bound, column names of $field are not.
+	if isinstance(x, basestring):
+		values.append(_sqlvalue(x))
+		return '%s'
+	if isinstance(x, dict):
+		return ('d',) + tuple((k, k == '$field' and x[k] or _func_shape(x[k], values)) for k in sorted(x.keys()))
+	if isinstance(x, (list, tuple)):
+		return ('t',) + tuple(_func_shape(v, values) for v in x)
+	# Numbers are a part of the SQL text.
+	return (type(x), x)
+
+
+def _update_leaf(value, values, inline):
+	if isinstance(value, dict):
+		return _func_shape(value, values)
+	if isinstance(value, inline):
+		return _freeze(value)
+	values.append(_sqlvalue(value))
+	return None
+
+
+def _update_shape(query, values):
+	"""Returns hashable shape of the SET document and collects its values
+
+	The values are collected in the order of placeholders produced
+	by DBConnect.sql_update() in the parameterized mode.
+	"""
+	res = []
+	for op in sorted(query.keys()):
+		cond = query[op]
+		if op in [ '$set', '$inc', '$dec', '$div', '$mult' ]:
+			res.append((op, tuple((n, _update_leaf(cond[n], values, (tuple, dict))) for n in sorted(cond.keys()))))
+		elif op == '$concat':
+			res.append((op, tuple((n, _update_leaf(cond[n], values, ())) for n in sorted(cond.keys()))))
+		elif op == '$bit':
+			res.append((op, tuple(
+				(n, tuple((b, _update_leaf(cond[n][b], values, tuple)) for b in sorted(cond[n].keys())))
+				for n in sorted(cond.keys()))))
+		else:
+			res.append((op, _update_leaf(cond, values, tuple)))
+	return tuple(res)
+
+
+class DBConnection(extensions.connection):
+	"""Connection with the cache of prepared statements"""
+
+	def __init__(self, *args, **kwargs):
+		extensions.connection.__init__(self, *args, **kwargs)
+		self.statements = StatementCache()
+
+
 class DBPool(object):
 
 	def __init__(self):
@@ -137,7 +547,9 @@ class DBPool(object):
 				host     = conn['dbhost'],
 				database = conn['dbname'],
 				user     = conn['dbuser'],
-				password = conn['dbpass']
+				password = conn['dbpass'],
+
+				connection_factory = DBConnection
 			)
 		conn['socket'] = self._CONNECTIONS[conn['key']].getconn()
 
@@ -145,10 +557,19 @@ class DBPool(object):
 
 
 	def free_connection(self, conn):
-		conn['socket'].reset()
+		# Do not reset the session, it removes prepared statements.
+		# Rollback is enough to return the connection to the initial state.
+		if not conn['socket'].closed:
+			conn['socket'].rollback()
 		self._CONNECTIONS[conn['key']].putconn(conn['socket'])
 
 
+	def drop_connection(self, conn):
+		"""Closes the connection instead of returning it to the pool"""
+
+		self._CONNECTIONS[conn['key']].putconn(conn['socket'], close=True)
+
+
 class DBQuery(object):
 	cursor = None
 
@@ -202,8 +623,67 @@ class DBQuery(object):
 			self.close()
 
 
+class DBStreamQuery(DBQuery):
+	"""Query with the result kept on the server side
+
+	The result is read from the server-side cursor by 'itersize' rows,
+	so the iteration starts immediately and runs in bounded memory.
+	The cursor exists only until the end of the transaction.
+	"""
+
+	def __init__(self, cursor, autocommit, name, itersize, fmt, *args):
+		self.name = name
+		self.itersize = itersize
+		DBQuery.__init__(self, cursor, autocommit,
+			"DECLARE " + name + " NO SCROLL CURSOR FOR " + fmt, *args)
+
+	def fetch(self, size=None):
+		"""Returns next part of the result"""
+
+		if not self.cursor or self.cursor.closed:
+			return []
+		self.cursor.execute("FETCH FORWARD {0} FROM {1}".format(size or self.itersize, self.name))
+		return self.cursor.fetchall()
+
+	def close(self):
+		if not self.cursor or self.cursor.closed:
+			return
+		try:
+			# Rest of the result is discarded on the server.
+			if self.cursor.connection.get_transaction_status() == TRANSACTION_STATUS_INTRANS:
+				self.cursor.execute("CLOSE " + self.name)
+				if self.autocommit:
+					self.cursor.execute("COMMIT")
+		finally:
+			self.cursor.close()
+			self.cursor = None
+
+	def __iter__(self):
+		try:
+			while True:
+				rows = self.fetch()
+				if not rows:
+					break
+				for o in rows:
+					yield o
+		finally:
+			self.close()
+
+	def one(self):
+		try:
+			rows = self.fetch(1)
+			return rows and rows[0] or None
+		finally:
+			self.close()
+
+	def all(self):
+		return list(self)
+
+
 DB = DBPool()
 
+_STREAM_NAMES = itertools.count(1)
+
 class DBConnect(object):
 	def __init__(self, dbhost=None, dbname=None, dbuser=None, dbpass=None, dbtype='global', primarykey=None, autocommit=True):
 		self._conn = DB.get_connection(dbhost, dbname, dbuser, dbpass, dbtype, primarykey)
@@ -212,8 +692,12 @@ class DBConnect(object):
 
 		self.autocommit = bool(autocommit)
 		self._curlist = []
+		self._channels = set()
 		self.state = 0
 
+		# Number of commands sent to the server by this object.
+		self.roundtrips = 0
+
 
 	def __enter__(self):
 		return self
@@ -235,6 +719,12 @@ class DBConnect(object):
 				cur.execute(cursor_cmd)
 			cur.close()
 
+		if self._channels and not self.connect().closed:
+			# Pooled connection must not receive notifications.
+			self.connect().cursor().execute("UNLISTEN *")
+			self.connect().notifies[:] = []
+			self._channels.clear()
+
 		DB.free_connection(self._conn)
 		return False
 
@@ -266,6 +756,7 @@ class DBConnect(object):
 		"""
 		if self.in_transaction():
 			return
+		self.roundtrips += 1
 		self.cursor().execute("START TRANSACTION")
 
 
@@ -274,6 +765,7 @@ class DBConnect(object):
 		"""
 		if not self.in_transaction():
 			return
+		self.roundtrips += 1
 		self.cursor().execute("COMMIT")
 
 
@@ -292,6 +784,7 @@ class DBConnect(object):
 		if not self.in_transaction():
 			return
 		qs = (release) and "RELEASE SAVEPOINT %s" or "SAVEPOINT %s"
+		self.roundtrips += 1
 		self.cursor().execute(qs, point)
 
 
@@ -307,6 +800,7 @@ class DBConnect(object):
 		"""
 		if not self.in_transaction():
 			return
+		self.roundtrips += 1
 		if point != None:
 			self.cursor().execute("ROLLBACK TO SAVEPOINT %s", point)
 			return
@@ -318,6 +812,7 @@ class DBConnect(object):
 		"""
 		self.begin()
 		try:
+			self.roundtrips += 1
 			self.cursor().execute(fmt, *args)
 
 		except psycopg2.Error as e:
@@ -329,26 +824,127 @@ class DBConnect(object):
 			self.commit()
 
 
-	def query(self, fmt, *args):
+	def query(self, fmt, *args, **kwargs):
 		"""Queries the database and returns DBCursor with result
+
+		The 'rows' keyword argument selects format of the rows:
+		ROWS_DICT (default), ROWS_TUPLE or ROWS_RECORD.
 		"""
 		self._curlist = filter(lambda x: x.closed, self._curlist)
 
-		cur = DBCursor(self.connect())
+		cur = ROW_CURSORS[kwargs.get('rows', ROWS_DICT)](self.connect())
 		self._curlist.append(cur)
 
+		self.roundtrips += 1
 		return DBQuery(cur, self.autocommit, fmt, *args)
 
 
-	def sql_update(self, query, sort=False):
+	def stream(self, fmt, *args, **kwargs):
+		"""Queries the database and returns DBStreamQuery with result
+
+		The number of rows fetched at once is 'itersize' from the database
+		section of configuration (STREAM_ITERSIZE by default). The 'rows'
+		keyword argument is the same as in query().
+		"""
+		if not self.autocommit:
+			# The cursor can be declared only in the transaction block.
+			self.begin()
+
+		self._curlist = filter(lambda x: x.closed, self._curlist)
+
+		cur = ROW_CURSORS[kwargs.get('rows', ROWS_DICT)](self.connect())
+		self._curlist.append(cur)
+
+		name = "bc_cursor_{0}".format(_STREAM_NAMES.next())
+		itersize = int(config.read()['database'].get('itersize', STREAM_ITERSIZE))
+
+		self.roundtrips += 1
+		return DBStreamQuery(cur, self.autocommit, name, itersize, fmt, *args)
+
+
+	def listen(self, channels, timeout=None):
+		"""Waits for notifications on the channels
+
+		The connection is subscribed to the channels on the first call, it
+		must be in the autocommit mode. Notifications received since the
+		previous call are returned at once. Otherwise the call blocks until
+		a notification arrives or 'timeout' seconds pass (None means forever).
+
+		Returns list of the channels which received notifications.
+		"""
+		conn = self.connect()
+
+		for ch in channels:
+			if ch not in self._channels:
+				self.execute('LISTEN "' + ch + '"')
+				self._channels.add(ch)
+
+		if not conn.notifies:
+			if select.select([ conn ], [], [], timeout) != ([], [], []):
+				conn.poll()
+
+		res = []
+		while conn.notifies:
+			n = conn.notifies.pop(0)
+			if n.channel not in res:
+				res.append(n.channel)
+		return res
+
+
+	def prepare(self, qs, args):
+		"""Returns command to execute the query
+
+		The query shape (SQL text with placeholders) which is used repeatedly
+		is prepared once per connection and then executed with bound parameters.
+		"""
+		cache = self.connect().statements
+		name = cache.get(qs)
+
+		if name == None:
+			if not cache.want(qs):
+				return qs
+
+			name = cache.genname()
+			try:
+				self.roundtrips += 1
+				self.cursor().execute("PREPARE " + name + " AS " + _sqlparams(qs))
+
+			except psycopg2.Error as e:
+				if self.autocommit:
+					self.rollback()
+				raise e
+
+			evicted = cache.add(qs, name)
+			if evicted:
+				self.roundtrips += 1
+				self.cursor().execute("DEALLOCATE " + evicted)
+
+		if not args:
+			return "EXECUTE " + name
+		return "EXECUTE " + name + " (" + ",".join([ "%s" ] * len(args)) + ")"
+
+
+	def _run(self, qs, args, need_return, rows=ROWS_DICT):
+		sqldbg(qs)
+		qs = self.prepare(qs, args)
+
+		if need_return:
+			return self.query(qs, args, rows=rows)
+		self.execute(qs, args)
+
+
+	def sql_update(self, query, sort=False, args=None):
 		"""Converts mongo-like dictionary to SET condition for UPDATE statement
+
+		If 'args' list is given, values are replaced by placeholders
+		and appended to the list.
 		"""
 		bit_ops = {
-			'and':    lambda x: '&'  + arg(x),
-			'or':     lambda x: '|'  + arg(x),
-			'xor':    lambda x: '^'  + arg(x),
-			'rshift': lambda x: '>>' + arg(x),
-			'lshift': lambda x: '<<' + arg(x),
+			'and':    lambda x: '&'  + bind(x),
+			'or':     lambda x: '|'  + bind(x),
+			'xor':    lambda x: '^'  + bind(x),
+			'rshift': lambda x: '>>' + bind(x),
+			'lshift': lambda x: '<<' + bind(x),
 		}
 		func_ops = {
 			'$field': lambda x: (str(x),),
@@ -361,70 +957,86 @@ class DBConnect(object):
 		}
 		ops = {
 			'$bit':    lambda x:   bit_ops[x[0]](x[1]),
-			'$set':    lambda x,y: x + "=" + arg(y),
-			'$dec':    lambda x,y: x + "=" + x + "-" + arg(y),
-			'$inc':    lambda x,y: x + "=" + x + "+" + arg(y),
-			'$div':    lambda x,y: x + "=" + x + "/" + arg(y),
-			'$mult':   lambda x,y: x + "=" + x + "*" + arg(y),
-			'$concat': lambda x,y: x + "=CONCAT(" + x + "," +  self.literal(y) + ")",
+			'$set':    lambda x,y: x + "=" + bind(y),
+			'$dec':    lambda x,y: x + "=" + x + "-" + bind(y),
+			'$inc':    lambda x,y: x + "=" + x + "+" + bind(y),
+			'$div':    lambda x,y: x + "=" + x + "/" + bind(y),
+			'$mult':   lambda x,y: x + "=" + x + "*" + bind(y),
+			'$concat': lambda x,y: x + "=CONCAT(" + x + "," + text(y) + ")",
 		}
 		def arg(x):
 			if isinstance(x, basestring):
-				return self.literal(x)
+				if args == None:
+					return self.literal(x)
+				args.append(_sqlvalue(x))
+				return "%s"
 			if isinstance(x, tuple):
 				return x[0]
 			return str(x)
 
+		def bind(x):
+			if args == None or isinstance(x, tuple):
+				return arg(x)
+			args.append(_sqlvalue(x))
+			return "%s"
+
+		def text(x):
+			if args == None:
+				return self.literal(x)
+			args.append(_sqlvalue(x))
+			return "%s::text"
+
 		def resole_op(arg):
-			k,v = arg.popitem()
+			k,v = arg.items()[0]
 			if isinstance(v, dict):
 				return func_ops[k](resole_op(v))
 			return func_ops[k](v)
 
+		# Placeholders must follow the order of arguments,
+		# so the keys are ordered instead of the result.
+		ordered = sort or args != None
+
 		res = []
-		for op in _sqllist(query.keys(), sort):
+		for op in _sqllist(query.keys(), ordered):
 			cond = query[op]
 			if op in [ '$set', '$inc', '$dec', '$div', '$mult' ]:
-				for n,v in cond.iteritems():
+				for n in _sqllist(cond.keys(), ordered):
+					v = cond[n]
 					if isinstance(v, dict):
 						res.append(ops[op](n, resole_op(v)))
 					else:
 						res.append(ops[op](n, v))
 			elif op == '$concat':
-				res.extend(map(lambda x: ops[op](x[0],x[1]),cond.iteritems()))
+				res.extend(map(lambda x: ops[op](x, cond[x]), _sqllist(cond.keys(), ordered)))
 			elif op == '$bit':
-				res.extend(map(lambda x: x[0]+"="+x[0]+"".join(map(ops[op],x[1].iteritems())),cond.iteritems()))
-			else:
+				res.extend(map(lambda x: x+"="+x+"".join(map(lambda y: ops[op]((y, cond[x][y])), _sqllist(cond[x].keys(), ordered))), _sqllist(cond.keys(), ordered)))
+			elif args == None:
 				res.append(op + "=" + self.literal(cond))
+			else:
+				res.append(op + "=" + bind(cond))
 
-		return self._delim(_sqllist(res, sort),",")
+		return self._delim(_sqllist(res, sort and args == None),",")
 
 
-	def sql_where(self, query, sort=False):
+	def sql_where(self, query, sort=False, args=None):
 		"""Converts mongo-like dictionary to SQL WHERE statement
+
+		If 'args' list is given, values are replaced by placeholders
+		and appended to the list.
 		"""
 		def sql_bool(x):
 			if x == None:
 				return 'NULL'
 			return str(bool(x))
 
-		def sql_optimize_operation(op, value):
-			if op == '$eq':
-				if isinstance(value, bool) or value == None:
-					return '$is'
-				if isinstance(value, list):
-					return '$in'
-			if op == '$ne':
-				if isinstance(value, bool) or value == None:
-					return '$notis'
-				if isinstance(value, list):
-					return '$nin'
-			return op
-
 		def sql_quote(op, value):
 			if op in ['$is','$notis']:
 				return sql_bool(value)
 
+			if args != None and not isinstance(value, dict):
+				args.append(_sqlvalue(value))
+				return "%s"
+
 			if op in ['$in','$nin']:
 				return ",".join(map(self.literal, value))
 
@@ -455,26 +1067,73 @@ class DBConnect(object):
 			'$in':     lambda x,y: [ x, "IN ("       , y, ")" ],
 			'$nin':    lambda x,y: [ x, "NOT IN ("   , y, ")" ],
 		}
+		if args != None:
+			# The list is passed as one array parameter,
+			# so the query shape does not depend on its length.
+			operation['$in']  = lambda x,y: [ x, "= ANY("  , y, ")" ]
+			operation['$nin'] = lambda x,y: [ x, "!= ALL(" , y, ")" ]
+
+		# Placeholders must follow the order of arguments,
+		# so the keys are ordered instead of the result.
+		ordered = sort or args != None
+
 		result = []
-		for name in _sqllist(query.keys(), sort):
+		for name in _sqllist(query.keys(), ordered):
 			conditions = query[name]
 
 			if name == '$not':
-				result.append([ "NOT (", self.sql_where(conditions, sort), ")" ])
+				result.append([ "NOT (", self.sql_where(conditions, sort, args), ")" ])
 			elif name in concatenation:
-				a = map(lambda x: [ "(", self.sql_where(x, sort), ")" ], conditions)
+				a = map(lambda x: [ "(", self.sql_where(x, sort, args), ")" ], conditions)
 				result.append([ "(", self._delim(a, concatenation[name]), ")" ])
 			elif isinstance(conditions, dict):
-				for o, value in conditions.iteritems():
-					o = sql_optimize_operation(o, value)
+				for o in _sqllist(conditions.keys(), ordered):
+					value = conditions[o]
+					o = _sqloperation(o, value)
 					v = sql_quote(o,value)
 					result.append(operation[o](name,v))
 			else:
-				o = sql_optimize_operation('$eq', conditions)
+				o = _sqloperation('$eq', conditions)
 				v = sql_quote(o, conditions)
 				result.append(operation[o](name, v))
 
-		return self._delim(_sqllist(result, sort), concatenation['$and'])
+		return self._delim(_sqllist(result, sort and args == None), concatenation['$and'])
+
+
+	def compile_where(self, query, args):
+		"""Returns parameterized WHERE condition for the spec
+
+		The SQL text depends only on the shape of the spec (keys, operators,
+		nesting), so it is built once per shape and cached. The values of
+		the spec are appended to the 'args' list.
+		"""
+		values = []
+		key = ('where', _where_shape(query, values))
+
+		qs = SHAPES.get(key)
+		if qs == None:
+			qs = sqlcmd([ self.sql_where(query, args=[]) ])
+			SHAPES.add(key, qs)
+
+		args.extend(values)
+		return qs
+
+
+	def compile_update(self, query, args):
+		"""Returns parameterized SET expression for the document
+
+		See compile_where().
+		"""
+		values = []
+		key = ('update', _update_shape(query, values))
+
+		qs = SHAPES.get(key)
+		if qs == None:
+			qs = sqlcmd([ self.sql_update(query, args=[]) ])
+			SHAPES.add(key, qs)
+
+		args.extend(values)
+		return qs
 
 
 	def escape(self, string):
@@ -528,25 +1187,89 @@ class DBConnect(object):
 		           of the output list of find().
 		"""
 
+		args = []
 		fmt = [ "DELETE FROM", table ]
 
 		if isinstance(spec, dict) and len(spec) > 0:
-			fmt.extend([ "WHERE", self.sql_where(spec) ])
+			fmt.extend([ "WHERE", self.compile_where(spec, args) ])
 
 		need_return = isinstance(returning, (dict, list))
 
 		if need_return:
 			fmt.extend([ "RETURNING", len(returning) > 0 and self._genlist(returning, '*') or '*' ])
 
-		qs = " ".join(runover(fmt))
-		sqldbg(qs)
+		return self._run(" ".join(runover(fmt)), args, need_return)
 
-		if need_return:
-			return self.query(qs)
-		self.execute(qs)
 
+	def copy_in(self, table, rows, columns):
+		"""Loads rows into the table by COPY FROM STDIN
+
+		Parameters:
+
+		table:   specify a table name;
+
+		rows:    an iterable of dictionaries or sequences of values
+		         in the order of 'columns';
+
+		columns: a list of column names.
+
+		The data is kept in memory up to COPY_BUFFER_SIZE bytes and
+		spooled to a temporary file after that. Returns number of rows.
+		"""
+		buf = tempfile.SpooledTemporaryFile(max_size=COPY_BUFFER_SIZE)
+		count = 0
+		try:
+			for r in rows:
+				if isinstance(r, dict):
+					r = [ r[c] for c in columns ]
+				buf.write("\t".join(map(_copyvalue, r)) + "\n")
+				count += 1
+
+			if count == 0:
+				return 0
+
+			buf.seek(0)
+
+			qs = "COPY " + table + " (" + ",".join(columns) + ") FROM STDIN"
+			sqldbg(qs)
+
+			self.begin()
+			try:
+				self.roundtrips += 1
+				self.cursor().copy_expert(qs, buf)
+
+			except psycopg2.Error as e:
+				if self.autocommit:
+					self.rollback()
+				raise e
+
+			if self.autocommit:
+				self.commit()
+		finally:
+			buf.close()
+
+		return count
+
+
+	def sql_conflict(self, conflict, columns):
+		"""Returns ON CONFLICT clause which updates all 'columns' except
+		the 'conflict' ones by the values of the inserted row
+		"""
+		if not isinstance(conflict, list):
+			conflict = [ conflict ]
+
+		update = map(lambda x: x + "=EXCLUDED." + x,
+			filter(lambda x: x not in conflict, columns))
 
-	def insert(self, table, document, returning=None):
+		fmt = [ "ON CONFLICT", "(", self._delim(conflict), ")" ]
+		if update:
+			fmt.extend([ "DO UPDATE SET", self._delim(update) ])
+		else:
+			fmt.append("DO NOTHING")
+		return " ".join(runover(fmt))
+
+
+	def insert(self, table, document, returning=None, conflict=None):
 		"""Inserts a document(s) into this table
 
 		Parameters:
@@ -559,6 +1282,10 @@ class DBConnect(object):
 		           return value(s) based on each row actually updated.
 		           The syntax of the 'returning' list is identical to that
 		           of the output list of find().
+
+		conflict:  a column name or list of names of the unique key. The
+		           existing row with the same key is updated by the
+		           document. A document must not appear twice.
 		"""
 
 		if not isinstance(document, (dict, list)):
@@ -571,13 +1298,26 @@ class DBConnect(object):
 			document = [ document ]
 
 		keys = sorted(document[0].keys())
-		fmt = [ "INSERT INTO", table, "(", self._delim(keys), ")", "VALUES" ]
+		row = "(" + ",".join([ "%s" ] * len(keys)) + ")"
 
-		for o in document:
-			# This is a simple protection against errors.
-			# We add value only by the keys from the first element.
-			fmt.extend([ "(", self._delim(map(lambda x: self.literal(o[x]), keys)), ")", "," ])
-		fmt.pop()
+		# This is a simple protection against errors.
+		# We add value only by the keys from the first element.
+		rows = [ map(lambda x: _sqlvalue(o[x]), keys) for o in document ]
+
+		if len(rows) == 1:
+			args = rows[0]
+		else:
+			# Rows are bound by psycopg2 into a single statement
+			# (like extras.execute_values() does). The number of
+			# rows varies, so such statement is not prepared.
+			cur = self.cursor()
+			row = ",".join([ cur.mogrify(row, r) for r in rows ])
+			args = []
+
+		fmt = [ "INSERT INTO", table, "(", self._delim(keys), ")", "VALUES", row ]
+
+		if conflict != None:
+			fmt.append(self.sql_conflict(conflict, keys))
 
 		need_return = isinstance(returning, (dict, list))
 
@@ -585,6 +1325,10 @@ class DBConnect(object):
 			fmt.extend([ "RETURNING", len(returning) > 0 and self._genlist(returning, '*') or '*' ])
 
 		qs = " ".join(runover(fmt))
+
+		if args:
+			return self._run(qs, args, need_return)
+
 		sqldbg(qs)
 
 		if need_return:
@@ -618,24 +1362,20 @@ class DBConnect(object):
 		if len(document) == 0:
 			raise ValueError("The 'document' should not be empty")
 
-		fmt = [ "UPDATE", self._genlist(tables, tables), "SET", self.sql_update(document) ]
+		args = []
+		fmt = [ "UPDATE", self._genlist(tables, tables), "SET", self.compile_update(document, args) ]
 		if len(spec) > 0:
-			fmt.extend([ "WHERE", self.sql_where(spec) ])
+			fmt.extend([ "WHERE", self.compile_where(spec, args) ])
 
 		need_return = isinstance(returning, (dict, list))
 
 		if need_return:
 			fmt.extend([ "RETURNING", len(returning) > 0 and self._genlist(returning, '*') or '*' ])
 
-		qs = " ".join(runover(fmt))
-		sqldbg(qs)
+		return self._run(" ".join(runover(fmt)), args, need_return)
 
-		if need_return:
-			return self.query(qs)
-		self.execute(qs)
 
-
-	def find(self, tables, spec=None, fields=None, sort=None, skip=0, limit=0, lock=None, nowait=False):
+	def find(self, tables, spec=None, fields=None, sort=None, skip=0, limit=0, lock=None, nowait=False, skip_locked=False, stream=False, rows=ROWS_DICT):
 		"""Query the database
 
 		The spec argument is a prototype document that all results must match.
@@ -655,11 +1395,25 @@ class DBConnect(object):
 		limit:  the maximum number of results to return;
 
 		sort:   a list of (key, direction) pairs specifying the sort order
-		        for this query.
+		        for this query;
+
+		lock:   lock the selected rows: 'update' or 'share';
+
+		nowait: fail if some row is locked by someone else;
+
+		skip_locked: skip rows locked by someone else (the result may be
+		        shorter than 'limit' or empty);
+
+		stream: fetch the result by parts using a server-side cursor
+		        (see stream());
+
+		rows:   format of the result rows: ROWS_DICT, ROWS_TUPLE
+		        (in order of 'fields') or ROWS_RECORD.
 		"""
+		args = []
 		fmt = [ "SELECT", self._genlist(fields, '*'), "FROM", self._genlist(tables, tables) ]
 		if isinstance(spec, dict):
-			fmt.extend([ "WHERE", self.sql_where(spec) ])
+			fmt.extend([ "WHERE", self.compile_where(spec, args) ])
 		if sort != None and len(sort) > 0:
 			fmt.extend([ "ORDER BY", self._genlist(sort, None) ])
 		if limit > 0:
@@ -675,14 +1429,24 @@ class DBConnect(object):
 				# Another syntax in MySQL: LOCK IN SHARE MODE
 				fmt.append("FOR SHARE")
 
+			if nowait and skip_locked:
+				raise ValueError("Options 'nowait' and 'skip_locked' are mutually exclusive")
+
 			# Unsupported in MySQL
 			if nowait:
 				fmt.append("NOWAIT")
 
+			elif skip_locked:
+				fmt.append("SKIP LOCKED")
+
 		qs = " ".join(runover(fmt))
-		sqldbg(qs)
 
-		return self.query(qs)
+		if stream:
+			# Prepared statements can not be used by DECLARE CURSOR.
+			sqldbg(qs)
+			return self.stream(qs, args, rows=rows)
+
+		return self._run(qs, args, True, rows)
 
 
 	def find_one(self, *args, **kwargs):
@@ -701,3 +1465,49 @@ class DBConnect(object):
 		All arguments to find() are also valid arguments for find_all().
 		"""
 		return self.find(*args, **kwargs).all()
+
+
+class DBListener(object):
+	"""Dedicated connection which waits for notifications
+
+	The connection is opened on the first call of wait() and reopened
+	after a failure. The channels are subscribed before the caller looks
+	for the work, so changes made after that moment are not missed.
+	"""
+
+	def __init__(self, channels, **kwargs):
+		self.channels = list(channels)
+		self.kwargs   = kwargs
+		self._db      = None
+
+
+	def subscribe(self):
+		"""Opens the connection and subscribes it to the channels"""
+
+		if self._db != None:
+			return
+
+		self._db = DBConnect(autocommit=True, **self.kwargs)
+		try:
+			self._db.listen(self.channels, 0)
+		except Exception:
+			self.close()
+			raise
+
+
+	def wait(self, timeout=None):
+		"""Waits for notifications, returns list of the channels"""
+
+		self.subscribe()
+		try:
+			return self._db.listen(self.channels, timeout)
+		except psycopg2.Error:
+			self.close()
+			raise
+
+
+	def close(self):
+		if self._db == None:
+			return
+		DB.drop_connection(self._db._conn)
+		self._db = None
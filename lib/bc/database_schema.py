@@ -7,11 +7,23 @@
 # This file is covered by the GNU General Public License,
 # which should be included with billing as the file COPYING.
 #
+import itertools
+
 from bc import database
 from bc import config
 
+# Sends notification to the channel named after the table.
+SQL_NOTIFY_FUNCTION = """
+CREATE OR REPLACE FUNCTION bc_notify() RETURNS trigger AS $$
+BEGIN
+	PERFORM pg_notify(TG_TABLE_NAME, '');
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
 class DBTable(object):
-	def __init__(self, name, conn=None, options=[], columns=[], indexes=[]):
+	def __init__(self, name, conn=None, options=[], columns=[], indexes=[], notify=None):
 		self.columns   = []
 		self.indexes   = []
 		self.tableopts = []
@@ -20,6 +32,11 @@ class DBTable(object):
 		self.name = name
 		self.set_table_options(options)
 
+		# Notify listeners of the channel named after the table on
+		# changes: { 'events': 'INSERT OR UPDATE', 'when': 'NEW.sync = 0' }.
+		# Without 'when' the notification is sent once per statement.
+		self.notify = notify
+
 		for o in columns:
 			# ( name, type [, constraint ] )
 			if len(o) < 2:
@@ -48,18 +65,45 @@ class DBTable(object):
 		yield ' '.join(res) + ';'
 
 
-	def sql_create_indexes(self):
+	def sql_create_indexes(self, exists=False):
 		for idx in self.indexes:
 			res = [ "CREATE" ]
 			if idx['unique'] == True:
 				res.append("UNIQUE")
-			res.extend([ "INDEX", idx['name'] ])
+			res.append("INDEX")
+			if exists:
+				res.append("IF NOT EXISTS")
+			res.append(idx['name'])
 			res.extend([ "ON", self.name ])
 			res.extend([ "USING", idx['method'] ])
 			res.append( "(" + ", ".join(idx['cols']) + ")")
 			yield " ".join(res) + ";"
 
 
+	def sql_create_triggers(self):
+		if not self.notify:
+			return
+
+		yield SQL_NOTIFY_FUNCTION
+
+		res = [ "CREATE TRIGGER", self.name + "_notify" ]
+		res.extend([ "AFTER", self.notify.get('events', 'INSERT'), "ON", self.name ])
+
+		if self.notify.get('when'):
+			res.extend([ "FOR EACH ROW WHEN", "(" + self.notify['when'] + ")" ])
+		else:
+			res.append("FOR EACH STATEMENT")
+
+		res.append("EXECUTE PROCEDURE bc_notify()")
+		yield " ".join(res) + ";"
+
+
+	def sql_drop_triggers(self):
+		if not self.notify:
+			return
+		yield "DROP TRIGGER IF EXISTS " + self.name + "_notify ON " + self.name + ";"
+
+
 	def sql_drop_table(self):
 		yield 'DROP TABLE IF EXISTS ' + self.name
 
@@ -103,6 +147,8 @@ class DBTable(object):
 			yield s
 		for s in self.sql_create_indexes():
 			yield s
+		for s in self.sql_create_triggers():
+			yield s
 
 
 	def sql_drop(self):
@@ -135,7 +181,8 @@ SCHEMA = [
 				("formula",   "varchar(32)",  "NOT NULL"),
 				("aggregate", "int",          "NOT NULL"),
 				("sync",      "int",          "NOT NULL DEFAULT '0'"),
-			]
+			],
+			notify = { 'events': 'INSERT OR UPDATE', 'when': 'NEW.sync = 0' }
 		)),
 	(LOCAL, DBTable("queue",
 			columns = [
@@ -168,8 +215,17 @@ SCHEMA = [
 				{ "cols": [ ("base_id", "ASC"), ("record_id", "ASC") ], 'unique': True },
 				{ "cols": [ ("group_id", "ASC") ] },
 				{ "cols": [ ("state", "ASC") ] },
+				{ "cols": [ ("state", "ASC"), ("group_id", "ASC") ] },
 			]
 		)),
+	(LOCAL, DBTable("schedule",
+			columns = [
+				# Range of the task groups (see bc.scheduler).
+				("id",          "int",          "NOT NULL PRIMARY KEY"),
+				("worker",      "int",          "NOT NULL DEFAULT '0'"),
+				("time_check",  "int",          "NOT NULL DEFAULT '0'"),
+			],
+		)),
 	(LOCAL, DBTable("bills",
 			columns = [
 				("id",       "varchar(36)",  "NOT NULL PRIMARY KEY"),
@@ -178,6 +234,7 @@ SCHEMA = [
 				("value",    "bigint",       "NOT NULL DEFAULT '0'"),
 				("sync",     "int",          "NOT NULL DEFAULT '0'"),
 			],
+			notify = { 'events': 'INSERT' }
 		)),
 	(GLOBAL, DBTable("customerbills",
 			columns = [
@@ -203,7 +260,8 @@ SCHEMA = [
 			],
 			indexes = [
 				{ "cols": [ ("state", "ASC"), ("metric_id", "ASC"), ("tariff_id","ASC") ] }
-			]
+			],
+			notify = { 'events': 'INSERT OR UPDATE', 'when': 'NEW.sync = 0' }
 		)),
 	(GLOBAL, DBTable("tariffs",
 			columns = [
@@ -217,7 +275,8 @@ SCHEMA = [
 			],
 			indexes = [
 				{ "cols": [ ("state", "ASC") ] }
-			]
+			],
+			notify = { 'events': 'INSERT OR UPDATE', 'when': 'NEW.sync = 0' }
 		)),
 	(GLOBAL, DBTable("customers",
 			columns = [
@@ -241,7 +300,8 @@ SCHEMA = [
 			],
 			indexes = [
 				{ "cols": [ ("login", "ASC"), ("state", "ASC") ], 'unique': True }
-			]
+			],
+			notify = { 'events': 'INSERT OR UPDATE', 'when': 'NEW.sync = 0' }
 		)),
 	(GLOBAL, DBTable("auth",
 			columns = [
@@ -253,7 +313,9 @@ SCHEMA = [
 			],
 			indexes = [
 				{ "cols": [ ("role", "ASC"), ("method", "ASC") ] }
-			]
+			],
+			# Cached access rules are reloaded (see bc_jsonrpc.secure).
+			notify = { 'events': 'INSERT OR UPDATE OR DELETE' }
 		)),
 ]
 
@@ -264,6 +326,21 @@ def create_schema(dbname=None, dbuser=None, dbpass=None):
 				table.create(db)
 
 
+def upgrade_schema(dbname=None, dbuser=None, dbpass=None):
+	"""Creates missing tables and indexes and recreates notification triggers
+
+	Data of the existing tables is kept. Changed columns of the existing
+	tables are not altered.
+	"""
+
+	for dbhosts, table in SCHEMA:
+		for dbhost in dbhosts:
+			with database.DBConnect(dbhost=dbhost, dbname=dbname, dbuser=dbuser, dbpass=dbpass, autocommit=True) as db:
+				for s in itertools.chain(table.sql_create_table(), table.sql_create_indexes(exists=True),
+						table.sql_drop_triggers(), table.sql_create_triggers()):
+					db.execute(s)
+
+
 def destroy_schema(dbname=None, dbuser=None, dbpass=None):
 	for dbhosts, table in SCHEMA:
 		for dbhost in dbhosts:
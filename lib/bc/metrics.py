@@ -8,6 +8,9 @@
 # This file is covered by the GNU General Public License,
 # which should be included with billing as the file COPYING.
 #
+import time
+import threading
+
 import bobject
 import readonly
 
@@ -23,43 +26,146 @@ class MetricConstants(object):
 
 constants = MetricConstants()
 
-class Metric(bobject.BaseObject):
-	def __init__(self, data = None):
-		self.__values__ = {
-			'id':         u'',
-			'type':       u'',
-			'formula':    u'',
-			'aggregate':  0,
-		}
+# Small integer codes of formulas for the fast dispatch in calculations.
+FORMULA_CODES = {
+	constants.FORMULA_SPEED: 1,
+	constants.FORMULA_TIME:  2,
+	constants.FORMULA_UNIT:  3,
+}
 
-		if data:
-			if 'sync' in data:
-				del data['sync']
-			self.set(data)
+class Metric(bobject.BaseObject):
+	__fields__ = [
+		('id',         u''),
+		('type',       u''),
+		('formula',    u''),
+		('aggregate',  0L),
+	]
 
 
 def add(metric):
-	"""Creates new billing metric"""
+	"""Creates new billing metric
+
+	An existing metric is not changed, the registry gets the stored one.
+	"""
 
 	with database.DBConnect() as db:
-		r = db.find_one('metrics', { 'id': metric.id })
-		if not r:
+		r = db.find_one('metrics', { 'id': metric.id },
+			fields=Metric.columns(), rows=database.ROWS_TUPLE)
+		if r:
+			metric = Metric.from_row(r)
+		else:
 			db.insert('metrics', metric.values)
 
+	REGISTRY.update([ metric ])
+
 
 def get_all():
 	"""Returns all metrics"""
 
 	with database.DBConnect() as db:
-		for i in db.find('metrics'):
-			yield Metric(i)
+		for i in db.find('metrics', fields=Metric.columns(), rows=database.ROWS_TUPLE):
+			yield Metric.from_row(i)
 
 
 def get(mid):
 	"""Returns metric by id or None if metric not found"""
 
 	with database.DBConnect() as db:
-		r = db.find_one('metrics', { 'id': mid })
+		r = db.find_one('metrics', { 'id': mid },
+			fields=Metric.columns(), rows=database.ROWS_TUPLE)
 		if r:
-			return Metric(r)
+			return Metric.from_row(r)
 		return None
+
+
+# How often the registry rereads the list of metrics (seconds).
+REFRESH_PERIOD = 60
+
+class Registry(object):
+	"""Metrics loaded by one query and shared by the process
+
+	The list is reread every 'period' seconds or on the first use after
+	expire() (it is safe to call from a signal handler). A metric which is
+	not in the list is read on demand once per period.
+	"""
+
+	def __init__(self, period=REFRESH_PERIOD):
+		self.period = period
+		self.loaded = 0
+		self.loads  = 0
+
+		# Metrics and formula codes by metric id. Both are replaced
+		# at once, so readers need no lock.
+		self._state   = ({}, {})
+		self._missing = set()
+		self._lock    = threading.Lock()
+
+
+	def expire(self):
+		"""Makes the next lookup reread the list"""
+
+		self.loaded = 0
+
+
+	def load(self):
+		"""Rereads all metrics in one query"""
+
+		with self._lock:
+			metrics = dict((m.id, m) for m in get_all())
+			self._state   = (metrics, self._codes(metrics))
+			self._missing = set()
+			self.loaded   = time.time()
+			self.loads   += 1
+
+
+	def update(self, objs):
+		"""Adds or replaces the metrics"""
+
+		with self._lock:
+			metrics = dict(self._state[0])
+			for m in objs:
+				metrics[m.id] = m
+				self._missing.discard(m.id)
+			self._state = (metrics, self._codes(metrics))
+
+
+	def _codes(self, metrics):
+		return dict((m.id, FORMULA_CODES.get(m.formula)) for m in metrics.itervalues())
+
+
+	def _refresh(self, mid=None):
+		if time.time() - self.loaded >= self.period:
+			self.load()
+
+		if mid == None or mid in self._state[0] or mid in self._missing:
+			return
+
+		m = get(mid)
+		if m:
+			self.update([ m ])
+		else:
+			self._missing.add(mid)
+
+
+	def get(self, mid):
+		"""Returns metric by id or None if metric not found"""
+
+		self._refresh(mid)
+		return self._state[0].get(mid)
+
+
+	def code(self, mid):
+		"""Returns formula code of the metric or None"""
+
+		self._refresh(mid)
+		return self._state[1].get(mid)
+
+
+	def all(self):
+		"""Returns list of all metrics"""
+
+		self._refresh()
+		return self._state[0].values()
+
+
+REGISTRY = Registry()
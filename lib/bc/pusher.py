@@ -0,0 +1,292 @@
+#
+# pusher.py
+#
+# Copyright (c) 2012-2013 by Alexey Gladkov
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+import time
+import Queue
+import logging
+import threading
+
+from bc import database
+
+LOG = logging.getLogger("pusher")
+
+# Number of records sent to a zone by one request.
+BATCH_SIZE = 500
+
+# Number of batches queued for a zone. If the queue of a zone is full,
+# the reading waits for the zone.
+QUEUE_DEPTH = 4
+
+# Seconds to wait for the full queue of a zone. If the zone does not take
+# the batch in time, it gets the remaining records on the next pass.
+PUT_TIMEOUT = 60
+
+# The records are read with the hash of the whole row. The record is
+# identified by the id and the hash, so the modified record has another
+# key and is sent again.
+SQL_READ = """
+SELECT t.*, md5(t::text) AS sync_hash
+FROM {table} AS t
+WHERE t.sync = 0 {after}
+ORDER BY t.id
+LIMIT %s
+"""
+
+# The record is marked only if it is not modified since it was read.
+SQL_MARK = """
+UPDATE {table} AS t SET sync = 1
+FROM unnest(%s::text[], %s::text[]) AS k(id, hash)
+WHERE t.id = k.id AND md5(t::text) = k.hash
+RETURNING t.id
+"""
+
+
+class Zone(threading.Thread):
+	"""Sends batches of records to one zone
+
+	Batches are sent in order by the own thread of the zone. After the
+	first failure the remaining batches of the pass are not sent.
+
+	The zone remembers the keys of the records it has accepted, so they
+	are not sent again while other zones are behind. The thread hands the
+	results back through the queue of the Pusher, 'delivered' is used by
+	the Pusher only.
+	"""
+
+	def __init__(self, name, client, depth=QUEUE_DEPTH):
+		threading.Thread.__init__(self, name='zone-' + name)
+		self.daemon = True
+
+		self.zone   = name
+		self.client = client
+		self.queue  = Queue.Queue(depth)
+		self.failed = False
+
+		# Accepted records by table.
+		self.delivered = {}
+
+		self.stat = {
+			'rows':     0,    # accepted records
+			'batches':  0,    # accepted batches
+			'failures': 0,    # failed requests
+			'skipped':  0,    # records postponed by the stuck queue
+			'time':     0.0,  # time of the requests (seconds)
+		}
+		self.start()
+
+
+	def run(self):
+		while True:
+			job = self.queue.get()
+			if job == None:
+				break
+
+			table, items, results = job
+			ok = False
+
+			if not self.failed:
+				t = time.time()
+				try:
+					self.client.syncList({ 'table': table, 'list': [ r for k, r in items ] })
+					ok = True
+
+				except Exception as e:
+					LOG.exception("zone(%s): %s", self.zone, e)
+					self.failed = True
+					self.stat['failures'] += 1
+
+				self.stat['time'] += time.time() - t
+
+			if ok:
+				self.stat['rows']    += len(items)
+				self.stat['batches'] += 1
+
+			results.put((self, items, ok))
+
+
+	def missing(self, table, items):
+		"""Returns (key, record) pairs which were not accepted by the zone"""
+
+		done = self.delivered.get(table, ())
+		return [ (k, r) for k, r in items if k not in done ]
+
+
+	def rate(self):
+		"""Returns throughput of the zone (records per second)"""
+
+		if self.stat['time'] == 0:
+			return 0.0
+		return self.stat['rows'] / self.stat['time']
+
+
+	def close(self):
+		self.queue.put(None)
+
+
+class Pusher(object):
+	"""Replicates unsynchronized records to all zones
+
+	Records are read by batches of 'batch' records and every batch is
+	sent to all zones at once. The record is marked as synchronized when
+	all zones have accepted it. A slow zone throttles the reading when its
+	queue is full, a failed zone does not stop the others: they go on with
+	the next batches and the failed zone gets only its missing records
+	later.
+	"""
+
+	def __init__(self, zones, batch=BATCH_SIZE, depth=QUEUE_DEPTH, timeout=PUT_TIMEOUT):
+		self.batch   = batch
+		self.timeout = timeout
+		self.zones   = [ Zone(n, c, depth) for n, c in sorted(zones.iteritems()) ]
+		self.results = Queue.Queue()
+
+		self.stat = {
+			'rows': 0,    # synchronized records
+			'time': 0.0,  # time of the passes (seconds)
+		}
+
+		self._inflight = 0
+
+
+	def synced(self, table, keys):
+		"""Returns keys of records accepted by all zones"""
+
+		return [ k for k in keys if all(k in z.delivered.get(table, ()) for z in self.zones) ]
+
+
+	def mark(self, db, table, keys):
+		"""Marks the records accepted by all zones as synchronized
+
+		A record is marked only if it is not modified since it was read,
+		otherwise the new version is sent by the next pass.
+		"""
+		keys = self.synced(table, keys)
+		if not keys:
+			return 0
+
+		count = len(db.query(SQL_MARK.format(table = table),
+			([ k[0] for k in keys ], [ k[1] for k in keys ])).all())
+
+		# Synchronized records are not read again and
+		# the modified ones have another key.
+		for z in self.zones:
+			z.delivered[table].difference_update(keys)
+
+		return count
+
+
+	def send(self, db, table, items):
+		"""Queues the (key, record) pairs for all zones
+
+		The full queue of a zone stops the reading until the zone takes
+		the batch, so the slowest zone sets the pace. Only the failed zone
+		or the zone which is stuck longer than 'timeout' is skipped.
+		"""
+
+		for z in self.zones:
+			if z.failed:
+				continue
+
+			missing = z.missing(table, items)
+			if not missing:
+				continue
+
+			try:
+				z.queue.put((table, missing, self.results), timeout=self.timeout)
+				self._inflight += 1
+
+			except Queue.Full:
+				z.stat['skipped'] += len(missing)
+
+		# Records which were sent by the previous passes.
+		return self.mark(db, table, [ k for k, r in items ])
+
+
+	def collect(self, db, table, block):
+		"""Marks the records of the finished requests"""
+
+		res = 0
+		while self._inflight > 0:
+			try:
+				z, items, ok = self.results.get(block)
+			except Queue.Empty:
+				break
+
+			self._inflight -= 1
+			if ok:
+				keys = [ k for k, r in items ]
+				z.delivered.setdefault(table, set()).update(keys)
+				res += self.mark(db, table, keys)
+		return res
+
+
+	def push(self, table):
+		"""Synchronizes the table and returns number of synchronized records"""
+
+		start = time.time()
+		count = 0
+		seen  = set()
+		done  = False
+
+		for z in self.zones:
+			z.failed = False
+
+		with database.DBConnect() as db:
+			last = None
+
+			while not all(z.failed for z in self.zones):
+				if last == None:
+					rows = db.query(SQL_READ.format(table = table, after = ''), (self.batch,)).all()
+				else:
+					rows = db.query(SQL_READ.format(table = table, after = 'AND t.id > %s'), (last, self.batch)).all()
+
+				if not rows:
+					done = True
+					break
+
+				last = rows[-1]['id']
+
+				# The hash is not sent to the zones.
+				items = [ ((r['id'], r.pop('sync_hash')), r) for r in rows ]
+				seen.update(k for k, r in items)
+
+				count += self.send(db, table, items)
+				count += self.collect(db, table, False)
+
+			count += self.collect(db, table, True)
+
+		# Forget the records which were modified or removed.
+		if done:
+			for z in self.zones:
+				if table in z.delivered:
+					z.delivered[table] &= seen
+
+		elapsed = max(time.time() - start, 0.001)
+
+		self.stat['rows'] += count
+		self.stat['time'] += elapsed
+
+		if count > 0:
+			LOG.info("table(%s): synced=%d rows/s=%.1f", table, count, count / elapsed)
+
+		return count
+
+
+	def report(self):
+		"""Logs throughput of all zones"""
+
+		for z in self.zones:
+			LOG.info("zone(%s): rows/s=%.1f %s", z.zone, z.rate(), z.stat)
+
+
+	def close(self):
+		for z in self.zones:
+			z.close()
+		for z in self.zones:
+			z.join()
@@ -51,27 +51,27 @@ class RateConstants(object):
 
 constants = RateConstants()
 
-class Rate(bobject.BaseObject):
-	def __init__(self, data = None):
-
-		c = RateConstants()
-
-		self.__values__ = {
-			'id':           str(uuid.uuid4()),
-			'description':  u'',
-			'metric_id':    u'',
-			'tariff_id':    u'',
-			'rate':         0L,
-			'currency':     c.CURRENCY_RUB,
-			'state':        c.STATE_ACTIVE,
-			'time_create':  int(time.time()),
-			'time_destroy': 0
-		}
+# Resolved rates are cached for this number of seconds. Changes made by
+# add(), modify(), remove() and by synchronization drop the cache earlier.
+RESOLVE_TTL = 60
+
+# Maximum number of cached (metric, tariff) pairs.
+RESOLVE_CACHE_SIZE = 10000
+
+RESOLVED = database.TTLCache(RESOLVE_CACHE_SIZE, RESOLVE_TTL)
 
-		if data:
-			if 'sync' in data:
-				del data['sync']
-			self.set(data)
+class Rate(bobject.BaseObject):
+	__fields__ = [
+		('id',           lambda: unicode(uuid.uuid4())),
+		('description',  u''),
+		('metric_id',    u''),
+		('tariff_id',    u''),
+		('rate',         0L),
+		('currency',     constants.CURRENCY_RUB),
+		('state',        constants.STATE_ACTIVE),
+		('time_create',  lambda: long(time.time())),
+		('time_destroy', 0L),
+	]
 
 
 def add(obj):
@@ -87,7 +87,7 @@ def add(obj):
 		if not r:
 			raise ValueError("Wrong tariff")
 
-		r = metrics.get(obj.metric_id)
+		r = metrics.REGISTRY.get(obj.metric_id)
 		if not r:
 			raise ValueError("Wrong metric")
 
@@ -95,6 +95,8 @@ def add(obj):
 		if not r:
 			db.insert('rates', obj.values)
 
+	invalidate(obj.metric_id, obj.tariff_id)
+
 
 def remove(tid, mid):
 	"""Disables rate"""
@@ -129,6 +131,8 @@ def remove(tid, mid):
 			}
 		)
 
+	invalidate(mid, tid)
+
 
 def modify(tid, mid, params):
 	"""Modify rate"""
@@ -146,48 +150,113 @@ def modify(tid, mid, params):
 			params
 		)
 
+	if 'metric_id' in params or 'tariff_id' in params:
+		invalidate()
+	else:
+		invalidate(mid, tid)
+
 
 def get_all():
 	c = RateConstants()
 
 	with database.DBConnect() as db:
-		for o in db.find('rates', { 'state': { '$lt': c.STATE_DELETED }}):
-			yield Rate(o)
+		for o in db.find('rates', { 'state': { '$lt': c.STATE_DELETED }},
+				fields=Rate.columns(), rows=database.ROWS_TUPLE, stream=True):
+			yield Rate.from_row(o)
 
 
 def get_by_tariff(tid):
 	c = RateConstants()
 
 	with database.DBConnect() as db:
-		for o in db.find('rates', { 'tariff_id': tid, 'state': { '$lt': c.STATE_DELETED }}):
-			yield Rate(o)
+		for o in db.find('rates', { 'tariff_id': tid, 'state': { '$lt': c.STATE_DELETED }},
+				fields=Rate.columns(), rows=database.ROWS_TUPLE):
+			yield Rate.from_row(o)
 
 
 def get_by_metric(tid, mid):
 	with database.DBConnect() as db:
-		o = db.find_one('rates', { 'tariff_id': tid, 'metric_id': mid })
+		o = db.find_one('rates', { 'tariff_id': tid, 'metric_id': mid },
+			fields=Rate.columns(), rows=database.ROWS_TUPLE)
 		if o:
-			return Rate(o)
+			return Rate.from_row(o)
 		return None
 
 
+def invalidate(mid=None, tid=None):
+	"""Drops cached resolutions of the rate
+
+	Without arguments drops all of them. The rate of the '*' tariff is
+	a fallback for every tariff, so its change drops all of them too.
+	"""
+
+	if mid == None or tid == None or tid == '*':
+		RESOLVED.clear()
+		return
+
+	RESOLVED.remove((mid, tid))
+
+
+def resolve_stats():
+	"""Returns counters of the rate resolution cache"""
+
+	res = RESOLVED.stats()
+
+	total = res['hits'] + res['misses']
+	res['hitrate'] = total and float(res['hits']) / total or 0.0
+
+	return res
+
+
 def resolve(mid, tid):
-	"""Rate information by tariff and metric"""
+	"""Rate information by tariff and metric
+
+	The rate of the tariff is preferred to the rate of the '*' tariff.
+	Returns (None, None) if there is no active rate.
+	"""
+
+	key = (mid, tid)
+	return resolve_many([ key ])[key]
+
+
+def resolve_many(pairs):
+	"""Rate information for the list of (metric_id, tariff_id) pairs
+
+	Returns dictionary of (rate_id, rate) by pair as resolve() does.
+	Pairs missing in the cache are resolved by one query.
+	"""
+
+	res = {}
+	misses = []
+
+	for key in set(pairs):
+		r = RESOLVED.get(key)
+		if r != None:
+			res[key] = r
+		else:
+			misses.append(key)
+
+	if not misses:
+		return res
 
 	c = RateConstants()
+	generation = RESOLVED.generation
+	found = {}
 
 	with database.DBConnect() as db:
-		r = db.find_one('rates',
+		for r in db.find('rates',
 			{
 				'state':     c.STATE_ACTIVE,
-				'metric_id': mid,
-				'$or': [
-					{ 'tariff_id': tid },
-					{ 'tariff_id': '*' }
-				]
+				'metric_id': list(set(m for m, t in misses)),
+				'tariff_id': list(set(t for m, t in misses)) + [ '*' ],
 			},
-			fields=[ 'id', 'rate' ]
-		)
-		if not r:
-			return (None, None)
-		return (r['id'], r['rate'])
+			fields=[ 'id', 'rate', 'metric_id', 'tariff_id' ]
+		):
+			found[(r['metric_id'], r['tariff_id'])] = (r['id'], r['rate'])
+
+	for key in misses:
+		r = found.get(key) or found.get((key[0], '*')) or (None, None)
+		RESOLVED.add(key, r, generation)
+		res[key] = r
+
+	return res
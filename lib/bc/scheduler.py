@@ -0,0 +1,219 @@
+#
+# scheduler.py
+#
+# Copyright (c) 2012-2013 by Alexey Gladkov
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+import time
+import logging
+
+from bc import database
+from bc import tasks
+
+LOG = logging.getLogger("scheduler")
+
+# Size of the group_id space (see polinomial.permutation()).
+GROUPS = 2 ** 16
+
+# Number of ranges per worker. A range is the unit of work stealing.
+RANGES_PER_WORKER = 4
+
+# How long to sleep if there is nothing to do (seconds).
+IDLE_DELAY = 1
+
+# How often the counters are logged (seconds).
+STAT_PERIOD = 60
+
+# Growth of the idle delay after each pass without work.
+BACKOFF_FACTOR = 2
+
+# Loose index scan over (state, group_id). Returns each group with enabled
+# tasks once and does not read the tasks of the group.
+SQL_ACTIVE_GROUPS = """
+WITH RECURSIVE g AS (
+	(SELECT group_id FROM tasks WHERE state = %(state)s ORDER BY group_id LIMIT 1)
+	UNION ALL
+	SELECT (SELECT group_id FROM tasks
+	        WHERE state = %(state)s AND group_id > g.group_id
+	        ORDER BY group_id LIMIT 1)
+	FROM g WHERE g.group_id IS NOT NULL
+)
+SELECT group_id FROM g WHERE group_id IS NOT NULL
+"""
+
+SQL_CREATE_RANGES = """
+INSERT INTO schedule (id) SELECT generate_series(0, %(last)s)
+ON CONFLICT (id) DO NOTHING
+"""
+
+# The range is leased to the worker until the end of the period.
+SQL_CLAIM_RANGE = """
+UPDATE schedule SET worker = %(worker)s, time_check = %(now)s
+WHERE id = %(id)s AND time_check <= %(now)s - %(period)s
+RETURNING id
+"""
+
+
+class Backoff(object):
+	"""Exponential idle delay
+
+	The delay starts from 'low' and is multiplied by 'factor' after each
+	idle pass up to 'high'. Any work resets it.
+	"""
+
+	def __init__(self, low, high, factor=BACKOFF_FACTOR):
+		if low <= 0 or high < low:
+			raise ValueError("Wrong backoff bounds: " + str((low, high)))
+
+		self.low    = low
+		self.high   = high
+		self.factor = factor
+		self.delay  = low
+
+
+	def idle(self):
+		"""Returns the delay for this idle pass and grows the next one"""
+
+		res = self.delay
+		self.delay = min(self.delay * self.factor, self.high)
+		return res
+
+
+	def reset(self):
+		self.delay = self.low
+
+
+class Scheduler(object):
+	"""Distributes the task groups between the calc workers
+
+	The group_id space is split into ranges. Each worker owns ranges
+	number 'worker', 'worker' + 'workers', ... and processes them first.
+	Then it steals ranges of other workers which were not processed during
+	the last 'period' seconds. A range is leased through the 'schedule'
+	table, so two workers never process the same range at once.
+
+	Only groups with enabled tasks are returned.
+	"""
+
+	def __init__(self, worker, workers, period, ranges=None, idle=IDLE_DELAY):
+		self.worker  = worker
+		self.workers = workers
+		self.period  = period
+		self.ranges  = ranges or workers * RANGES_PER_WORKER
+		self.idle    = idle
+
+		self.stat = {
+			'rounds':     0,  # passes over all ranges
+			'groups':     0,  # processed groups
+			'empty':      0,  # processed groups without tasks
+			'collisions': 0,  # groups with tasks locked by someone else
+			'skipped':    0,  # tasks locked by someone else
+			'stolen':     0,  # claimed ranges of other workers
+			'busy':       0,  # ranges claimed by someone else
+		}
+		self.stat_time = time.time()
+
+		self._active  = {}
+		self._pending = []
+		self._queue   = []
+		self._created = False
+
+
+	def range_of(self, group_id):
+		return group_id * self.ranges // GROUPS
+
+
+	def owner(self, range_id):
+		return range_id % self.workers
+
+
+	def active_groups(self):
+		"""Returns lists of groups with enabled tasks by range"""
+
+		res = {}
+		with database.DBConnect(dbtype='local') as db:
+			for r in db.query(SQL_ACTIVE_GROUPS,
+					{ 'state': tasks.constants.STATE_ENABLED }, rows=database.ROWS_TUPLE):
+				res.setdefault(self.range_of(r[0]), []).append(r[0])
+		return res
+
+
+	def claim(self, range_id):
+		"""Leases the range and returns True on success"""
+
+		with database.DBConnect(dbtype='local') as db:
+			params = {
+				'id':     range_id,
+				'worker': self.worker,
+				'now':    int(time.time()),
+				'period': self.period,
+			}
+
+			if db.query(SQL_CLAIM_RANGE, params).one():
+				return True
+
+			# Usually the range is leased by someone else. The ranges
+			# are created once, on the first failed claim.
+			if self._created:
+				return False
+
+			db.execute(SQL_CREATE_RANGES, { 'last': self.ranges - 1 })
+			self._created = True
+
+			return db.query(SQL_CLAIM_RANGE, params).one() != None
+
+
+	def start_round(self):
+		self.stat['rounds'] += 1
+
+		if time.time() - self.stat_time >= STAT_PERIOD:
+			LOG.info("worker(%s): %s", self.worker, self.stat)
+			self.stat_time = time.time()
+
+		self._active = self.active_groups()
+
+		# Own ranges first, then ranges of the next workers.
+		self._pending = sorted(self._active.keys(),
+			key = lambda r: ((self.owner(r) - self.worker) % self.workers, r))
+
+
+	def next(self):
+		"""Returns the next group to process"""
+
+		while not self._queue:
+			if not self._pending:
+				self.start_round()
+
+				if not self._pending:
+					time.sleep(self.idle)
+					continue
+
+			r = self._pending.pop(0)
+
+			if not self.claim(r):
+				self.stat['busy'] += 1
+				if not self._pending:
+					time.sleep(self.idle)
+				continue
+
+			if self.owner(r) != self.worker:
+				self.stat['stolen'] += 1
+
+			self._queue = list(reversed(self._active[r]))
+
+		return self._queue.pop()
+
+
+	def report(self, group_id, stat):
+		"""Accounts the result of CalcEngine.process() of the group"""
+
+		self.stat['groups'] += 1
+
+		if stat['skipped']:
+			self.stat['collisions'] += 1
+			self.stat['skipped'] += stat['skipped']
+		elif stat['tasks'] == 0:
+			self.stat['empty'] += 1
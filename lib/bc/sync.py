@@ -8,6 +8,7 @@
 # This file is covered by the GNU General Public License,
 # which should be included with billing as the file COPYING.
 #
+import collections
 
 from bc import database
 
@@ -17,31 +18,83 @@ from bc import metrics
 from bc import rates
 from bc import tariffs
 
+SYNC_TABLES = {
+	'customerbills': bills.Bill,
+	'customers':     customers.Customer,
+	'metrics':       metrics.Metric,
+	'rates':         rates.Rate,
+	'tariffs':       tariffs.Tariff
+}
+
+
+def _synced(table, objs):
+	"""Drops cached data which depends on the synchronized records"""
+
+	if table == 'customers':
+		for o in objs:
+			customers.invalidate('id', o.id)
+		return
+
+	if table == 'metrics':
+		metrics.REGISTRY.update(objs)
+		return
+
+	if table != 'rates':
+		return
+
+	if len(objs) >= database.COPY_THRESHOLD:
+		rates.invalidate()
+		return
+
+	for o in objs:
+		rates.invalidate(o.metric_id, o.tariff_id)
+
 
 def record(table, params):
+	records(table, [ params ])
+
 
-	SYNC_TABLES = {
-		'customerbills': bills.Bill,
-		'customers':     customers.Customer,
-		'metrics':       metrics.Metric,
-		'rates':         rates.Rate,
-		'tariffs':       tariffs.Tariff
-	}
+def records(table, params_list):
+	"""Synchronizes list of records in one transaction
+
+	The records are inserted or updated by INSERT ... ON CONFLICT. Large
+	lists are loaded by COPY into a temporary table first.
+	"""
 
 	if table not in SYNC_TABLES:
 		raise ValueError("Not synchronizable table")
 
-	o = SYNC_TABLES[table](params)
+	# The last record with the same id wins.
+	objs = collections.OrderedDict()
+	for params in params_list:
+		o = SYNC_TABLES[table](params)
+		objs[o.id] = o
+
+	if not objs:
+		return
+
+	columns = SYNC_TABLES[table].columns()
+	stage   = "sync_" + table
+
+	fields = ",".join(columns)
 
-	with database.DBConnect() as db:
-		try:
-			db.insert(table, o.values)
+	with database.DBConnect(autocommit=False) as db:
+		if len(objs) < database.COPY_THRESHOLD:
+			db.insert(table, [ o.values for o in objs.itervalues() ], conflict='id')
+			db.commit()
+
+			_synced(table, objs.values())
 			return
 
-		except database.DatabaseError, e:
-			if e.pgcode != '23505':
-				raise
-			# Ignore duplicate key value violates unique constraint
-			pass
+		db.execute("CREATE TEMPORARY TABLE " + stage +
+			" (LIKE " + table + " INCLUDING DEFAULTS) ON COMMIT DROP")
+
+		db.copy_in(stage, (o.values for o in objs.itervalues()), columns)
+
+		db.execute("INSERT INTO " + table + " (" + fields + ") " +
+			"SELECT " + fields + " FROM " + stage + " " +
+			db.sql_conflict('id', columns))
+
+		db.commit()
 
-		db.update(table, { 'id': o.id }, o.values)
+	_synced(table, objs.values())
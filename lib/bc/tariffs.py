@@ -35,21 +35,14 @@ class TariffConstants(object):
 constants = TariffConstants()
 
 class Tariff(bobject.BaseObject):
-	def __init__(self, data = None):
-
-		c = TariffConstants()
-
-		self.__values__ = {
-			'id':           unicode(uuid.uuid4()),
-			'name':         u'',
-			'description':  u'',
-			'state':        c.STATE_ENABLED,
-			'time_create':  int(time.time()),
-			'time_destroy': 0,
-		}
-
-		if data:
-			self.set(data)
+	__fields__ = [
+		('id',           lambda: unicode(uuid.uuid4())),
+		('name',         u''),
+		('description',  u''),
+		('state',        constants.STATE_ENABLED),
+		('time_create',  lambda: long(time.time())),
+		('time_destroy', 0L),
+	]
 
 
 def get(tid):
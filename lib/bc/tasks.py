@@ -44,50 +44,42 @@ class TaskConstants(object):
 constants = TaskConstants()
 
 class Task(bobject.BaseObject):
-	def __init__(self, data = None):
+	__fields__ = [
+		# Уникальный идентификатор задания
+		('task_id',        lambda: unicode(uuid.uuid4())),
+		('base_id',        lambda: unicode(uuid.uuid4())),
+		('record_id',      u'0'),
 
-		c = TaskConstants()
-		now = int(time.time())
+		('queue_id',       u''),
+		('group_id',       0L),
 
-		self.__values__ = {
-			# Уникальный идентификатор задания
-			'task_id':        unicode(uuid.uuid4()),
-			'base_id':        unicode(uuid.uuid4()),
-			'record_id':      u'0',
+		# Владелец задания, тот чей счёт используется
+		('customer',       u''),
 
-			'queue_id':       u'',
-			'group_id':       0L,
+		# Уникальный идентификатор правила тарифа
+		('rate_id',        u''),
 
-			# Владелец задания, тот чей счёт используется
-			'customer':       u'',
+		# Уникальный идентификатор метрики
+		('metric_id',      u''),
 
-			# Уникальный идентификатор правила тарифа
-			'rate_id':        u'',
+		# (Дупликация) стоймость метрики в тарифе
+		('rate',           0L),
 
-			# Уникальный идентификатор метрики
-			'metric_id':      u'',
+		# Текущее состояние задания
+		('state',          constants.STATE_ENABLED),
 
-			# (Дупликация) стоймость метрики в тарифе
-			'rate':           0L,
+		# Значение ресурса задания. Это может быть время или штуки
+		('value',          0L),
 
-			# Текущее состояние задания
-			'state':          c.STATE_ENABLED,
+		# Тайминги задания
+		('time_create',    lambda: long(time.time())),
+		('time_destroy',   0L),
 
-			# Значение ресурса задания. Это может быть время или штуки
-			'value':          0L,
-
-			# Тайминги задания
-			'time_create':    now,
-			'time_destroy':   0,
-
-			# (Опциональные) биллинговые данные, описывающие характер VALUE
-			'target_user':    u'',
-			'target_uuid':    u'',
-			'target_descr':   u'',
-		}
-
-		if data:
-			self.set(data)
+		# (Опциональные) биллинговые данные, описывающие характер VALUE
+		('target_user',    u''),
+		('target_uuid',    u''),
+		('target_descr',   u''),
+	]
 
 
 def add(obj):
@@ -107,6 +99,95 @@ def add(obj):
 		db.commit()
 
 
+def _existing(db, ids):
+	"""Returns base_ids of the tasks which are in the database"""
+
+	return [ r[0] for r in db.find('tasks', { 'base_id': ids, 'record_id': '0' },
+		fields=[ 'base_id' ], rows=database.ROWS_TUPLE) ]
+
+
+def _write(db, values, queue):
+	if len(values) >= database.COPY_THRESHOLD:
+		db.copy_in('tasks', values, Task.columns())
+		db.copy_in('queue', queue, [ 'id', 'time_check' ])
+	else:
+		db.insert('tasks', values)
+		db.insert('queue', queue)
+
+
+def add_many(objs):
+	"""Adds list of tasks
+
+	Tasks are grouped by the shard of base_id. Tasks and queue items of
+	a shard are written by one multi-row statement each in one
+	transaction. Tasks which are already in the database or repeated in
+	the list are not added. Task objects are not modified: queue items
+	of the tasks without queue_id get new ids in the database only.
+
+	Returns list of errors in the order of 'objs': None if the task was
+	added or the exception.
+	"""
+
+	res = [ None ] * len(objs)
+	index = {}
+
+	for i, o in enumerate(objs):
+		if o.base_id in index:
+			res[i] = ValueError("Task is repeated: " + o.base_id)
+			continue
+		index[o.base_id] = i
+
+	now = int(time.time())
+
+	for host, ids in database.get_hosts(index.keys()).iteritems():
+		try:
+			with database.DBConnect(dbhost=host, autocommit=False) as db:
+				values = {}
+				for i in ids:
+					v = objs[index[i]].values
+					if not v['queue_id']:
+						v['queue_id'] = str(uuid.uuid4())
+					values[i] = v
+
+				found = _existing(db, ids)
+
+				while True:
+					for i in found:
+						res[index[i]] = ValueError("Task already exists: " + i)
+						values.pop(i, None)
+
+					if not values:
+						break
+
+					# The same task may be added by someone else since
+					# the check. Such tasks are found again and the rest
+					# of the shard is written.
+					db.execute("SAVEPOINT add_many")
+					try:
+						_write(db, values.values(),
+							[ { 'id': v['queue_id'], 'time_check': now } for v in values.itervalues() ])
+						break
+
+					except database.DatabaseError as e:
+						# Unique violation.
+						if e.pgcode != '23505':
+							raise e
+						db.execute("ROLLBACK TO SAVEPOINT add_many")
+
+						found = _existing(db, values.keys())
+						if not found:
+							raise e
+
+				db.commit()
+
+		except Exception as e:
+			for i in ids:
+				if res[index[i]] == None:
+					res[index[i]] = e
+
+	return res
+
+
 def modify(typ, val, params):
 	"""Modify task"""
 
@@ -144,11 +225,12 @@ def update(id, params, ts=0):
 	with database.DBConnect(primarykey=id, autocommit=False) as db:
 
 		ot = db.find_one('tasks',
-			{ 'base_id': id, 'record_id': '0' })
+			{ 'base_id': id, 'record_id': '0' },
+			fields=Task.columns(), rows=database.ROWS_TUPLE)
 		if not ot:
 			return
 
-		nt = Task(ot)
+		nt = Task.from_row(ot)
 		nt.set(params)
 		nt.queue_id = str(uuid.uuid4())
 		nt.task_id  = str(uuid.uuid4())
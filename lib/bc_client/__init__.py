@@ -8,10 +8,11 @@
 # which should be included with billing as the file COPYING.
 #
 from client import BCClient
+from asyncclient import AsyncBCClient
 
 
-def Customers(auth, server):
-	return BCClient(
+def Customers(auth, server, client=BCClient):
+	return client(
 		{
 			'customerList':    'customers',
 			'customerGet':     'customer',
@@ -22,8 +23,8 @@ def Customers(auth, server):
 		}, auth, server)
 
 
-def Metrics(auth, server):
-	return BCClient(
+def Metrics(auth, server, client=BCClient):
+	return client(
 		{
 		'metricList':'metrics',
 		'metricAdd': 'id',
@@ -31,8 +32,8 @@ def Metrics(auth, server):
 		}, auth, server)
 
 
-def Rates(auth, server):
-	return BCClient(
+def Rates(auth, server, client=BCClient):
+	return client(
 		{
 		'rateList':  'rates',
 		'rateGet':   'rate',
@@ -42,8 +43,8 @@ def Rates(auth, server):
 		}, auth, server)
 
 
-def Tariffs(auth, server):
-	return BCClient(
+def Tariffs(auth, server, client=BCClient):
+	return client(
 		{
 		'tariffList':       'tariffs',
 		'tariffGet':        'tariff',
@@ -53,16 +54,17 @@ def Tariffs(auth, server):
 		}, auth, server)
 
 
-def Tasks(auth, server):
-	return BCClient(
+def Tasks(auth, server, client=BCClient):
+	return client(
 		{
 		'taskAdd':   'id',
+		'taskAddMany':'tasks',
 		'taskModify':'status',
 		'taskRemove':'status',
 		}, auth, server)
 
-def Sync(auth, server):
-	return BCClient(
+def Sync(auth, server, client=BCClient):
+	return client(
 		{
 		'sync':    'status',
 		'syncList':'status',
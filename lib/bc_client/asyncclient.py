@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+#
+# asyncclient.py
+#
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+
+import Queue
+import threading
+
+from bc import log
+from bc_jsonrpc import http
+
+from client import BillingError
+from client import Future
+from client import address
+from client import redirect
+from client import result
+
+LOG = log.logger("client.async", syslog=False)
+
+# Number of requests in flight.
+WORKERS = 8
+
+# Timeout of the server connections (seconds).
+TIMEOUT = 30
+
+
+def gather(futures, timeout=None):
+	"""Returns results of all futures in the same order"""
+
+	return [ f.result(timeout) for f in futures ]
+
+
+class AsyncBCClient(object):
+	"""Billing client which does not wait for the responses
+
+	Methods are the same as methods of BCClient, but they return Future
+	instead of the result. Requests are sent by 'workers' threads, so up
+	to 'workers' requests are in flight at once. Every worker keeps
+	connections to the servers open between requests.
+	"""
+
+	def __init__(self, method_dict, auth, local_server=None, workers=WORKERS, timeout=TIMEOUT):
+		self.method_dict  = method_dict
+		self.auth         = auth
+		self.local_server = local_server
+		self.timeout      = timeout
+
+		for name in method_dict.keys():
+			setattr(self, name, self.__method(name))
+
+		self.queue   = Queue.Queue()
+		self.workers = []
+
+		for i in xrange(workers):
+			t = threading.Thread(target=self.__worker)
+			t.daemon = True
+			t.start()
+			self.workers.append(t)
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, traceback):
+		self.close()
+
+
+	def __method(self, name):
+		return lambda json={}, server=None: self.submit(name, json, server or self.local_server)
+
+
+	def submit(self, method, json_data, server):
+		"""Queues the request and returns Future of the result"""
+
+		f = Future()
+
+		if not server:
+			f.set_exception(BillingError("Server not specified"))
+			return f
+
+		self.queue.put((f, method, json_data, server))
+		return f
+
+
+	def close(self):
+		"""Waits for the queued requests and stops the workers"""
+
+		for t in self.workers:
+			self.queue.put(None)
+		for t in self.workers:
+			t.join()
+		self.workers = []
+
+
+	def __worker(self):
+		conns = http.Connections(self.timeout)
+
+		while True:
+			job = self.queue.get()
+			if job == None:
+				break
+
+			f, method, json_data, server = job
+			try:
+				f.set_result(self.__request(conns, method, json_data, server))
+
+			except Exception as e:
+				LOG.error("Failed to communicate with Billing: %s", e)
+				f.set_exception(e)
+
+		conns.close()
+
+
+	def __send(self, conns, method, json_data, server):
+		host, port = address(server)
+		return http.jsonrpc_http_request(conns,
+			host, port, method, json_data,
+			auth_data=self.auth)
+
+
+	def __request(self, conns, method, json_data, server):
+		response = self.__send(conns, method, json_data, server)
+
+		srv = redirect(response)
+		if srv:
+			response = self.__send(conns, method, json_data, srv)
+
+		return result(self.method_dict, method, response)
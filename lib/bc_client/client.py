@@ -8,6 +8,8 @@
 # which should be included with billing as the file COPYING.
 #
 
+import threading
+
 from connectionpool import HTTPConnectionPool
 
 from bc import log
@@ -26,6 +28,163 @@ ERRORS = dict((str(message.error_codes[i]['code']), lambda x: BillingError(i+':
 ERRORS['0'] = lambda x: BillingError('Invalid return message')
 
 
+def address(server):
+	"""Returns (host, port) of the server"""
+
+	if ':' in server:
+		return tuple(server.split(':'))
+	return (server, '80')
+
+
+def redirect(response):
+	"""Returns the server which the call is redirected to or None"""
+
+	# The object belongs to another zone (see wapi_customers).
+	result = response.get('result')
+	if not isinstance(result, dict) or result.get('status') != 'redirect':
+		return None
+
+	if not result.get('server'):
+		raise BillingError("Redirect to unknown server: {0}", result)
+	return result['server']
+
+
+def result(method_dict, method, response):
+	"""Returns result of the call or raises its error"""
+
+	if 'result' in response.keys():
+		return response['result'].get(method_dict[method])
+
+	elif 'error' in response.keys():
+		raise ERRORS[str(response['error'].get('code', 0))](response['error'].get('message', 0))
+
+
+class Future(object):
+	"""Result of the call which may be not received yet"""
+
+	def __init__(self):
+		self._event  = threading.Event()
+		self._result = None
+		self._error  = None
+
+
+	def done(self):
+		return self._event.is_set()
+
+
+	def set_result(self, result):
+		self._result = result
+		self._event.set()
+
+
+	def set_exception(self, error):
+		self._error = error
+		self._event.set()
+
+
+	def result(self, timeout=None):
+		"""Waits for the response and returns the result or raises
+		the error of the call
+		"""
+		if not self._event.wait(timeout):
+			raise BillingError("No response in {0} seconds", timeout)
+
+		if self._error != None:
+			raise self._error
+
+		return self._result
+
+
+class Batch(object):
+	"""Calls which are sent to the server by one request
+
+	Methods are the same as methods of the client, but they return
+	Future instead of the result. The calls are sent on exit from
+	the 'with' block or by send():
+
+	python> with client.batch() as b:
+	python>     res = [ b.taskAdd(t) for t in tasklist ]
+	python> ids = [ r.result() for r in res ]
+
+	Redirected calls are sent again by one request per server.
+	"""
+
+	def __init__(self, method_dict, auth, server, pool):
+		self.method_dict = method_dict
+		self.auth        = auth
+		self.server      = server
+		self.pool        = pool
+		self.calls       = []
+
+		for name in method_dict.keys():
+			setattr(self, name, self.__method(name))
+
+
+	def __enter__(self):
+		return self
+
+
+	def __exit__(self, type, value, traceback):
+		if type == None:
+			self.send()
+
+
+	def __method(self, name):
+		return lambda json={}: self.add(name, json)
+
+
+	def add(self, method, json_data):
+		f = Future()
+		self.calls.append((f, method, json_data))
+		return f
+
+
+	def send(self):
+		"""Sends the queued calls"""
+
+		calls, self.calls = self.calls, []
+		if not calls:
+			return
+
+		try:
+			self.__send(calls, self.server, True)
+
+		except Exception as e:
+			LOG.exception("Failed to communicate with Billing: %s", e)
+			for f, method, json_data in calls:
+				if not f.done():
+					f.set_exception(e)
+			raise e
+
+
+	def __send(self, calls, server, follow):
+		if not server:
+			raise BillingError("Server not specified")
+
+		host, port = address(server)
+		responses = http.jsonrpc_http_batch(self.pool, host, port,
+			[ (method, json_data) for f, method, json_data in calls ],
+			auth_data=self.auth)
+
+		redirects = {}
+
+		for call, response in zip(calls, responses):
+			f, method, json_data = call
+			try:
+				srv = follow and redirect(response)
+				if srv:
+					redirects.setdefault(srv, []).append(call)
+					continue
+
+				f.set_result(result(self.method_dict, method, response))
+
+			except BillingError as e:
+				f.set_exception(e)
+
+		for srv, rcalls in redirects.iteritems():
+			self.__send(rcalls, srv, False)
+
+
 class BCClient(object):
 	def __init__(self, method_dict, auth, local_server=None):
 
@@ -39,6 +198,12 @@ class BCClient(object):
 			LOG.exception("Failed to connect: %s.", e)
 			raise e
 
+
+	def batch(self, server=None):
+		"""Returns Batch of calls which are sent by one request"""
+
+		return Batch(self.method_dict, self.auth, server or self.local_server, self.pool)
+
 	def __request(self, method, json_data, server):
 
 		def request(method, server, auth):
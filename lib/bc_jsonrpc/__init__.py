@@ -26,8 +26,10 @@ from bc_jsonrpc.methods import jsonrpc_result_error    as result_error
 from bc_jsonrpc.methods import jsonrpc_result_http     as result_http
 from bc_jsonrpc.methods import jsonrpc_method          as method
 from bc_jsonrpc.methods import jsonrpc_process         as process
+from bc_jsonrpc.methods import jsonrpc_process_batch   as process_batch
 
 from bc_jsonrpc.wsgi    import jsonrpc_handle          as handle
 
 from bc_jsonrpc.http    import JsonRpcHttpError
 from bc_jsonrpc.http    import jsonrpc_http_request    as http_request
+from bc_jsonrpc.http    import jsonrpc_http_batch      as http_batch
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+#
+# codec.py
+#
+# Copyright (c) 2012-2013 by Alexey Gladkov
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+
+__version__ = '1.0'
+
+__all__ = [ 'BACKENDS', 'loads', 'dumps', 'use' ]
+
+import logging
+import functools
+
+LOG = logging.getLogger("jsonrpc.codec")
+
+BACKENDS = [ 'ujson', 'simplejson', 'json' ]
+"""JSON libraries in order of preference."""
+
+BACKEND = None
+"""Name of the library in use."""
+
+# Float which needs all 17 digits.
+_FLOAT = 0.1 + 0.2
+
+
+def _backend(name):
+	mod = __import__(name)
+
+	if name == 'ujson':
+		# Default float parsing of ujson differs from the other libraries
+		# in the last digits. The signature of the request is computed by
+		# str() of the decoded values (see secure.serialize()), so floats
+		# must come back unchanged. Old versions also write floats with
+		# 10 digits at most, they are not used.
+		loads = functools.partial(mod.loads, precise_float=True)
+
+		if loads(mod.dumps(_FLOAT)) != _FLOAT:
+			raise ImportError(name + " does not keep floats")
+		return loads, mod.dumps
+
+	# Encoder is made once, json.dumps() creates it on every call
+	# if any option is given.
+	return mod.loads, mod.JSONEncoder(separators=(',', ':')).encode
+
+
+def use(name):
+	"""Switches encoding and decoding to the named library"""
+
+	global BACKEND, loads, dumps
+
+	loads, dumps = _backend(name)
+	BACKEND = name
+
+	LOG.debug("JSON backend: %s", name)
+
+
+for _name in BACKENDS:
+	try:
+		use(_name)
+		break
+	except ImportError:
+		continue
@@ -9,9 +9,10 @@
 #
 __version__ = '1.0'
 
-import json
+import socket
 import httplib
 
+import codec
 import secure
 import message
 import logging
@@ -23,28 +24,88 @@ class JsonRpcHttpError(Exception):
 		Exception.__init__(self, fmt.format(*args))
 
 
-def jsonrpc_http_request(pool, host, port, method, params=None, auth_data=None, req_limit=None):
+class Connections(object):
+	"""Keep-alive connections to the servers
+
+	The object has the same request() as the connection pool of
+	BCClient. It is not thread-safe, so every thread needs its own.
+	"""
+
+	def __init__(self, timeout=None):
+		self.timeout = timeout
+		self.conns   = {}
+
+
+	def request(self, host, port, method, url, body):
+		key = (host, int(port))
+
+		while True:
+			conn  = self.conns.get(key)
+			fresh = conn == None
+
+			if fresh:
+				conn = httplib.HTTPConnection(host, int(port), timeout=self.timeout)
+				self.conns[key] = conn
+			try:
+				conn.request(method, url, body, { 'Content-Type': 'application/json' })
+				return conn.getresponse()
+
+			except (httplib.HTTPException, socket.error):
+				conn.close()
+				del self.conns[key]
+
+				# The server may close an idle connection,
+				# so a reused connection is retried once.
+				if fresh:
+					raise
+
+
+	def close(self):
+		for conn in self.conns.itervalues():
+			conn.close()
+		self.conns.clear()
+
+
+def _request(method, params, auth_data):
+	# Signing adds 'auth' to the parameters, so the parameters of
+	# the caller are copied to be sent again (e.g. by redirect).
+	if isinstance(params, dict):
+		params = dict(params)
+	elif isinstance(params, list):
+		params = list(params)
+
 	req = message.jsonrpc_request(method, params)
-	LOG.debug(">>>Sending>>>:" + str(req))
 	if auth_data:
 		req = secure.jsonrpc_sign(auth_data['role'], auth_data['secret'], req)
+	return req
 
-	response = pool.request(host, port, "POST", "/", json.dumps(req))
+
+def _post(pool, host, port, req, req_limit):
+	LOG.debug(">>>Sending>>>:" + str(req))
+
+	response = pool.request(host, port, "POST", "/", codec.dumps(req))
 
 	if response.status != httplib.OK:
 		raise JsonRpcHttpError("The server returned an error: {0}.", response.reason)
 
-		if req_limit:
-			reply = response.read(req_limit + 1)
+	if req_limit:
+		reply = response.read(req_limit + 1)
 
 		if len(reply) > req_limit:
 			raise JsonRpcHttpError("Got a reply of too big size.")
 	else:
 		reply = response.read()
 
-	res = json.loads(reply)
+	res = codec.loads(reply)
 	LOG.debug("<<<Reciving<<<:" + str(res))
 
+	return res
+
+
+def jsonrpc_http_request(pool, host, port, method, params=None, auth_data=None, req_limit=None):
+	req = _request(method, params, auth_data)
+	res = _post(pool, host, port, req, req_limit)
+
 	if not message.jsonrpc_is_response(res):
 		raise JsonRpcHttpError("Got wrong response: {0}.", repr(res))
 
@@ -52,3 +113,29 @@ def jsonrpc_http_request(pool, host, port, method, params=None, auth_data=None,
 		raise JsonRpcHttpError("Got wrong reply id: {0}.", repr(res))
 
 	return res
+
+
+def jsonrpc_http_batch(pool, host, port, calls, auth_data=None, req_limit=None):
+	"""Sends list of (method, params) calls by one request
+
+	Every call is signed by itself. Returns list of responses
+	in the order of calls.
+	"""
+	reqs = [ _request(method, params, auth_data) for method, params in calls ]
+	res = _post(pool, host, port, reqs, req_limit)
+
+	# The whole batch is rejected by the server.
+	if not isinstance(res, list):
+		raise JsonRpcHttpError("Got wrong response: {0}.", repr(res))
+
+	replies = {}
+	for r in res:
+		if not message.jsonrpc_is_response(r):
+			raise JsonRpcHttpError("Got wrong response: {0}.", repr(r))
+		replies[r['id']] = r
+
+	for r in reqs:
+		if r['id'] not in replies:
+			raise JsonRpcHttpError("Got no reply for: {0}.", repr(r))
+
+	return [ replies[r['id']] for r in reqs ]
@@ -56,7 +56,7 @@ def jsonrpc_result_http(http_code, http_body = "", http_headers = []):
 def jsonrpc_process(headers, request):
 	notification = 'id' not in request
 
-	LOG.info(repr(request) + ": notification=" + str(notification))
+	LOG.info("%r: notification=%s", request, notification)
 
 	def error(errcode, data = None):
 		if not notification:
@@ -112,3 +112,31 @@ def jsonrpc_process(headers, request):
 	except Exception, e:
 		LOG.exception("Unable to process request", e)
 		return error('InternalError')
+
+
+def jsonrpc_process_batch(headers, requests):
+	"""Processes JSON-RPC 2.0 batch (array of requests)
+
+	Every request is authenticated by itself. Returns list of responses
+	(notifications are not answered) or an error if the batch is empty.
+	"""
+	if not requests:
+		return message.jsonrpc_response_error({}, 'InvalidRequest')
+
+	res = []
+	for request in requests:
+		if not isinstance(request, dict):
+			res.append(message.jsonrpc_response_error({}, 'InvalidRequest'))
+			continue
+
+		result = jsonrpc_process(headers, request)
+
+		if not result:
+			continue
+
+		# HTTP answer can not be a part of the batch.
+		if isinstance(result, tuple):
+			result = message.jsonrpc_response_error(request, 'InternalError')
+
+		res.append(result)
+	return res
@@ -11,7 +11,14 @@
 
 __version__ = '1.0'
 
-import base64, hmac, hashlib, string, time, fnmatch
+import re
+import time
+import base64
+import hmac
+import hashlib
+import fnmatch
+import logging
+import threading
 
 try:
 	from bc import database
@@ -19,52 +26,170 @@ try:
 except ImportError:
 	_HAVE_DATABASE = False
 
+LOG = logging.getLogger("jsonrpc.secure")
 
-def serialize(data, prefix = 'params'):
+# How long the access rules are used without reloading (seconds).
+ACL_TTL = 60
+
+# Databases created before the 'auth' table got its notification
+# trigger are announced by nothing.
+SQL_AUTH_TRIGGER = "SELECT 1 FROM pg_trigger WHERE tgname = %(name)s"
+
+
+def _serialize(out, data, prefix):
 	if not data:
-		return [ prefix + " = null" ]
-	res = []
+		out(prefix + " = null")
 
-	if isinstance(data, dict):
+	elif isinstance(data, dict):
 		for k in sorted(data.keys()):
-			res.extend(serialize(data[k], prefix + '.' + str(k)))
+			_serialize(out, data[k], prefix + '.' + str(k))
 
 	elif isinstance(data, list):
-		i = 0
-		for k in data:
-			res.extend(serialize(data[i], prefix + '.' + str(i)))
-			i += 1
+		for i, v in enumerate(data):
+			_serialize(out, v, prefix + '.' + str(i))
 	else:
-		res.append(prefix + ' = ' + str(data))
+		out(prefix + ' = ' + str(data))
+
+
+def serialize(data, prefix = 'params'):
+	"""Returns canonical text of the data which is signed
+
+	Every value is one 'path = value' line, keys of dicts are sorted.
+	"""
+	if not data:
+		return [ prefix + " = null" ]
+
+	res = []
+	_serialize(res.append, data, prefix)
 
 	if prefix == 'params':
-		return string.join(res,'\n')
+		return '\n'.join(res)
 
 	return res
 
 
-def get_secret(role, method):
-	if _HAVE_DATABASE:
-		with database.DBConnect() as db:
-			ret = db.find_one('auth',
-				{
-					'role': role,
-					'method': method
-				}
-			)
-			if ret:
-				ret['found'] = True
-				return ret
-	field = '_invalid'
+def _rule(role, method, secret, host, found=True):
 	return {
-		'role':   field,
-		'method': field,
-		'secret': field,
-		'host':   '*',
-		'found':  False
+		'role':   role,
+		'method': method,
+		'secret': secret,
+		'host':   host,
+		'found':  found,
+
+		# Precompiled host pattern and HMAC key.
+		'match':  re.compile(fnmatch.translate(host)).match,
+		'key':    hmac.new(str(secret), digestmod=hashlib.sha1),
 	}
 
 
+_INVALID = _rule('_invalid', '_invalid', '_invalid', '*', False)
+
+
+class ACL(object):
+	"""Access rules of the 'auth' table
+
+	All rules are loaded by one query and kept for 'ttl' seconds. Changes
+	of the table (e.g. by billing-acl) are announced on the 'auth' channel
+	and make the rules reload on the next request.
+	"""
+
+	def __init__(self, ttl=ACL_TTL):
+		self.ttl    = ttl
+		self.loads  = 0
+
+		# (rules by (role, method), time of the load)
+		self._state = ({}, 0)
+
+		self._lock     = threading.Lock()
+		self._listener = None
+
+
+	def expire(self):
+		self._state = (self._state[0], 0)
+
+
+	def changed(self):
+		"""Returns True if the table was changed since the last check"""
+
+		# Another thread is checking right now.
+		if not self._lock.acquire(False):
+			return False
+		try:
+			if self._listener == None:
+				self._listener = database.DBListener([ 'auth' ])
+				self._check_trigger()
+			return len(self._listener.wait(0)) > 0
+
+		except Exception as e:
+			LOG.error("Unable to check access rules: %s", e)
+			return True
+
+		finally:
+			self._lock.release()
+
+
+	def _check_trigger(self):
+		with database.DBConnect() as db:
+			if db.query(SQL_AUTH_TRIGGER, { 'name': 'auth_notify' }).one():
+				return
+
+		LOG.warning("Table 'auth' does not announce changes (see 'billing-bootstrap --upgrade'), "
+			"access rules are reloaded every %d seconds", self.ttl)
+
+
+	def load(self):
+		"""Loads all rules and returns them"""
+
+		# Subscribe before reading, so the next change is not missed.
+		self.changed()
+
+		rules = {}
+		with database.DBConnect() as db:
+			for r in db.find('auth', fields=[ 'role', 'method', 'secret', 'host' ],
+					rows=database.ROWS_TUPLE):
+				rules[(r[0], r[1])] = _rule(*r)
+
+		self._state = (rules, time.time())
+		self.loads += 1
+		return rules
+
+
+	def get(self, role, method):
+		"""Returns the rule or None"""
+
+		rules, ts = self._state
+
+		if time.time() - ts >= self.ttl or self.changed():
+			rules = self.load()
+
+		return rules.get((role, method))
+
+
+	def close(self):
+		with self._lock:
+			if self._listener != None:
+				self._listener.close()
+				self._listener = None
+
+
+ACCESS = ACL()
+
+
+def get_secret(role, method):
+	if _HAVE_DATABASE:
+		ret = ACCESS.get(role, method)
+		if ret:
+			return ret
+	return _INVALID
+
+
+def sign_key(key, string):
+	""" Sign string using precomputed HMAC key and return base64 encoded value """
+	h = key.copy()
+	h.update(str(string))
+	return base64.b64encode(h.digest())
+
+
 def sign_string(secret, string):
 	""" Sign string using specified secret and return base64 encoded value """
 	return base64.b64encode(hmac.new(str(secret), str(string), hashlib.sha1).digest())
@@ -81,14 +206,17 @@ def jsonrpc_auth(headers, sign, request):
 	method = request.get('method', '')
 	auth   = get_secret(role, method)
 
+	if not auth['found']:
+		return False
+
 	if headers:
 		for n in [ 'REMOTE_ADDR', 'REMOTE_HOST' ]:
 			if n not in headers:
 				continue
-			if fnmatch.fnmatch(headers[n], auth['host']):
+			if auth['match'](headers[n]):
 				break
 		else:
-			auth['found'] = False
+			return False
 
 	data = {
 		'auth': {
@@ -97,8 +225,11 @@ def jsonrpc_auth(headers, sign, request):
 		'data': request
 	}
 
-	return ((sign.get('sign', '') == sign_string(auth['secret'], serialize(data))) and
-	        (auth['found'] == True))
+	value = sign.get('sign', '')
+	if isinstance(value, unicode):
+		value = value.encode('utf-8')
+
+	return hmac.compare_digest(str(value), sign_key(auth['key'], serialize(data)))
 
 
 def jsonrpc_sign(role, secret, request):
@@ -11,9 +11,9 @@
 
 __version__ = '1.0'
 
-import json
 import logging
 
+import codec
 import methods
 
 LOG = logging.getLogger("jsonrpc.wsgi")
@@ -36,6 +36,11 @@ def jsonrpc_handle(environ, start_response):
 
 	def answer(http_code, http_body = '', http_headers = []):
 		start_response(http_code, http_headers)
+
+		# The server writes every item of the iterable, a string
+		# would be written by one character.
+		if isinstance(http_body, basestring):
+			return [ http_body ] if http_body else []
 		return http_body
 
 	if "CONTENT_LENGTH" not in environ:
@@ -52,14 +57,19 @@ def jsonrpc_handle(environ, start_response):
 			headers[n] = v
 
 	try:
-		response = ""
+		response = []
 		request_body = environ["wsgi.input"].read(request_length)
 
 		for r in request_body.split('\n'):
 			if not r:
 				continue
 
-			result = methods.jsonrpc_process(headers, json.loads(r))
+			data = codec.loads(r)
+
+			if isinstance(data, list):
+				result = methods.jsonrpc_process_batch(headers, data)
+			else:
+				result = methods.jsonrpc_process(headers, data)
 
 			if not result:
 				continue
@@ -67,9 +77,10 @@ def jsonrpc_handle(environ, start_response):
 			if isinstance(result, tuple):
 				return answer(result[0], result[1], result[2])
 
-			response += json.dumps(result) + "\n"
+			response.append(codec.dumps(result))
+			response.append("\n")
 
-		return answer("200 OK", response)
+		return answer("200 OK", "".join(response))
 
 	except Exception,e:
 		LOG.exception("Failed handle request")
@@ -45,8 +45,7 @@ def sync(params):
 	auth = True)
 def syncList(params):
 	try:
-		for r in params['list']:
-			bc_sync.record(params['table'], r)
+		bc_sync.records(params['table'], params['list'])
 
 	except Exception, e:
 		LOG.error(e)
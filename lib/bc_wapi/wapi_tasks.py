@@ -14,6 +14,7 @@ import time
 import bc_jsonrpc as jsonrpc
 
 from bc.validator import Validate as V
+from bc.validator import ValidError
 from bc import log
 from bc import customers
 from bc import rates
@@ -23,34 +24,61 @@ from bc import polinomial
 LOG = log.logger("wapi.tasks")
 GROUPID = iter(polinomial.permutation())
 
-@jsonrpc.method(
-	validate = V({
-			# Metric
-			'type':		V(basestring),
+# Maximum number of tasks added by taskAddMany.
+MAX_TASKS = 5000
 
-			'customer':	V(basestring, min=36, max=36),
+TASK = V({
+		# Metric
+		'type':		V(basestring),
 
-			'value':	V(int),
+		'customer':	V(basestring, min=36, max=36),
 
-			# Info
-			'user':		V(basestring, min=1,  max=64),
-			'uuid':		V(basestring, min=36, max=36),
-			'descr':	V(basestring),
+		'value':	V(int),
 
-			# Timings
-			'time-create':	V(int, default=0),
-			'time-destroy':	V(int, default=0),
-	}),
-	auth = False)
-def taskAdd(request):
-	""" Open new billing task """
+		# Info
+		'user':		V(basestring, min=1,  max=64),
+		'uuid':		V(basestring, min=36, max=36),
+		'descr':	V(basestring),
+
+		# Timings
+		'time-create':	V(int, default=0),
+		'time-destroy':	V(int, default=0),
+})
 
+
+def new_task(request, rid, rate):
 	if request['time-create'] == 0:
 		request['time-create'] = int(time.time())
 
+	return tasks.Task({
+			'group_id':     GROUPID.next(),
+			'base_id':      request['uuid'],
+			'customer':     request['customer'],
+
+			'metric_id':    request['type'],
+			'rate_id':      rid,
+			'rate':         rate,
+
+			'value':        request['value'],
+
+			'time_create':  request['time-create'],
+			'time_destroy': request['time-destroy'],
+
+			'target_user':  request['user'],
+			'target_uuid':  request['uuid'],
+			'target_descr': request['descr'],
+		})
+
+
+@jsonrpc.method(
+	validate = TASK,
+	auth = False)
+def taskAdd(request):
+	""" Open new billing task """
+
 	try:
 		rid, rate = ('', 0)
-		customer = customers.get(request['customer'], typ='id')
+		customer = customers.get(request['customer'], typ='id', cached=True)
 
 		if customer:
 			rid, rate  = rates.resolve(request['type'], customer.tariff_id)
@@ -62,25 +90,7 @@ def taskAdd(request):
 			LOG.error("task(%s): Unknown customer (%s)",
 				request['uuid'], request['customer'])
 
-		t = tasks.Task({
-				'group_id':     GROUPID.next(),
-				'base_id':      request['uuid'],
-				'customer':     request['customer'],
-
-				'metric_id':    request['type'],
-				'rate_id':      rid,
-				'rate':         rate,
-
-				'value':        request['value'],
-
-				'time_create':  request['time-create'],
-				'time_check':   request['time-create'],
-				'time_destroy': request['time-destroy'],
-
-				'target_user':  request['user'],
-				'target_uuid':  request['uuid'],
-				'target_descr': request['descr'],
-			})
+		t = new_task(request, rid, rate)
 		tasks.add(t)
 
 	except Exception, e:
@@ -91,6 +101,72 @@ def taskAdd(request):
 	return jsonrpc.result({'status':'ok', 'id':t.base_id})
 
 
+@jsonrpc.method(
+	validate = V({
+		'tasks': V(list, min=1, max=MAX_TASKS),
+	}),
+	auth = False)
+def taskAddMany(request):
+	""" Open list of billing tasks
+
+	Customers and rates of all tasks are looked up at once and tasks are
+	written by one transaction per shard (see tasks.add_many()). Returns
+	status of every task in the order of the list.
+	"""
+
+	res = [ None ] * len(request['tasks'])
+	valid = []
+
+	for i, params in enumerate(request['tasks']):
+		try:
+			valid.append((i, TASK.check(params)))
+		except ValidError, e:
+			res[i] = { 'status': 'error', 'message': str(e) }
+
+	try:
+		custs = customers.get_many([ p['customer'] for i, p in valid ])
+
+		keys = {}
+		for i, p in valid:
+			c = custs.get(p['customer'])
+			if c:
+				keys[i] = (p['type'], c.tariff_id)
+			else:
+				LOG.error("task(%s): Unknown customer (%s)",
+					p['uuid'], p['customer'])
+
+		resolved = rates.resolve_many(keys.values())
+
+		objs = []
+		for i, p in valid:
+			rid, rate = ('', 0)
+
+			if i in keys:
+				rid, rate = resolved[keys[i]]
+
+				if not rid:
+					LOG.error("task(%s): Unable to find rate for metric",
+						p['uuid'])
+
+			objs.append(new_task(p, rid, rate))
+
+		errors = tasks.add_many(objs)
+
+	except Exception, e:
+		LOG.exception("Unable to add new tasks: %s", e)
+		return jsonrpc.result_error('ServerError',
+			{ 'status': 'error', 'message': 'Unable to add new tasks' })
+
+	for (i, p), t, e in zip(valid, objs, errors):
+		if e != None:
+			LOG.error("task(%s): Unable to add task: %s", t.base_id, e)
+			res[i] = { 'status': 'error', 'message': 'Unable to add new task' }
+			continue
+		res[i] = { 'status': 'ok', 'id': t.base_id }
+
+	return jsonrpc.result({ 'status': 'ok', 'tasks': res })
+
+
 @jsonrpc.method(
 	validate = V({
 		'id':    V(basestring, min=36, max=36),
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+# bench_auth.py
+#
+# Copyright (c) 2012-2013 by Alexey Gladkov
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+# Measures the cost of the request authentication on the server side.
+# The schema of the testing database is recreated.
+#
+# Usage: python bench_auth.py [iterations]
+#
+import sys
+import uuid
+import timeit
+
+import unithelper
+
+from bc import database
+from bc import database_schema
+from bc_jsonrpc import message
+from bc_jsonrpc import secure
+
+NUMBER = len(sys.argv) > 1 and int(sys.argv[1]) or 2000
+
+ROLE   = 'bench-' + str(uuid.uuid4())[:8]
+SECRET = str(uuid.uuid4())
+
+PARAMS = {
+	'type':         'cpu',
+	'customer':     str(uuid.uuid4()),
+	'value':        10,
+	'user':         'user',
+	'uuid':         str(uuid.uuid4()),
+	'descr':        'descr',
+	'time-create':  1360000000,
+	'time-destroy': 0,
+}
+
+REQUEST = secure.jsonrpc_sign(ROLE, SECRET, message.jsonrpc_request('taskAdd', dict(PARAMS)))
+SIGN    = REQUEST['params'].pop('auth')
+HEADERS = { 'REMOTE_ADDR': '127.0.0.1' }
+
+DATA = { 'auth': { 'role': ROLE }, 'data': REQUEST }
+
+
+def sign():
+	secure.jsonrpc_sign(ROLE, SECRET, message.jsonrpc_request('taskAdd', dict(PARAMS)))
+
+
+def auth():
+	if not secure.jsonrpc_auth(HEADERS, SIGN, REQUEST):
+		raise Exception("Authentication failed")
+
+
+def auth_reload():
+	secure.ACCESS.expire()
+	auth()
+
+
+CASES = [
+	("serialize",          lambda: secure.serialize(DATA)),
+	("sign (client)",      sign),
+	("auth",               auth),
+	("auth (reload rules)", auth_reload),
+]
+
+
+database_schema.destroy_schema()
+database_schema.create_schema()
+
+with database.DBConnect() as db:
+	db.insert('auth', { 'id': str(uuid.uuid4()), 'role': ROLE,
+		'method': 'taskAdd', 'secret': SECRET, 'host': '127.0.0.*' })
+
+try:
+	print "Iterations:", NUMBER
+
+	for name, func in CASES:
+		t = min(timeit.repeat(func, number=NUMBER, repeat=3))
+		print "{0:<20} {1:>8.2f} usec".format(name, t * 1000000 / NUMBER)
+finally:
+	secure.ACCESS.close()
+	database_schema.destroy_schema()
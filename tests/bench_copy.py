@@ -0,0 +1,91 @@
+#!/usr/bin/python
+#
+# bench_copy.py
+#
+# Copyright (c) 2012-2013 by Alexey Gladkov
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+# Compares bulk loading by insert() and copy_in().
+#
+# Usage: python bench_copy.py [rows]
+#
+import sys
+import time
+import uuid
+
+import unithelper
+
+from bc import database
+
+ROWS = len(sys.argv) > 1 and int(sys.argv[1]) or 10000
+BATCH = 50
+
+COLUMNS = [ 'id', 'target', 'group_id', 'value' ]
+
+
+def reset():
+	with database.DBConnect() as db:
+		db.execute("DROP TABLE IF EXISTS bench_copy")
+		db.execute("""
+			CREATE TABLE bench_copy (
+				id       varchar(36) NOT NULL PRIMARY KEY,
+				target   varchar(36) NOT NULL,
+				group_id bigint      NOT NULL,
+				value    bigint      NOT NULL
+			)""")
+
+
+def rows():
+	return [
+		{
+			'id':       str(uuid.uuid4()),
+			'target':   str(uuid.uuid4()),
+			'group_id': i,
+			'value':    i * 100,
+		}
+		for i in xrange(ROWS)
+	]
+
+
+def insert_rows(db, data):
+	for o in data:
+		db.insert('bench_copy', o)
+
+
+def insert_batches(db, data):
+	for i in xrange(0, len(data), BATCH):
+		db.insert('bench_copy', data[i:i + BATCH])
+
+
+def copy_rows(db, data):
+	db.copy_in('bench_copy', data, COLUMNS)
+
+
+def run(name, func):
+	data = rows()
+	reset()
+
+	with database.DBConnect() as db:
+		ts = time.time()
+		func(db, data)
+		delta = time.time() - ts
+
+		count = db.query("SELECT COUNT(*) AS n FROM bench_copy").one()['n']
+
+	if count != ROWS:
+		raise RuntimeError(name + ": wrong number of rows: " + str(count))
+
+	print "{0:<24} {1:>8.3f} sec {2:>10.0f} rows/sec".format(name, delta, ROWS / delta)
+
+
+print "Rows:", ROWS
+
+run("insert (row by row)", insert_rows)
+run("insert ({0} rows)".format(BATCH), insert_batches)
+run("copy_in", copy_rows)
+
+with database.DBConnect() as db:
+	db.execute("DROP TABLE bench_copy")
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+#
+# bench_models.py
+#
+# Copyright (c) 2012-2013 by Alexey Gladkov
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+# Measures construction and attribute access cost of the model objects.
+#
+# Usage: python bench_models.py [iterations]
+#
+import sys
+import uuid
+import timeit
+
+sys.path.insert(0, '../lib')
+
+from bc import tasks
+from bc import customers
+
+NUMBER = len(sys.argv) > 1 and int(sys.argv[1]) or 20000
+
+ROW = {
+	'task_id':      str(uuid.uuid4()),
+	'base_id':      str(uuid.uuid4()),
+	'record_id':    '0',
+	'queue_id':     str(uuid.uuid4()),
+	'group_id':     12345,
+	'customer':     str(uuid.uuid4()),
+	'rate_id':      str(uuid.uuid4()),
+	'metric_id':    'cpu',
+	'rate':         100,
+	'state':        tasks.constants.STATE_ENABLED,
+	'value':        3,
+	'time_create':  1360000000,
+	'time_destroy': 0,
+	'target_user':  'user',
+	'target_uuid':  str(uuid.uuid4()),
+	'target_descr': 'descr',
+}
+
+TASK = tasks.Task(ROW)
+
+
+def read_attrs():
+	t = TASK
+	return t.rate * t.value + t.time_destroy + t.group_id + t.state
+
+
+def write_attrs():
+	t = TASK
+	t.rate = 10
+	t.value = 20
+	t.customer = 'x'
+
+
+CASES = [
+	("Task()",            lambda: tasks.Task()),
+	("Task(row)",         lambda: tasks.Task(ROW)),
+	("Customer()",        lambda: customers.Customer()),
+	("5 attribute reads", read_attrs),
+	("3 attribute writes",write_attrs),
+	(".values",           lambda: TASK.values),
+]
+
+print "Iterations:", NUMBER
+
+for name, func in CASES:
+	t = min(timeit.repeat(func, number=NUMBER, repeat=3))
+	print "{0:<20} {1:>8.2f} usec".format(name, t * 1000000 / NUMBER)
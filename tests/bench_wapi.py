@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+# bench_wapi.py
+#
+# Copyright (c) 2012-2013 by Alexey Gladkov
+# Copyright (c) 2012-2013 by Nikolay Ivanov
+#
+# This file is covered by the GNU General Public License,
+# which should be included with billing as the file COPYING.
+#
+# Measures handling of the WAPI requests by every available JSON backend.
+# The requests are passed to the WSGI handler directly, so the numbers
+# do not include the HTTP server.
+#
+# Usage: python bench_wapi.py [iterations]
+#
+import sys
+import uuid
+import timeit
+import StringIO
+
+sys.path.insert(0, '../lib')
+
+import bc_jsonrpc as jsonrpc
+from bc_jsonrpc import codec
+
+NUMBER = len(sys.argv) > 1 and int(sys.argv[1]) or 1000
+CALLS  = 50
+
+TASK = {
+	'id':           str(uuid.uuid4()),
+	'customer':     str(uuid.uuid4()),
+	'metric_id':    'cpu',
+	'rate':         100,
+	'state':        'enable',
+	'value':        3,
+	'time_create':  1360000000,
+	'time_destroy': 0,
+	'target_user':  'user',
+	'target_uuid':  str(uuid.uuid4()),
+	'target_descr': 'Virtual machine',
+}
+
+
+@jsonrpc.method(auth = False)
+def benchTasks(params):
+	return jsonrpc.result({ 'status': 'ok', 'tasks': [ TASK ] * params['count'] })
+
+
+def start_response(code, headers):
+	pass
+
+
+def handler(body):
+	def handle():
+		environ = {
+			'CONTENT_LENGTH': str(len(body)),
+			'wsgi.input':     StringIO.StringIO(body),
+		}
+		return ''.join(jsonrpc.handle(environ, start_response))
+	return handle
+
+
+def request(count):
+	return jsonrpc.request('benchTasks', { 'count': count })
+
+
+CASES = [
+	("request",   handler(codec.dumps(request(1)))),
+	("big reply", handler(codec.dumps(request(CALLS)))),
+	("batch",     handler(codec.dumps([ request(1) for i in xrange(CALLS) ]))),
+	("lines",     handler('\n'.join(codec.dumps(request(1)) for i in xrange(CALLS)))),
+]
+
+print "Iterations:", NUMBER
+
+for name in codec.BACKENDS:
+	try:
+		codec.use(name)
+	except ImportError:
+		print "{0:<20} not available".format(name)
+		continue
+
+	print name
+	for case, func in CASES:
+		t = min(timeit.repeat(func, number=NUMBER, repeat=3))
+		print "  {0:<18} {1:>8.2f} usec".format(case, t * 1000000 / NUMBER)
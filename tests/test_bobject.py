@@ -0,0 +1,26 @@
+import unithelper
+
+from bc import bobject
+
+
+class One(bobject.BaseObject):
+	__fields__ = [ ('name', '') ]
+
+
+class Two(bobject.BaseObject):
+	__fields__ = [ ('name', ''), ('value', 0) ]
+
+
+class Test(unithelper.TestCase):
+	def test_values(self):
+		"""Check values of the models with one and many fields"""
+
+		o = One({ 'name': 'a' })
+		self.assertEqual(o.values, { 'name': u'a' })
+		self.assertEqual(o, One(o.values))
+		self.assertEqual(hash(o), hash(One({ 'name': 'a' })))
+		self.assertNotEqual(o, One())
+
+		o = Two({ 'name': 'a', 'value': 1 })
+		self.assertEqual(o.values, { 'name': u'a', 'value': 1L })
+		self.assertEqual(hash(o), hash(Two(o.values)))
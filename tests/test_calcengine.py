@@ -0,0 +1,270 @@
+import uuid
+import time
+import random
+import unithelper
+
+from bc import database
+from bc import metrics
+from bc import tasks
+from bc import rates
+from bc import customers
+from bc import calcengine
+
+class Test(unithelper.DBTestCase):
+	def setUp(self):
+		super(Test, self).setUp()
+
+		self.metric = metrics.Metric({
+			'id':        str(uuid.uuid4()),
+			'type':      'unit',
+			'formula':   metrics.constants.FORMULA_UNIT,
+			'aggregate': 0L,
+		})
+		metrics.add(self.metric)
+
+
+	def create_tasks(self, group_id, customer, num, state=tasks.constants.STATE_ENABLED):
+		res = []
+		for i in xrange(num):
+			t = tasks.Task({
+				'customer':  customer,
+				'group_id':  group_id,
+				'metric_id': self.metric.id,
+				'rate_id':   str(uuid.uuid4()),
+				'rate':      10,
+				'value':     i + 1,
+				'state':     state,
+			})
+			tasks.add(t)
+			res.append(t)
+		return res
+
+
+	def test_process_group(self):
+		"""Check batched calculation of the task group"""
+
+		c1, c2 = str(uuid.uuid4()), str(uuid.uuid4())
+		t1 = self.create_tasks(100, c1, 3)
+		t2 = self.create_tasks(100, c2, 2)
+
+		ts = int(time.time()) - 100
+		with database.DBConnect(dbtype='local') as db:
+			db.update('queue', { 'id': [ t.queue_id for t in t1 + t2 ] }, { 'time_check': ts })
+
+		stat = calcengine.CalcEngine().process(100)
+
+		self.assertEquals(stat['tasks'], 5)
+		self.assertEquals(stat['bills'], 2)
+
+		with database.DBConnect(dbtype='local') as db:
+			res = dict((b['target'], b['value']) for b in db.find('bills'))
+			queue = db.find_all('queue', { 'id': [ t.queue_id for t in t1 + t2 ] })
+
+		self.assertEquals(res, { c1: 10 * (1 + 2 + 3), c2: 10 * (1 + 2) })
+
+		for q in queue:
+			self.assertTrue(q['time_check'] > ts)
+
+
+	def test_process_copy(self):
+		"""Check bills of the large group are written by COPY"""
+
+		custs = [ str(uuid.uuid4()) for i in xrange(3) ]
+		for c in custs:
+			self.create_tasks(600, c, 2)
+
+		threshold = database.COPY_THRESHOLD
+		database.COPY_THRESHOLD = len(custs)
+		try:
+			stat = calcengine.CalcEngine().process(600)
+		finally:
+			database.COPY_THRESHOLD = threshold
+
+		self.assertEquals(stat['bills'], len(custs))
+
+		with database.DBConnect(dbtype='local') as db:
+			self.assertEquals(set(b['target'] for b in db.find('bills')), set(custs))
+
+
+	def test_process_roundtrips(self):
+		"""Check number of round-trips does not depend on number of tasks"""
+
+		self.create_tasks(100, str(uuid.uuid4()), 1)
+		self.create_tasks(200, str(uuid.uuid4()), 2)
+		self.create_tasks(300, str(uuid.uuid4()), 20)
+
+		engine = calcengine.CalcEngine()
+
+		# Repeated queries are prepared once, so the statement cache
+		# is warmed up first.
+		for i in xrange(database.PREPARE_THRESHOLD):
+			engine.process(100)
+
+		s1 = engine.process(200)
+		s2 = engine.process(300)
+
+		self.assertEquals(s1['tasks'], 2)
+		self.assertEquals(s2['tasks'], 20)
+		self.assertEquals(s1['roundtrips'], s2['roundtrips'])
+
+
+	def test_process_unrated(self):
+		"""Check rates of the unrated tasks are resolved at once"""
+
+		tariff = str(uuid.uuid4())
+		custs = [ str(uuid.uuid4()) for i in xrange(2) ]
+
+		with database.DBConnect() as db:
+			for c in custs:
+				db.insert('customers', customers.Customer({ 'id': c, 'login': c, 'tariff_id': tariff }).values)
+			db.insert('rates', rates.Rate({ 'metric_id': self.metric.id, 'tariff_id': tariff, 'rate': 7 }).values)
+
+		def unrated(group_id, num):
+			res = []
+			for i in xrange(num):
+				t = tasks.Task({
+					'customer':  custs[i % len(custs)],
+					'group_id':  group_id,
+					'metric_id': self.metric.id,
+				})
+				tasks.add(t)
+				res.append(t.task_id)
+			return res
+
+		t1 = unrated(700, 2)
+		t2 = unrated(800, 20)
+
+		engine = calcengine.CalcEngine()
+		s1 = engine.process(700)
+		s2 = engine.process(800)
+
+		self.assertEquals(s1['roundtrips'], s2['roundtrips'])
+
+		with database.DBConnect(dbtype='local') as db:
+			res = db.find_all('tasks', { 'task_id': t1 + t2 }, fields=[ 'rate_id', 'rate' ])
+
+		self.assertEquals(len(res), len(t1 + t2))
+		for r in res:
+			self.assertNotEquals(r['rate_id'], '')
+			self.assertEquals(r['rate'], 7)
+
+
+	def test_process_modes_pending(self):
+		"""Check unrated tasks and unknown formulas wait in both modes"""
+
+		tariff = str(uuid.uuid4())
+		cust = str(uuid.uuid4())
+
+		unknown = metrics.Metric({
+			'id':        str(uuid.uuid4()),
+			'type':      'unit',
+			'formula':   'unknown',
+			'aggregate': 0L,
+		})
+		metrics.add(unknown)
+
+		with database.DBConnect() as db:
+			db.insert('customers', customers.Customer({ 'id': cust, 'login': cust, 'tariff_id': tariff }).values)
+			db.insert('rates', rates.Rate({ 'metric_id': self.metric.id, 'tariff_id': tariff, 'rate': 7 }).values)
+
+		for group_id, mode in [ (900, calcengine.MODE_CLIENT), (901, calcengine.MODE_DATABASE) ]:
+			tasks.add(tasks.Task({ 'customer': cust, 'group_id': group_id, 'metric_id': self.metric.id }))
+
+			t = tasks.Task({
+				'customer':  cust,
+				'group_id':  group_id,
+				'metric_id': unknown.id,
+				'rate_id':   str(uuid.uuid4()),
+				'rate':      10,
+			})
+			tasks.add(t)
+
+			ts = int(time.time()) - 100
+			with database.DBConnect(dbtype='local') as db:
+				db.update('queue', { 'id': t.queue_id }, { 'time_check': ts })
+
+			engine = calcengine.CalcEngine(mode)
+
+			# The rate is resolved by the first pass and used by the next one.
+			self.assertEquals(engine.process(group_id)['tasks'], 0)
+			self.assertEquals(engine.process(group_id)['tasks'], 1)
+
+			with database.DBConnect(dbtype='local') as db:
+				self.assertEquals(db.find_one('queue', { 'id': t.queue_id })['time_check'], ts)
+
+
+	def test_process_locked(self):
+		"""Check locked tasks are skipped"""
+
+		o1, o2 = self.create_tasks(400, str(uuid.uuid4()), 2)
+
+		for mode in [ calcengine.MODE_CLIENT, calcengine.MODE_DATABASE ]:
+			with database.DBConnect(dbtype='local', autocommit=False) as db:
+				db.find_all('queue', { 'id': o1.queue_id }, lock='update')
+				stat = calcengine.CalcEngine(mode).process(400)
+
+				self.assertEquals(stat['tasks'], 1)
+				self.assertEquals(stat['skipped'], 1)
+
+				db.find_all('queue', { 'id': o2.queue_id }, lock='update')
+				stat = calcengine.CalcEngine(mode).process(400)
+
+				self.assertEquals(stat['tasks'], 0)
+				self.assertEquals(stat['skipped'], 2)
+
+
+	def test_process_modes(self):
+		"""Check client and database modes produce the same bills"""
+
+		now = int(time.time())
+		formulas = [
+			metrics.constants.FORMULA_SPEED,
+			metrics.constants.FORMULA_TIME,
+			metrics.constants.FORMULA_UNIT,
+		]
+		mlist = []
+		for f in formulas:
+			m = metrics.Metric({
+				'id':        str(uuid.uuid4()),
+				'type':      f,
+				'formula':   f,
+				'aggregate': 0L,
+			})
+			metrics.add(m)
+			mlist.append(m)
+
+		custs = [ str(uuid.uuid4()) for i in xrange(5) ]
+		queue = {}
+
+		for i in xrange(100):
+			t = tasks.Task({
+				'customer':     random.choice(custs),
+				'group_id':     500,
+				'metric_id':    random.choice(mlist).id,
+				'rate_id':      str(uuid.uuid4()),
+				'rate':         random.choice([ 0, random.randint(1, 10**4) ]),
+				'value':        random.randint(0, 10**4),
+				'time_destroy': random.choice([ 0, now - random.randint(0, 100) ]),
+			})
+			tasks.add(t)
+			queue[t.queue_id] = now - random.randint(100, 10**5)
+
+		def run(mode):
+			with database.DBConnect(dbtype='local') as db:
+				db.delete('bills')
+				for qid, ts in queue.iteritems():
+					db.update('queue', { 'id': qid }, { 'time_check': ts })
+
+			stat = calcengine.CalcEngine(mode).process(500, now)
+
+			with database.DBConnect(dbtype='local') as db:
+				bills = dict((b['target'], b['value']) for b in db.find('bills'))
+				checks = set(q['time_check'] for q in db.find('queue', { 'id': queue.keys() }))
+
+			self.assertEquals(stat['tasks'], len(queue))
+			self.assertEquals(checks, set([ now ]))
+			return bills
+
+		res = run(calcengine.MODE_CLIENT)
+		self.assertTrue(len(res) > 0)
+		self.assertEquals(res, run(calcengine.MODE_DATABASE))
@@ -62,3 +62,20 @@ class Test(unithelper.TestCase):
 				)
 
 
+
+
+	def test_formula_codes(self):
+		"""Check calculation by formula codes"""
+
+		now = int(time.time())
+		values = {
+			'rate':           random.randint(10**4, 10**10),
+			'value':          random.randint(10**4, 10**10),
+			'time_check':     now - random.randint(10, 1000),
+			'time_now':       now,
+			'time_destroy':   0,
+		}
+
+		for f, code in metrics.FORMULA_CODES.iteritems():
+			self.metric.set({'formula': f})
+			self.assertEqual(calculate(values, code), calculate(values, self.metric))
@@ -0,0 +1,96 @@
+import time
+import random
+import unithelper
+import unittest2 as unittest
+
+from bc import metrics
+from bc import calculate
+from bc import calculate_bulk
+
+class Test(unithelper.TestCase):
+	def setUp(self):
+		now = int(time.time())
+		size = 1000
+
+		self.formulas = [ random.choice(metrics.FORMULA_CODES.keys()) for i in xrange(size) ]
+		self.columns = {
+			'rate':         [ random.choice([ 0, random.randint(1, 10**6) ]) for i in xrange(size) ],
+			'value':        [ random.randint(0, 10**6) for i in xrange(size) ],
+			'time_check':   [ now - random.randint(0, 10**6) for i in xrange(size) ],
+			'time_now':     now,
+			'time_destroy': [ random.choice([ 0, now - random.randint(0, 100) ]) for i in xrange(size) ],
+			'formula':      calculate_bulk.formula_codes(self.formulas),
+		}
+
+
+	def expected(self):
+		res = []
+		for i in xrange(len(self.formulas)):
+			t = {
+				'rate':         self.columns['rate'][i],
+				'value':        self.columns['value'][i],
+				'time_check':   self.columns['time_check'][i],
+				'time_now':     self.columns['time_now'],
+				'time_destroy': self.columns['time_destroy'][i],
+			}
+			res.append(calculate.calculate(t, metrics.Metric({ 'formula': self.formulas[i] })))
+		return res
+
+
+	def test_array(self):
+		"""Check bulk calculation without NumPy"""
+
+		res = calculate_bulk._calculate_array(**self.columns)
+		self.assertEqual(list(res), self.expected())
+
+
+	@unittest.skipUnless(calculate_bulk._HAVE_NUMPY, True)
+	def test_numpy(self):
+		"""Check bulk calculation with NumPy"""
+
+		res = calculate_bulk._calculate_numpy(**self.columns)
+		self.assertEqual(list(res), self.expected())
+
+
+	def test_overflow(self):
+		"""Check costs which do not fit into 64 bits"""
+
+		self.columns['rate'][0] = 10**12
+		self.columns['value'][0] = 10**12
+		self.formulas[0] = metrics.constants.FORMULA_SPEED
+		self.columns['formula'][0] = calculate_bulk.CODE_SPEED
+
+		self.assertEqual(list(calculate_bulk.calculate(**self.columns)), self.expected())
+		self.assertEqual(list(calculate_bulk._calculate_array(**self.columns)), self.expected())
+
+
+	def test_wrong_formula(self):
+		"""Check unknown formula code"""
+
+		self.columns['rate'][0] = 1
+		self.columns['formula'][0] = 0
+
+		with self.assertRaises(ValueError):
+			calculate_bulk.calculate(**self.columns)
+
+
+	def test_scalars(self):
+		"""Check single numbers are broadcast by both backends"""
+
+		self.columns['formula'] = calculate_bulk.CODE_TIME
+		self.columns['value'] = 3
+
+		expected = []
+		for i, r in enumerate(self.columns['rate']):
+			td = self.columns['time_destroy'][i] or self.columns['time_now']
+			expected.append(r * (td - self.columns['time_check'][i]))
+
+		self.assertEqual(list(calculate_bulk._calculate_array(**self.columns)), expected)
+
+		if calculate_bulk._HAVE_NUMPY:
+			self.assertEqual(list(calculate_bulk._calculate_numpy(**self.columns)), expected)
+
+			self.columns['value'] = [ 1, 2 ]
+			for func in [ calculate_bulk._calculate_array, calculate_bulk._calculate_numpy ]:
+				with self.assertRaises(ValueError):
+					func(**self.columns)
@@ -0,0 +1,141 @@
+import json
+import threading
+import unithelper
+import BaseHTTPServer
+import SocketServer
+
+from bc_jsonrpc import http
+from bc_jsonrpc import message
+from bc_client import Tasks
+from bc_client import AsyncBCClient
+from bc_client import asyncclient
+from bc_client.client import Batch
+from bc_client.client import BillingError
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def setup(self):
+		BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+		self.server.connections += 1
+
+
+	def answer(self, req):
+		params = req['params']
+
+		if params.get('error'):
+			return message.jsonrpc_response_error(req, 'ServerError')
+		if params.get('redirect') and self.server.redirect:
+			return message.response(req, result={ 'status': 'redirect', 'server': self.server.redirect })
+		return message.response(req, result={ 'id': params['id'], 'port': self.server.server_port })
+
+
+	def do_POST(self):
+		req = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+		self.server.requests += 1
+
+		if isinstance(req, list):
+			res = map(self.answer, req)
+		else:
+			res = self.answer(req)
+
+		data = json.dumps(res)
+		self.send_response(200)
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+
+	def log_message(self, *args):
+		pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+	def __init__(self, redirect=None):
+		BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), Handler)
+		self.connections = 0
+		self.requests = 0
+		self.redirect = redirect
+
+		t = threading.Thread(target=self.serve_forever)
+		t.daemon = True
+		t.start()
+
+
+	def address(self):
+		return '127.0.0.1:' + str(self.server_port)
+
+
+class Test(unithelper.TestCase):
+	def test_async_requests(self):
+		"""Check requests are sent at once by kept connections"""
+
+		srv = Server()
+		try:
+			with Tasks(None, srv.address(), client=AsyncBCClient) as c:
+				futures = [ c.taskAdd({ 'id': i }) for i in xrange(100) ]
+				res = asyncclient.gather(futures, 10)
+		finally:
+			srv.shutdown()
+
+		self.assertEquals(res, range(100))
+
+		# One connection per worker.
+		self.assertTrue(srv.connections <= asyncclient.WORKERS)
+
+
+	def test_async_redirect(self):
+		"""Check redirect to another server"""
+
+		dst = Server()
+		src = Server(redirect=dst.address())
+		try:
+			with Tasks(None, src.address(), client=AsyncBCClient) as c:
+				res = c.taskAdd({ 'id': 1, 'redirect': True }).result(10)
+		finally:
+			src.shutdown()
+			dst.shutdown()
+
+		self.assertEquals(res, 1)
+
+
+	def test_async_errors(self):
+		"""Check errors are raised by result()"""
+
+		srv = Server()
+		try:
+			with Tasks(None, srv.address(), client=AsyncBCClient) as c:
+				with self.assertRaises(BillingError):
+					c.taskAdd({ 'id': 1, 'error': True }).result(10)
+
+			with Tasks(None, None, client=AsyncBCClient) as c:
+				with self.assertRaises(BillingError):
+					c.taskAdd({ 'id': 1 }).result(10)
+		finally:
+			srv.shutdown()
+
+
+	def test_batch(self):
+		"""Check calls of the batch are sent by one request"""
+
+		dst = Server()
+		src = Server(redirect=dst.address())
+		conns = http.Connections(10)
+		try:
+			with Batch({ 'taskAdd': 'id' }, None, src.address(), conns) as b:
+				res = [ b.taskAdd({ 'id': i }) for i in xrange(10) ]
+				res.append(b.taskAdd({ 'id': 10, 'redirect': True }))
+				res.append(b.taskAdd({ 'id': 11, 'redirect': True }))
+				err = b.taskAdd({ 'id': 12, 'error': True })
+		finally:
+			conns.close()
+			src.shutdown()
+			dst.shutdown()
+
+		self.assertEquals(asyncclient.gather(res), range(12))
+		self.assertEquals((src.requests, dst.requests), (1, 1))
+
+		with self.assertRaises(BillingError):
+			err.result()
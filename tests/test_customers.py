@@ -262,3 +262,54 @@ class Test(unithelper.DBTestCase):
 			c1 = db.find_one('customers', {'id': cus.id})
 
 		self.assertEquals(customers.Customer(c1), cus)
+
+
+	def test_customer_from_row(self):
+		"""Check creating customer from database row"""
+
+		c = customers.Customer({
+			'id':    str(uuid.uuid4()),
+			'login': str(uuid.uuid4()),
+			'state': customers.constants.STATE_ENABLED,
+		})
+		customers.add(c)
+
+		with database.DBConnect() as db:
+			r = db.find_one('customers', { 'id': c.id },
+				fields=customers.Customer.columns(), rows=database.ROWS_TUPLE)
+
+		self.assertEquals(customers.Customer.from_row(r), c)
+		self.assertEquals(customers.get(c.id), c)
+
+
+	def test_customers_cache(self):
+		"""Check cached lookup of the customers"""
+
+		clist = []
+		for i in xrange(3):
+			c = customers.Customer({
+				'id':        str(uuid.uuid4()),
+				'login':     str(uuid.uuid4()),
+				'tariff_id': str(uuid.uuid4()),
+			})
+			customers.add(c)
+			clist.append(c)
+
+		c = clist[0]
+		self.assertEquals(customers.get(c.id, cached=True), c)
+
+		# Cached object is returned until invalidation.
+		with database.DBConnect() as db:
+			db.update('customers', { 'id': c.id }, { 'comment': 'changed' })
+
+		self.assertEquals(customers.get(c.id, cached=True), c)
+		self.assertEquals(customers.get(c.id).comment, 'changed')
+
+		customers.deposit(c.id, 10)
+		self.assertEquals(customers.get(c.id, cached=True).wallet, 10)
+
+		res = customers.get_many([ o.id for o in clist ] + [ str(uuid.uuid4()) ])
+		self.assertEquals(res, dict((o.id, customers.get(o.id)) for o in clist))
+
+		customers.modify('id', c.id, { 'tariff_id': str(uuid.uuid4()) })
+		self.assertEquals(customers.get_many([ c.id ])[c.id], customers.get(c.id))
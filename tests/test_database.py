@@ -69,6 +69,24 @@ class Test(unithelper.DBTestCase):
 					db2.find('new_table', {'uuid':o['uuid']}, lock='update', nowait=True)
 
 
+	def test_select_skip_locked(self):
+		"""locked rows are skipped"""
+
+		l = [ { 'uuid': str(uuid.uuid4()), 'big': i, 'time': i } for i in xrange(3) ]
+		with database.DBConnect() as db:
+			db.insert('new_table', l)
+
+		with database.DBConnect(autocommit=False) as db1:
+			db1.find_all('new_table', { 'uuid': l[0]['uuid'] }, lock='update')
+
+			with database.DBConnect(autocommit=False) as db2:
+				res = db2.find_all('new_table', sort=[ 'big' ], limit=2, lock='update', skip_locked=True)
+				self.assertEqual(res, l[1:])
+
+				with self.assertRaises(ValueError):
+					db2.find('new_table', lock='update', nowait=True, skip_locked=True)
+
+
 	def test_insert_return(self):
 		"""insert with return test"""
 		with database.DBConnect() as db:
@@ -82,6 +100,22 @@ class Test(unithelper.DBTestCase):
 			self.assertEqual(o, c.one())
 
 
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_insert_conflict(self):
+		"""insert or update test"""
+		with database.DBConnect() as db:
+			o = { 'uuid': str(uuid.uuid4()), 'big': 2, 'time': int(time.time()) }
+			db.insert('new_table', o)
+
+			l = [
+				{ 'uuid': o['uuid'],         'big': 4, 'time': o['time'] },
+				{ 'uuid': str(uuid.uuid4()), 'big': 8, 'time': o['time'] },
+			]
+			db.insert('new_table', l, conflict='uuid')
+
+			self.assertEqual(sorted(l), sorted(db.find_all('new_table')))
+
+
 	@unittest.skipUnless(unithelper.haveDatabase(), True)
 	def test_insert_autocommit_false(self):
 		"""transaction insert test"""
@@ -156,3 +190,177 @@ class Test(unithelper.DBTestCase):
 
 			self.assertEqual(c.all(), [{ 'uuid':uid, 'big':2**30, 'time':ts }])
 
+
+
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_prepared(self):
+		"""repeated queries use prepared statements"""
+		with database.DBConnect() as db:
+			l = [ { 'uuid': str(uuid.uuid4()), 'big': i, 'time': i } for i in xrange(5) ]
+			for o in l:
+				db.insert('new_table', o)
+
+			stats = db.connect().statements.stats()
+
+			for o in l:
+				self.assertEqual(db.find_one('new_table', { 'uuid': o['uuid'] }), o)
+
+			self.assertEqual(
+				db.find_all('new_table', { 'uuid': [ l[0]['uuid'], l[1]['uuid'] ] }, sort=['big']),
+				l[:2])
+
+			res = db.connect().statements.stats()
+			self.assertTrue(res['hits'] - stats['hits'] >= 3)
+			self.assertTrue(res['statements'] > stats['statements'])
+
+
+	def test_statement_cache(self):
+		"""statement cache evicts least recently used statements"""
+		cache = database.StatementCache(size=2, threshold=2)
+
+		self.assertFalse(cache.want('a'))
+		self.assertTrue(cache.want('a'))
+
+		cache.add('a', 'stmt_a')
+		self.assertEqual(cache.add('b', 'stmt_b'), None)
+
+		self.assertEqual(cache.get('a'), 'stmt_a')
+		self.assertEqual(cache.add('c', 'stmt_c'), 'stmt_b')
+
+		self.assertEqual(cache.get('b'), None)
+		self.assertEqual(cache.stats(), { 'statements': 2, 'hits': 1, 'misses': 1, 'evictions': 1 })
+
+
+	def test_ttl_cache(self):
+		"""entries of the TTL cache expire"""
+
+		cache = database.TTLCache(2, 60)
+		cache.add('a', 1)
+		self.assertEqual(cache.get('a'), 1)
+
+		cache.ttl = 0
+		cache.add('b', 2)
+		self.assertEqual(cache.get('b'), None)
+		self.assertEqual(len(cache), 1)
+
+		cache.remove('a')
+		self.assertEqual(cache.get('a'), None)
+		self.assertEqual(cache.stats(),
+			{ 'size': 0, 'hits': 1, 'misses': 2, 'evictions': 0, 'expired': 1 })
+
+
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_bound_values(self):
+		"""values with special characters are bound as is"""
+		with database.DBConnect() as db:
+			l = [
+				{ 'uuid': "a'%s\\", 'big': 1, 'time': 1 },
+				{ 'uuid': 'b"%%;', 'big': 2, 'time': 2 },
+			]
+			db.insert('new_table', l)
+			db.insert('new_table', { 'uuid': 'c%', 'big': 3, 'time': 3 })
+
+			for o in l:
+				self.assertEqual(db.find_one('new_table', { 'uuid': o['uuid'] }), o)
+
+			db.delete('new_table', { 'uuid': { '$like': 'c%' } })
+			self.assertEqual(db.find_all('new_table', { 'uuid': { '$like': '_%' } }, sort=['big']), l)
+
+
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_where_shapes(self):
+		"""NULL and False conditions have different shapes"""
+		with database.DBConnect() as db:
+			for op, sql in [ ('$eq', 'IS'), ('$ne', 'IS NOT') ]:
+				for order in [ (None, False), (False, None) ]:
+					database.SHAPES.clear()
+					for value in order:
+						args = []
+						qs = db.compile_where({ 'x': { op: value } }, args)
+						self.assertEqual(qs, 'x {0} {1}'.format(sql, value == None and 'NULL' or 'False'))
+						self.assertEqual(args, [])
+
+
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_copy_in(self):
+		"""copy_in loads rows with special characters"""
+		with database.DBConnect() as db:
+			l = [
+				{ 'uuid': u'a\tb\nc\\d\r\u044f', 'big': 2**40, 'time': 1 },
+				{ 'uuid': 'x', 'big': 2, 'time': 2 },
+			]
+			self.assertEqual(db.copy_in('new_table', l, ['uuid', 'big', 'time']), 2)
+			self.assertEqual(db.copy_in('new_table', [ ('y', 3, 3) ], ['uuid', 'big', 'time']), 1)
+			self.assertEqual(db.copy_in('new_table', [], ['uuid']), 0)
+
+			res = db.find_all('new_table', sort=['big'])
+			self.assertEqual([ (r['uuid'].decode('utf-8'), r['big']) for r in res ],
+				[ (u'x', 2), (u'y', 3), (l[0]['uuid'], 2**40) ])
+
+			with self.assertRaises(database.DatabaseError):
+				db.copy_in('new_table', [ ('x', 1, 1) ], ['uuid', 'big', 'time'])
+
+
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_find_stream(self):
+		"""find with server-side cursor"""
+		l = [ { 'uuid': str(uuid.uuid4()), 'big': i, 'time': i } for i in xrange(25) ]
+
+		with database.DBConnect() as db:
+			db.insert('new_table', l)
+
+			c = db.find('new_table', { 'big': { '$ge': 0 } }, sort=['big'], stream=True)
+			self.assertEqual(list(c), l)
+
+			# Partially read result
+			c = db.find('new_table', sort=['big'], stream=True)
+			self.assertEqual(c.fetch(1), [ l[0] ])
+			c.close()
+
+			self.assertEqual(db.find_one('new_table', { 'uuid': l[1]['uuid'] }), l[1])
+
+		with database.DBConnect(autocommit=False) as db:
+			c = db.find('new_table', sort=['big'], stream=True)
+			db.update('new_table', { 'uuid': l[0]['uuid'] }, { 'big': 100 })
+			self.assertEqual(c.fetch(1), [ l[0] ])
+
+		with database.DBConnect() as db:
+			self.assertEqual(db.find_one('new_table', { 'uuid': l[0]['uuid'] })['big'], 100)
+
+
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_find_rows(self):
+		"""find with tuple and record rows"""
+		o = { 'uuid': str(uuid.uuid4()), 'big': 2**32, 'time': 1 }
+
+		with database.DBConnect() as db:
+			db.insert('new_table', o)
+
+			fields = [ 'uuid', 'big', 'time' ]
+
+			r = db.find_one('new_table', fields=fields, rows=database.ROWS_TUPLE)
+			self.assertEqual(r, (o['uuid'], o['big'], o['time']))
+
+			r = db.find_all('new_table', fields=fields, rows=database.ROWS_RECORD)
+			self.assertEqual(r[0].uuid, o['uuid'])
+			self.assertEqual(r[0]._asdict(), o)
+
+			r = db.find('new_table', fields=fields, rows=database.ROWS_RECORD, stream=True).one()
+			self.assertEqual(r.big, o['big'])
+			self.assertTrue(type(r) is database.record_type(fields))
+
+
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_listen(self):
+		"""notifications wake up the listener"""
+
+		with database.DBConnect() as db:
+			self.assertEqual(db.listen([ 'chan1', 'chan2' ], 0), [])
+
+			with database.DBConnect() as db2:
+				db2.execute("NOTIFY chan2")
+				db2.execute("NOTIFY chan2")
+
+			self.assertEqual(db.listen([ 'chan1', 'chan2' ], 5), [ 'chan2' ])
+			self.assertEqual(db.listen([ 'chan1', 'chan2' ], 0), [])
+
@@ -138,3 +138,37 @@ class Test(unithelper.DBTestCase):
 		with database.DBConnect() as db:
 			for m,s in testList:
 				self.assertEqual(s, sqlcmd(db.sql_update(m, True)))
+
+
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_compiled(self):
+		"""Check compiled SET statment matches the parameterized one"""
+
+		testList = [
+			{ 'a': 1, 'b': 'x' },
+			{ '$set': { 'a': 1, 'b': { '$field': 'c' } }, '$inc': { 'c': 2 } },
+			{ '$concat': { 'a': 'x' }, '$mult': { 'b': 2 }, '$div': { 'c': ('d',) } },
+			{ '$bit': { 'a': { 'and': 1, 'or': 2 } }, 'b': ('NOW()',) },
+			{ '$set': { 'a': { '$crc32': { '$abs': 'x' } } }, '$dec': { 'b': 3 } },
+		]
+		with database.DBConnect() as db:
+			for m in testList:
+				a1 = []
+				s = sqlcmd(db.sql_update(m, args=a1))
+
+				for i in xrange(2):
+					a2 = []
+					self.assertEqual(s, db.compile_update(m, a2))
+					self.assertEqual(a1, a2)
+
+			a = []
+			self.assertEqual(db.compile_update({ '$set': { 'a': 5, 'b': { '$field': 'c' } }, '$inc': { 'c': 7 } }, a),
+				"c=c+%s , a=%s , b=c")
+			self.assertEqual(a, [ '7', '5' ])
+
+			# Strings of the functions are bound too.
+			for v in [ 'x', "y'" ]:
+				a = []
+				self.assertEqual(db.compile_update({ '$set': { 'a': { '$mod': [ v, 2 ] } } }, a),
+					"a=MOD(%s,2)")
+				self.assertEqual(a, [ v ])
@@ -293,3 +293,32 @@ class Test(unithelper.DBTestCase):
 		with database.DBConnect() as db:
 			for m,s in testList:
 				self.assertEqual(s, sqlcmd(db.sql_where(m, True)))
+
+
+	@unittest.skipUnless(unithelper.haveDatabase(), True)
+	def test_compiled(self):
+		"""Check compiled WHERE statment matches the parameterized one"""
+
+		testList = [
+			{ 'a': 1, 'b': 'x', 'c': [1,2,3] },
+			{ 'a': True, 'b': { '$ne': None }, 'c': { '$nin': [ 'x', 'y' ] } },
+			{ 'a': { '$gt': 1, '$le': 5 }, 'b': { '$eq': { '$field': 'c' } } },
+			{ '$or': [ { 'a': 1 }, { 'b': { '$like': 'x%' } } ], '$not': { 'c': 2 } },
+			{ '$and': [ { 'a': { '$regex': 'x' } }, { 'b': [ 1 ] } ], 'c': None },
+		]
+		with database.DBConnect() as db:
+			for m in testList:
+				a1, a2 = [], []
+				s = sqlcmd(db.sql_where(m, args=a1))
+
+				for i in xrange(2):
+					a2 = []
+					self.assertEqual(s, db.compile_where(m, a2))
+					self.assertEqual(a1, a2)
+
+			stats = database.SHAPES.stats()
+
+			a = []
+			self.assertEqual(db.compile_where({ 'a': 10, 'b': 'y', 'c': [4] }, a), "a = %s AND b = %s AND c = ANY( %s )")
+			self.assertEqual(a, [ '10', 'y', '{"4"}' ])
+			self.assertEqual(database.SHAPES.stats()['hits'], stats['hits'] + 1)
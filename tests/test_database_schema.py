@@ -0,0 +1,26 @@
+import uuid
+import unithelper
+
+from bc import database
+
+class Test(unithelper.DBTestCase):
+	def test_listener(self):
+		"""Check changes of the tables notify the listeners"""
+
+		l = database.DBListener([ 'metrics', 'bills' ])
+		l.subscribe()
+		try:
+			with database.DBConnect() as db:
+				db.insert('metrics', { 'id': str(uuid.uuid4()), 'type': 'unit', 'formula': 'unit', 'aggregate': 0 })
+			self.assertEquals(l.wait(5), [ 'metrics' ])
+
+			# Synchronized records do not notify.
+			with database.DBConnect() as db:
+				db.update('metrics', {}, { 'sync': 1 })
+			self.assertEquals(l.wait(0), [])
+
+			with database.DBConnect(dbtype='local') as db:
+				db.insert('bills', [ { 'id': str(uuid.uuid4()), 'target': 'a', 'value': i } for i in xrange(3) ])
+			self.assertEquals(l.wait(5), [ 'bills' ])
+		finally:
+			l.close()
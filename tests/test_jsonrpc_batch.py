@@ -0,0 +1,90 @@
+import json
+import threading
+import unithelper
+import StringIO
+
+from wsgiref import simple_server
+
+import bc_jsonrpc as jsonrpc
+from bc_jsonrpc import http
+
+@jsonrpc.method(auth = False)
+def batchEcho(params):
+	return jsonrpc.result(params)
+
+
+@jsonrpc.method(auth = True)
+def batchSecret(params):
+	return jsonrpc.result(params)
+
+
+class Handler(simple_server.WSGIRequestHandler):
+	def log_message(self, *args):
+		pass
+
+
+def handle(body):
+	res = {}
+	def start_response(code, headers):
+		res['code'] = code
+
+	environ = {
+		'CONTENT_LENGTH': str(len(body)),
+		'wsgi.input':     StringIO.StringIO(body),
+	}
+	data = jsonrpc.handle(environ, start_response)
+	return res['code'], ''.join(data)
+
+
+class Test(unithelper.TestCase):
+	def test_process_batch(self):
+		"""Check every request of the batch is processed by itself"""
+
+		reqs = [
+			jsonrpc.request('batchEcho', { 'a': 1 }),
+			jsonrpc.notify('batchEcho', { 'a': 2 }),
+			jsonrpc.request('batchSecret', { 'a': 3 }),
+			jsonrpc.request('batchUnknown', {}),
+			1,
+		]
+
+		code, data = handle(json.dumps(reqs))
+		self.assertEquals(code, '200 OK')
+
+		res = json.loads(data)
+		self.assertEquals(len(res), 4)
+
+		self.assertEquals(res[0]['id'], reqs[0]['id'])
+		self.assertEquals(res[0]['result'], { 'a': 1 })
+		self.assertEquals(res[1]['error']['code'], -32001)
+		self.assertEquals(res[2]['error']['code'], -32601)
+		self.assertEquals(res[3]['error']['code'], -32600)
+		self.assertEquals(res[3]['id'], None)
+
+
+	def test_process_batch_empty(self):
+		"""Check empty batch is rejected"""
+
+		code, data = handle('[]')
+		self.assertEquals(json.loads(data)['error']['code'], -32600)
+
+		code, data = handle(json.dumps([ jsonrpc.notify('batchEcho', {}) ]))
+		self.assertEquals(data, '')
+
+
+	def test_http_batch(self):
+		"""Check batch is sent by one request"""
+
+		srv = simple_server.make_server('127.0.0.1', 0, jsonrpc.handle, handler_class=Handler)
+		t = threading.Thread(target=srv.serve_forever)
+		t.daemon = True
+		t.start()
+
+		params = [ { 'n': i } for i in xrange(50) ]
+		try:
+			res = http.jsonrpc_http_batch(http.Connections(10), '127.0.0.1', srv.server_port,
+				[ ('batchEcho', p) for p in params ])
+		finally:
+			srv.shutdown()
+
+		self.assertEquals([ r['result'] for r in res ], params)
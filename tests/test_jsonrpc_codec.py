@@ -0,0 +1,69 @@
+import sys
+import json
+import types
+import unithelper
+
+from bc_jsonrpc import codec
+
+
+class Test(unithelper.TestCase):
+	def setUp(self):
+		self.backend = codec.BACKEND
+
+
+	def tearDown(self):
+		codec.use(self.backend)
+
+
+	def test_backends(self):
+		"""Check every available backend encodes the same data"""
+
+		data = {
+			'jsonrpc': '2.0',
+			'id':      '1',
+			'result':  [ { 'a': 1, 'b': None, 'c': True, 'd': u'\u0442\u0435\u0441\u0442' } ],
+		}
+
+		for name in codec.BACKENDS:
+			try:
+				codec.use(name)
+			except ImportError:
+				continue
+
+			self.assertEquals(codec.BACKEND, name)
+			self.assertEquals(codec.loads(codec.dumps(data)), data)
+
+		with self.assertRaises(ValueError):
+			codec.loads('{')
+
+		with self.assertRaises(ImportError):
+			codec.use('nonexistent_json')
+
+
+	def test_ujson_floats(self):
+		"""Check ujson is used only if it keeps floats"""
+
+		fake = types.ModuleType('ujson')
+		calls = []
+
+		def loads(s, precise_float=False):
+			calls.append(precise_float)
+			return json.loads(s)
+
+		fake.loads = loads
+		saved = sys.modules.get('ujson')
+		sys.modules['ujson'] = fake
+		try:
+			fake.dumps = lambda o: json.dumps(o).replace('30000000000000004', '3')
+			with self.assertRaises(ImportError):
+				codec.use('ujson')
+
+			fake.dumps = json.dumps
+			codec.use('ujson')
+			self.assertEquals(codec.loads('[0.1]'), [ 0.1 ])
+			self.assertTrue(all(calls))
+		finally:
+			if saved:
+				sys.modules['ujson'] = saved
+			else:
+				del sys.modules['ujson']
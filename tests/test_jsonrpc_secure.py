@@ -0,0 +1,94 @@
+import time
+import uuid
+import unithelper
+
+from bc import database
+from bc import database_schema
+from bc_jsonrpc import message
+from bc_jsonrpc import secure
+
+class Test(unithelper.DBTestCase):
+	def setUp(self):
+		super(Test, self).setUp()
+		self.access = secure.ACCESS
+		secure.ACCESS = secure.ACL(ttl=3600)
+
+
+	def tearDown(self):
+		secure.ACCESS.close()
+		secure.ACCESS = self.access
+		super(Test, self).tearDown()
+
+
+	def test_serialize(self):
+		"""Check canonical text of the signed data"""
+
+		data = {
+			'b': [ 1, 0, 'x' ],
+			'a': { 'c': None, 'd': u'y' },
+		}
+		self.assertEquals(secure.serialize(data), "\n".join([
+			"params.a.c = null",
+			"params.a.d = y",
+			"params.b.0 = 1",
+			"params.b.1 = null",
+			"params.b.2 = x",
+		]))
+		self.assertEquals(secure.serialize({}), [ "params = null" ])
+
+
+	def test_auth(self):
+		"""Check signed requests are checked by cached rules"""
+
+		role = str(uuid.uuid4())[:16]
+
+		with database.DBConnect() as db:
+			db.insert('auth', { 'id': str(uuid.uuid4()), 'role': role,
+				'method': 'taskAdd', 'secret': 'qwerty', 'host': '127.0.0.*' })
+
+		def auth(secret, host='127.0.0.1', method='taskAdd'):
+			req = secure.jsonrpc_sign(role, secret, message.jsonrpc_request(method, { 'a': 1 }))
+			sign = req['params'].pop('auth')
+			return secure.jsonrpc_auth({ 'REMOTE_ADDR': host }, sign, req)
+
+		self.assertTrue(auth('qwerty'))
+		self.assertTrue(auth('qwerty'))
+		self.assertEquals(secure.ACCESS.loads, 1)
+
+		self.assertFalse(auth('asdfgh'))
+		self.assertFalse(auth('qwerty', host='10.0.0.1'))
+		self.assertFalse(auth('qwerty', method='taskRemove'))
+
+		# The change is seen without waiting for the TTL.
+		with database.DBConnect() as db:
+			db.update('auth', { 'role': role }, { 'secret': 'asdfgh' })
+
+		deadline = time.time() + 5
+		while secure.ACCESS.loads < 2 and time.time() < deadline:
+			auth('asdfgh')
+
+		self.assertTrue(auth('asdfgh'))
+		self.assertFalse(auth('qwerty'))
+
+
+	def test_missing_trigger(self):
+		"""Check missing notification trigger is reported and recreated"""
+
+		with database.DBConnect() as db:
+			db.execute("DROP TRIGGER auth_notify ON auth")
+
+		warnings = []
+		warning = secure.LOG.warning
+		secure.LOG.warning = lambda *args: warnings.append(args)
+		try:
+			secure.ACCESS.get('role', 'taskAdd')
+			secure.ACCESS.get('role', 'taskAdd')
+			self.assertEquals(len(warnings), 1)
+
+			database_schema.upgrade_schema()
+
+			secure.ACCESS.close()
+			secure.ACCESS.get('role', 'taskAdd')
+			self.assertEquals(len(warnings), 1)
+		finally:
+			secure.LOG.warning = warning
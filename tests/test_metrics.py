@@ -38,6 +38,15 @@ class Test(unithelper.DBTestCase):
 
 		self.assertEquals(metrics.Metric(m1), met)
 
+		# The stored metric is not replaced, neither in the registry.
+		other = metrics.Metric(met.values)
+		other.formula = metrics.constants.FORMULA_UNIT
+
+		metrics.REGISTRY.load()
+		metrics.add(other)
+
+		self.assertEquals(metrics.REGISTRY.get(met.id), met)
+
 
 	def test_metric_get(self):
 		"""Check getting metric from db"""
@@ -79,3 +88,41 @@ class Test(unithelper.DBTestCase):
 
 		self.assertEquals(set(list(metrics.get_all())), set([met,met1]))
 
+
+
+	def test_metric_registry(self):
+		"""Check shared registry of metrics"""
+
+		def metric(formula):
+			m = metrics.Metric({
+				'id':         str(uuid.uuid4()),
+				'type':       str(uuid.uuid4())[:10],
+				'formula':    formula,
+				'aggregate':  0L,
+			})
+			with database.DBConnect() as db:
+				db.insert('metrics', m.values)
+			return m
+
+		m1 = metric(metrics.constants.FORMULA_UNIT)
+
+		reg = metrics.Registry()
+		self.assertEquals(reg.get(m1.id), m1)
+		self.assertEquals(reg.loads, 1)
+
+		# Unknown metric is read on demand.
+		m2 = metric(metrics.constants.FORMULA_TIME)
+		self.assertEquals(reg.code(m2.id), metrics.FORMULA_CODES[metrics.constants.FORMULA_TIME])
+		self.assertEquals(reg.get(str(uuid.uuid4())), None)
+		self.assertEquals(reg.loads, 1)
+
+		# Changes are seen after the reload.
+		with database.DBConnect() as db:
+			db.update('metrics', { 'id': m1.id }, { 'formula': metrics.constants.FORMULA_SPEED })
+
+		self.assertEquals(reg.get(m1.id).formula, metrics.constants.FORMULA_UNIT)
+
+		reg.expire()
+		self.assertEquals(reg.get(m1.id).formula, metrics.constants.FORMULA_SPEED)
+		self.assertEquals(reg.loads, 2)
+		self.assertEquals(set(m.id for m in reg.all()), set([ m1.id, m2.id ]))
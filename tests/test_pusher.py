@@ -0,0 +1,119 @@
+import time
+import unithelper
+
+from bc import database
+from bc import pusher
+from bc import tariffs
+
+class Client(object):
+	def __init__(self):
+		self.rows = []
+		self.fail = False
+		self.hook = None
+
+	def syncList(self, params):
+		if self.fail:
+			raise Exception('Zone is not available')
+		if self.hook:
+			self.hook()
+		self.rows.extend(r['id'] for r in params['list'])
+
+
+class Test(unithelper.DBTestCase):
+	def setUp(self):
+		super(Test, self).setUp()
+
+		self.ids = []
+		with database.DBConnect() as db:
+			for i in xrange(5):
+				t = tariffs.Tariff({ 'name': str(i) })
+				db.insert('tariffs', t.values)
+				self.ids.append(t.id)
+		self.ids.sort()
+
+
+	def unsynced(self):
+		with database.DBConnect() as db:
+			return db.find_all('tariffs', { 'sync': 0 })
+
+
+	def test_push(self):
+		"""Check records are sent to all zones by batches"""
+
+		zones = { 'a': Client(), 'b': Client() }
+
+		p = pusher.Pusher(zones, batch=2)
+		try:
+			self.assertEquals(p.push('tariffs'), len(self.ids))
+		finally:
+			p.close()
+
+		for c in zones.itervalues():
+			self.assertEquals(c.rows, self.ids)
+
+		self.assertEquals(self.unsynced(), [])
+		self.assertEquals([ z.stat['batches'] for z in p.zones ], [ 3, 3 ])
+
+
+	def test_push_slow_zone(self):
+		"""Check slow zone throttles the reading instead of skipping records"""
+
+		fast, slow = Client(), Client()
+		slow.hook = lambda: time.sleep(0.05)
+
+		p = pusher.Pusher({ 'fast': fast, 'slow': slow }, batch=1, depth=1)
+		try:
+			self.assertEquals(p.push('tariffs'), len(self.ids))
+		finally:
+			p.close()
+
+		self.assertEquals(slow.rows, self.ids)
+		self.assertEquals([ z.stat['skipped'] for z in p.zones ], [ 0, 0 ])
+		self.assertEquals(self.unsynced(), [])
+
+
+	def test_push_failed_zone(self):
+		"""Check failed zone does not stop the others"""
+
+		good, bad = Client(), Client()
+		bad.fail = True
+
+		p = pusher.Pusher({ 'good': good, 'bad': bad }, batch=2)
+		try:
+			self.assertEquals(p.push('tariffs'), 0)
+			self.assertEquals(good.rows, self.ids)
+			self.assertEquals(len(self.unsynced()), len(self.ids))
+
+			# Only missing records are sent to the zone.
+			bad.fail = False
+			self.assertEquals(p.push('tariffs'), len(self.ids))
+			self.assertEquals(good.rows, self.ids)
+			self.assertEquals(bad.rows, self.ids)
+		finally:
+			p.close()
+
+		self.assertEquals(self.unsynced(), [])
+
+
+	def test_push_modified(self):
+		"""Check record modified during the push is sent again"""
+
+		c = Client()
+
+		def modify():
+			c.hook = None
+			with database.DBConnect() as db:
+				db.update('tariffs', { 'id': self.ids[0] }, { 'description': 'new' })
+		c.hook = modify
+
+		p = pusher.Pusher({ 'a': c }, batch=10)
+		try:
+			self.assertEquals(p.push('tariffs'), len(self.ids) - 1)
+			self.assertEquals([ r['id'] for r in self.unsynced() ], [ self.ids[0] ])
+
+			self.assertEquals(p.push('tariffs'), 1)
+			self.assertEquals(c.rows, self.ids + [ self.ids[0] ])
+		finally:
+			p.close()
+
+		self.assertEquals(self.unsynced(), [])
@@ -191,3 +191,45 @@ class Test(unithelper.DBTestCase):
 			r1 = db.find_one('rates', {'id': rat.id})
 
 		self.assertEquals(rates.Rate(r1), rat)
+
+
+	def test_rate_resolve(self):
+		"""Check rate resolution and its cache"""
+
+		mid, tid = str(uuid.uuid4()), str(uuid.uuid4())
+
+		def insert(tariff_id, rate):
+			data = {
+				'id':           str(uuid.uuid4()),
+				'description':  u'',
+				'metric_id':    mid,
+				'tariff_id':    tariff_id,
+				'rate':         rate,
+				'currency':     rates.constants.CURRENCY_RUB,
+				'state':        rates.constants.STATE_ACTIVE,
+				'time_create':  int(time.time()),
+				'time_destroy': 0
+			}
+			with database.DBConnect() as db:
+				db.insert('rates', data)
+			rates.invalidate(mid, tariff_id)
+			return data['id']
+
+		self.assertEquals(rates.resolve(mid, tid), (None, None))
+
+		rid = insert('*', 10)
+		self.assertEquals(rates.resolve(mid, tid), (rid, 10))
+
+		rid = insert(tid, 20)
+		self.assertEquals(rates.resolve(mid, tid), (rid, 20))
+
+		# Cached value is returned without a query.
+		with database.DBConnect() as db:
+			db.update('rates', { 'id': rid }, { 'rate': 30 })
+
+		hits = rates.resolve_stats()['hits']
+		self.assertEquals(rates.resolve(mid, tid), (rid, 20))
+		self.assertEquals(rates.resolve_stats()['hits'], hits + 1)
+
+		rates.modify(tid, mid, { 'rate': 40 })
+		self.assertEquals(rates.resolve(mid, tid), (rid, 40))
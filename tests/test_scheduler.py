@@ -0,0 +1,109 @@
+import uuid
+import unithelper
+
+from bc import database
+from bc import database_schema
+from bc import scheduler
+from bc import tasks
+
+class Test(unithelper.DBTestCase):
+	def create_groups(self, groups, state=tasks.constants.STATE_ENABLED):
+		for g in groups:
+			tasks.add(tasks.Task({
+				'customer':  str(uuid.uuid4()),
+				'group_id':  g,
+				'metric_id': str(uuid.uuid4()),
+				'rate_id':   str(uuid.uuid4()),
+				'state':     state,
+			}))
+
+
+	def test_active_groups(self):
+		"""Check only groups with enabled tasks are scheduled"""
+
+		self.create_groups([ 5, 5, 70, 40000, 65535 ])
+		self.create_groups([ 100 ], state=tasks.constants.STATE_DELETED)
+
+		s = scheduler.Scheduler(0, 2, period=0)
+		self.assertEquals(s.ranges, 2 * scheduler.RANGES_PER_WORKER)
+
+		res = s.active_groups()
+		self.assertEquals(sorted(res.keys()), [ 0, 4, 7 ])
+		self.assertEquals(res[0], [ 5, 70 ])
+
+		self.assertEquals(sorted(s.next() for i in xrange(4)), [ 5, 70, 40000, 65535 ])
+		self.assertEquals(s.stat['rounds'], 1)
+		self.assertEquals(s.stat['stolen'], 1)
+
+
+	def test_ranges(self):
+		"""Check workers do not process the same range"""
+
+		self.create_groups([ 1, 20000, 40000, 60000 ])
+
+		w0 = scheduler.Scheduler(0, 2, period=3600, ranges=4, idle=0)
+		w1 = scheduler.Scheduler(1, 2, period=3600, ranges=4, idle=0)
+
+		# Own ranges first.
+		self.assertEquals(w0.next(), 1)
+		self.assertEquals(w1.next(), 20000)
+
+		# The worker steals ranges of others.
+		self.assertEquals(w0.next(), 40000)
+		self.assertEquals(w0.next(), 60000)
+		self.assertEquals(w0.stat['stolen'], 1)
+
+		w1.start_round()
+		self.assertFalse(w1.claim(0))
+		self.assertFalse(w1.claim(3))
+
+		# The ranges are created only once.
+		with database.DBConnect(dbtype='local') as db:
+			db.delete('schedule', { 'id': 1 })
+		self.assertFalse(w1.claim(1))
+
+
+	def test_upgrade(self):
+		"""Check upgrade of the database creates the schedule"""
+
+		self.create_groups([ 1 ])
+
+		with database.DBConnect(dbtype='local') as db:
+			db.execute("DROP TABLE schedule")
+			db.execute("DROP INDEX tasks_group_id_state_index")
+
+		database_schema.upgrade_schema()
+
+		s = scheduler.Scheduler(0, 1, period=3600, idle=0)
+		self.assertEquals(s.next(), 1)
+
+		with database.DBConnect(dbtype='local') as db:
+			self.assertTrue(db.query("""SELECT 1 FROM pg_indexes
+				WHERE indexname = 'tasks_group_id_state_index'""").one())
+
+
+	def test_report(self):
+		"""Check counters of the processed groups"""
+
+		s = scheduler.Scheduler(0, 1, period=0)
+		s.report(1, { 'tasks': 5, 'skipped': 3 })
+		s.report(2, { 'tasks': 0, 'skipped': 0 })
+		s.report(3, { 'tasks': 10, 'skipped': 0 })
+
+		self.assertEquals(s.stat['groups'], 3)
+		self.assertEquals(s.stat['collisions'], 1)
+		self.assertEquals(s.stat['skipped'], 3)
+		self.assertEquals(s.stat['empty'], 1)
+
+
+	def test_backoff(self):
+		"""Check idle delay grows up to the bound and is reset by work"""
+
+		b = scheduler.Backoff(0.5, 3)
+		self.assertEquals([ b.idle() for i in xrange(5) ], [ 0.5, 1, 2, 3, 3 ])
+
+		b.reset()
+		self.assertEquals(b.idle(), 0.5)
+
+		with self.assertRaises(ValueError):
+			scheduler.Backoff(0, 1)
@@ -0,0 +1,44 @@
+import unithelper
+import uuid
+
+from bc import database
+from bc import sync
+
+class Test(unithelper.DBTestCase):
+
+	def check_records(self, num):
+		old = [ { 'id': str(uuid.uuid4()), 'target': str(uuid.uuid4()), 'value': 1 } for i in xrange(3) ]
+		for b in old:
+			sync.record('customerbills', b.copy())
+
+		data = [ { 'id': str(uuid.uuid4()), 'target': str(uuid.uuid4()), 'value': i } for i in xrange(num) ]
+		data.extend({ 'id': b['id'], 'target': b['target'], 'value': 100 } for b in old)
+
+		sync.records('customerbills', [ b.copy() for b in data ])
+
+		with database.DBConnect() as db:
+			res = dict((r['id'], r) for r in db.find('customerbills'))
+
+		self.assertEquals(len(res), num + len(old))
+		for b in data:
+			self.assertEquals(res[b['id']]['target'], b['target'])
+			self.assertEquals(res[b['id']]['value'], b['value'])
+
+
+	def test_records(self):
+		"""Check synchronization of short list"""
+
+		self.check_records(2)
+
+
+	def test_records_copy(self):
+		"""Check synchronization of long list by COPY"""
+
+		self.check_records(database.COPY_THRESHOLD)
+
+
+	def test_records_unknown(self):
+		"""Check synchronization of unknown table"""
+
+		with self.assertRaises(ValueError):
+			sync.records('tasks', [])
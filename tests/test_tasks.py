@@ -60,6 +60,23 @@ class Test(unithelper.DBTestCase):
 			t.values['base_id'] = '123'
 
 
+	def test_task_slots(self):
+		"""Check task fields are stored in slots"""
+
+		t = tasks.Task({ 'rate': 10, 'customer': 'abc' })
+
+		self.assertFalse(hasattr(t, '__dict__'))
+		self.assertEqual(sorted(t.__slots__), tasks.Task.columns())
+
+		self.assertEqual(type(t.rate), long)
+		self.assertEqual(type(t.customer), unicode)
+		self.assertEqual(type(t.time_create), long)
+
+		self.assertNotEqual(t.task_id, tasks.Task().task_id)
+		self.assertEqual(t, tasks.Task(t.values))
+		self.assertEqual(hash(t), hash(tasks.Task(t.values)))
+
+
 	def test_task_creation(self):
 		"""Check add new task to database"""
 
@@ -79,6 +96,62 @@ class Test(unithelper.DBTestCase):
 		self.assertEquals(o1.values, o.values)
 
 
+	def test_task_add_many(self):
+		"""Check add list of tasks to database"""
+
+		objs = [ tasks.Task({ "customer": str(uuid.uuid4()) }) for i in xrange(database.COPY_THRESHOLD) ]
+		objs.append(tasks.Task(objs[0].values))
+
+		errors = tasks.add_many(objs)
+
+		self.assertEquals(errors[:-1], [ None ] * (len(objs) - 1))
+		self.assertTrue(isinstance(errors[-1], ValueError))
+
+		with database.DBConnect(dbtype='local') as db:
+			res = db.find_all('tasks', { 'base_id': [ o.base_id for o in objs ] })
+			queue = db.find_all('queue', { 'id': [ r['queue_id'] for r in res ] })
+
+		self.assertEquals(len(res), len(objs) - 1)
+		self.assertEquals(len(queue), len(objs) - 1)
+
+		# Objects of the caller are not modified.
+		self.assertEquals(objs[0].queue_id, '')
+
+		self.assertTrue(isinstance(tasks.add_many(objs[:1])[0], ValueError))
+
+
+	def test_task_add_many_race(self):
+		"""Check task added after the check is reported by itself"""
+
+		objs = [ tasks.Task({ "customer": str(uuid.uuid4()) }) for i in xrange(3) ]
+		tasks.add(tasks.Task(objs[1].values))
+
+		existing = tasks._existing
+		calls = []
+
+		def check(db, ids):
+			# The first check misses the task added concurrently.
+			calls.append(ids)
+			if len(calls) == 1:
+				return []
+			return existing(db, ids)
+
+		tasks._existing = check
+		try:
+			errors = tasks.add_many(objs)
+		finally:
+			tasks._existing = existing
+
+		self.assertEquals(len(calls), 2)
+		self.assertEquals(errors[0], None)
+		self.assertTrue(isinstance(errors[1], ValueError))
+		self.assertEquals(errors[2], None)
+
+		with database.DBConnect(dbtype='local') as db:
+			res = db.find_all('tasks', { 'base_id': [ o.base_id for o in objs ] })
+		self.assertEquals(len(res), 3)
+
+
 	def test_task_modify(self):
 		"""Testing task modification"""
 
@@ -0,0 +1,78 @@
+import uuid
+
+from unithelper import DBTestCase
+
+from bc import database
+from bc import customers
+from bc import metrics
+from bc import rates
+
+from bc_wapi import wapi_tasks
+
+
+class Test(DBTestCase):
+	def setUp(self):
+		super(Test, self).setUp()
+
+		self.metric = metrics.Metric({
+			'id':        str(uuid.uuid4()),
+			'type':      'unit',
+			'formula':   metrics.constants.FORMULA_UNIT,
+			'aggregate': 0L,
+		})
+		metrics.add(self.metric)
+
+		self.customer = customers.Customer({ 'login': str(uuid.uuid4()), 'tariff_id': str(uuid.uuid4()) })
+
+		with database.DBConnect() as db:
+			db.insert('customers', self.customer.values)
+			db.insert('rates', rates.Rate({
+				'metric_id': self.metric.id,
+				'tariff_id': self.customer.tariff_id,
+				'rate':      7,
+			}).values)
+
+
+	def request(self, customer):
+		return {
+			'type':     self.metric.id,
+			'customer': customer,
+			'value':    1,
+			'user':     'user',
+			'uuid':     str(uuid.uuid4()),
+			'descr':    '',
+		}
+
+
+	def test_task_add_many(self):
+		"""Check adding list of tasks with taskAddMany"""
+
+		reqs = [ self.request(self.customer.id) for i in xrange(3) ]
+		reqs.append(self.request(str(uuid.uuid4())))
+		reqs.append({ 'uuid': str(uuid.uuid4()) })
+		reqs.append(reqs[0])
+
+		res = wapi_tasks.taskAddMany({ 'tasks': [ dict(r) for r in reqs ] })[1]
+
+		self.assertEquals(res['status'], 'ok')
+		self.assertEquals([ r['status'] for r in res['tasks'] ],
+			[ 'ok', 'ok', 'ok', 'ok', 'error', 'error' ])
+		self.assertEquals([ r['id'] for r in res['tasks'][:4] ], [ r['uuid'] for r in reqs[:4] ])
+
+		with database.DBConnect(dbtype='local') as db:
+			found = dict((t['base_id'], t) for t in db.find('tasks'))
+			queue = db.find_all('queue', { 'id': [ t['queue_id'] for t in found.values() ] })
+
+		self.assertEquals(len(found), 4)
+		self.assertEquals(len(queue), 4)
+
+		for r in reqs[:3]:
+			self.assertEquals(found[r['uuid']]['rate'], 7)
+			self.assertNotEquals(found[r['uuid']]['time_create'], 0)
+
+		# Unknown customer: the rate is resolved later.
+		self.assertEquals(found[reqs[3]['uuid']]['rate_id'], '')
+
+		# Tasks which are already added.
+		res = wapi_tasks.taskAddMany({ 'tasks': [ dict(reqs[0]), self.request(self.customer.id) ] })[1]
+		self.assertEquals([ r['status'] for r in res['tasks'] ], [ 'error', 'ok' ])